@@ -1,31 +1,61 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends
+from fastapi import FastAPI, APIRouter, BackgroundTasks, HTTPException, Depends, Header, Request, WebSocket, WebSocketDisconnect
 from fastapi.responses import StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorGridFSBucket
+from bson import ObjectId
+from bson.errors import InvalidId
+from gridfs import errors as gridfs_errors
+from pymongo import ASCENDING, DESCENDING, CursorType, ReturnDocument, UpdateOne
+from pymongo.errors import CollectionInvalid, DuplicateKeyError
+from pymongo.monitoring import ConnectionPoolListener
+from pymongo.read_preferences import Nearest, Primary, PrimaryPreferred, Secondary, SecondaryPreferred
 import os
 import logging
 import json
 import asyncio
+import bisect
+import gzip
+import heapq
+import importlib.util
+import io
+import itertools
+import math
+import random
+import re
+import shutil
+import signal
+import string
+from collections import Counter, OrderedDict, defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager
+from functools import lru_cache
 from pathlib import Path
+from urllib.parse import quote
 from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Tuple
 import uuid
-from datetime import datetime, timedelta
+import hashlib
+import zlib
+import zipfile
+import socket
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
 import httpx
+import numpy as np
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
 import ollama
 from enum import Enum
+from xml.etree import ElementTree
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
-
-# Create the main app
-app = FastAPI(title="MIND14 Virtual Front Desk API", version="1.0.0")
 api_router = APIRouter(prefix="/api")
 
 # Configure logging
@@ -35,6 +65,201 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# MongoDB connection
+class PoolMetricsListener(ConnectionPoolListener):
+    """Connection pool counters: check-outs, time spent waiting for a connection,
+    connections in use and check-out failures.
+
+    The driver reports these events on its worker threads; a check-out starts and
+    finishes on the same thread, which is how the wait time is measured.
+    """
+
+    WAIT_BUCKETS_MS = (1, 5, 10, 50, 100, 500, 1000)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.checkouts = 0
+        self.checkins = 0
+        self.checkout_failures = defaultdict(int)
+        self.connections_created = 0
+        self.connections_closed = 0
+        self.pools_cleared = 0
+        self.peak_in_use = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.wait_histogram = [0] * (len(self.WAIT_BUCKETS_MS) + 1)
+
+    def connection_check_out_started(self, event):
+        self._local.started = time.perf_counter()
+
+    def connection_checked_out(self, event):
+        wait = time.perf_counter() - getattr(self._local, "started", time.perf_counter())
+        with self._lock:
+            self.checkouts += 1
+            self.peak_in_use = max(self.peak_in_use, self.checkouts - self.checkins)
+            self.wait_seconds += wait
+            self.max_wait_seconds = max(self.max_wait_seconds, wait)
+            self.wait_histogram[bisect.bisect_left(self.WAIT_BUCKETS_MS, wait * 1000)] += 1
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            self.checkout_failures[event.reason] += 1
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.checkins += 1
+
+    def connection_created(self, event):
+        with self._lock:
+            self.connections_created += 1
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.connections_closed += 1
+
+    def pool_cleared(self, event):
+        with self._lock:
+            self.pools_cleared += 1
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def snapshot(self, max_pool_size: int = None) -> Dict[str, Any]:
+        with self._lock:
+            in_use = self.checkouts - self.checkins
+            labels = [f"<={bound}ms" for bound in self.WAIT_BUCKETS_MS] + [f">{self.WAIT_BUCKETS_MS[-1]}ms"]
+            return {
+                "checkouts": self.checkouts,
+                "checkout_failures": dict(self.checkout_failures),
+                "in_use": in_use,
+                "peak_in_use": self.peak_in_use,
+                "open_connections": self.connections_created - self.connections_closed,
+                "pools_cleared": self.pools_cleared,
+                "saturation": in_use / max_pool_size if max_pool_size else None,
+                "avg_wait_ms": self.wait_seconds * 1000 / self.checkouts if self.checkouts else 0.0,
+                "max_wait_ms": self.max_wait_seconds * 1000,
+                "wait_histogram": dict(zip(labels, self.wait_histogram))
+            }
+
+class MongoManager:
+    """Owns the Motor client, which is opened and closed by the app lifespan.
+
+    Chat reads and writes use ``db`` (primary). Analytics aggregations use ``analytics``:
+    the same database with its own read preference (secondaries by default), and they
+    pass ``analytics_max_time_ms`` so a heavy query cannot hold a connection for long.
+    """
+
+    READ_PREFERENCES = {
+        "primary": Primary,
+        "primaryPreferred": PrimaryPreferred,
+        "secondary": Secondary,
+        "secondaryPreferred": SecondaryPreferred,
+        "nearest": Nearest
+    }
+    # Wire compressor -> module pymongo needs for it
+    COMPRESSOR_MODULES = {"zstd": "zstandard", "snappy": "snappy", "zlib": "zlib"}
+
+    def __init__(self, url: str, db_name: str, client_options: Dict[str, Any] = None,
+                 analytics_read_preference: str = "secondaryPreferred", analytics_max_staleness: int = -1,
+                 analytics_max_time_ms: int = 5000):
+        self.url = url
+        self.db_name = db_name
+        self.client_options = dict(client_options or {})
+        if "compressors" in self.client_options:
+            self.client_options["compressors"] = self.available_compressors(self.client_options["compressors"])
+        mode = self.READ_PREFERENCES[analytics_read_preference]
+        self.analytics_read_preference = mode() if mode is Primary else mode(max_staleness=analytics_max_staleness)
+        self.analytics_max_time_ms = analytics_max_time_ms
+        self.pool_metrics = PoolMetricsListener()
+        self.client = None
+        self._db = None
+        self.analytics = None
+
+    @classmethod
+    def from_env(cls) -> "MongoManager":
+        env = os.environ
+        return cls(
+            env["MONGO_URL"],
+            env["DB_NAME"],
+            client_options={
+                "maxPoolSize": int(env.get("MONGO_MAX_POOL_SIZE", "100")),
+                "minPoolSize": int(env.get("MONGO_MIN_POOL_SIZE", "0")),
+                "maxIdleTimeMS": int(env.get("MONGO_MAX_IDLE_TIME_MS", "300000")),
+                "waitQueueTimeoutMS": int(env.get("MONGO_WAIT_QUEUE_TIMEOUT_MS", "5000")),
+                "connectTimeoutMS": int(env.get("MONGO_CONNECT_TIMEOUT_MS", "5000")),
+                "serverSelectionTimeoutMS": int(env.get("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000")),
+                "socketTimeoutMS": int(env.get("MONGO_SOCKET_TIMEOUT_MS", "30000")),
+                "compressors": env.get("MONGO_COMPRESSORS", "zstd,snappy,zlib")
+            },
+            analytics_read_preference=env.get("MONGO_ANALYTICS_READ_PREFERENCE", "secondaryPreferred"),
+            analytics_max_staleness=int(env.get("MONGO_ANALYTICS_MAX_STALENESS_SECONDS", "-1")),
+            analytics_max_time_ms=int(env.get("MONGO_ANALYTICS_MAX_TIME_MS", "5000"))
+        )
+
+    @classmethod
+    def available_compressors(cls, names: str) -> List[str]:
+        """Requested compressors whose modules are installed, in preference order"""
+        requested = [name.strip() for name in names.split(",") if name.strip()]
+        available = [
+            name for name in requested
+            if name in cls.COMPRESSOR_MODULES and importlib.util.find_spec(cls.COMPRESSOR_MODULES[name]) is not None
+        ]
+        if len(available) < len(requested):
+            logger.info(f"MongoDB compressors not installed, skipping: {sorted(set(requested) - set(available))}")
+        return available
+
+    @property
+    def db(self):
+        if self._db is None:
+            raise RuntimeError("MongoDB is not connected: it is opened in the app lifespan (or injected with MongoManager.use)")
+        return self._db
+
+    def use(self, database):
+        """Serve from an existing database handle (tests, load tests against mongomock)"""
+        self._db = database
+        self.analytics = database.client.get_database(database.name, read_preference=self.analytics_read_preference)
+        return database
+
+    def connect(self):
+        if self._db is None:
+            self.client = AsyncIOMotorClient(self.url, event_listeners=[self.pool_metrics], **self.client_options)
+            self.use(self.client[self.db_name])
+            logger.info(
+                f"MongoDB client created: pool {self.client_options.get('minPoolSize')}-{self.client_options.get('maxPoolSize')}, "
+                f"compressors {self.client_options.get('compressors')}, analytics reads {self.analytics_read_preference.mongos_mode}"
+            )
+        return self._db
+
+    def close(self):
+        if self.client is not None:
+            self.client.close()
+            self.client = None
+            self._db = None
+            self.analytics = None
+
+    def stats(self) -> Dict[str, Any]:
+        max_pool_size = self.client_options.get("maxPoolSize")
+        return {
+            "connected": self.client is not None,
+            "database": self.db_name,
+            "options": self.client_options,
+            "analytics_read_preference": self.analytics_read_preference.mongos_mode,
+            "analytics_max_time_ms": self.analytics_max_time_ms,
+            "pool": self.pool_metrics.snapshot(max_pool_size)
+        }
+
+mongo = MongoManager.from_env()
+
 # Enums
 class ConversationStatus(str, Enum):
     ACTIVE = "active"
@@ -61,7 +286,8 @@ class Message(BaseModel):
     language: str = "en"
     intent: Optional[str] = None
     confidence: Optional[float] = None
-    attachments: List[str] = []
+    attachments: List[str] = []  # attachment ids from POST /api/attachments
+    metadata: Dict[str, Any] = {}
 
 class ServiceInfo(BaseModel):
     id: str
@@ -82,6 +308,21 @@ class SessionData(BaseModel):
     confidence: float = 0.0
     booking_step: Optional[str] = None
     appointment_id: Optional[str] = None
+    conversation_id: Optional[str] = None
+    offered_slots: List[str] = []  # slot ids offered at the datetime step, in display order
+    slot_id: Optional[str] = None
+    state_entered_at: Optional[datetime] = None  # when the current flow state was entered
+
+class ConversationSummary(BaseModel):
+    """Rolling, bounded summary of a conversation, see ConversationSummarizer"""
+    text: str = ""
+    facts: Dict[str, Any] = {}
+    topics: List[str] = []  # intents discussed, oldest first, without repeats
+    first_request: Optional[str] = None
+    last_request: Optional[str] = None
+    documents: int = 0
+    covered_messages: int = 0  # messages[:covered_messages] are folded in
+    updated_at: Optional[datetime] = None
 
 class Conversation(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -92,9 +333,11 @@ class Conversation(BaseModel):
     language: str = "en"
     messages: List[Message] = []
     session_data: SessionData = Field(default_factory=SessionData)
+    summary: ConversationSummary = Field(default_factory=ConversationSummary)
     user_id: str
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
+    version: int = 0  # bumped by every saved turn, see ConversationConcurrency
 
 class User(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -109,7 +352,7 @@ class ChatRequest(BaseModel):
     message: str
     conversation_id: Optional[str] = None
     language: str = "en"
-    attachments: List[str] = []
+    attachments: List[str] = []  # attachment ids from POST /api/attachments
 
 class ChatResponse(BaseModel):
     message: str
@@ -119,6 +362,10 @@ class ChatResponse(BaseModel):
     session_data: SessionData
     actions: List[str] = []
 
+class IntentBatchRequest(BaseModel):
+    messages: List[str]
+    language: Optional[str] = None  # None: detect per message
+
 class BookingData(BaseModel):
     appointment_id: str
     service: ServiceInfo
@@ -170,6 +417,19 @@ class BookingData(BaseModel):
     session_duration_seconds: Optional[float] = None
     user_satisfaction_score: Optional[float] = None
 
+class AutomationEventReport(BaseModel):
+    type: str  # one of REPORTED_EVENT_TYPES
+    message: str
+    status: str = "success"  # success, error
+    appointment_id: Optional[str] = None
+    workflow: Optional[str] = None
+    details: Dict[str, Any] = {}
+
+class ReminderSentReport(BaseModel):
+    reminder_type: Optional[str] = None  # e.g. 24h, 2h
+    sent_via: Optional[str] = None  # comma separated channels
+    sent_at: Optional[str] = None
+
 # Available Services Configuration
 AVAILABLE_SERVICES = [
     ServiceInfo(
@@ -229,25 +489,2555 @@ AVAILABLE_SERVICES = [
     )
 ]
 
+# Appointment ID Generation
+class AppointmentIdGenerator:
+    """Snowflake-style appointment ids that are unique across workers and sortable by time.
+
+    Layout (70 bits): 42-bit millisecond timestamp since ``EPOCH_MS`` | 16-bit worker id |
+    12-bit per-millisecond sequence, rendered as fixed-width Crockford base32 after an
+    ``APT`` prefix (e.g. ``APT01J5Z3K7Q8M2XA``). Fixed width keeps string order equal to
+    numeric order, and Crockford's alphabet avoids the easily confused I/L/O/U.
+    """
+
+    EPOCH_MS = 1704067200000  # 2024-01-01T00:00:00Z
+    WORKER_BITS = 16
+    SEQUENCE_BITS = 12
+    MAX_WORKER_ID = (1 << WORKER_BITS) - 1
+    MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+    ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+    ENCODED_LENGTH = 14
+    PREFIX = "APT"
+
+    def __init__(self, worker_id: Optional[int] = None, clock=None):
+        self._clock = clock or (lambda: int(time.time() * 1000))
+        self._explicit_worker_id = worker_id
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        """(Re)derive the worker id and clear sequence state, e.g. in a freshly forked worker"""
+        self.worker_id = self._derive_worker_id(self._explicit_worker_id)
+        self._last_timestamp = -1
+        self._sequence = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def _derive_worker_id(cls, worker_id: Optional[int]) -> int:
+        if worker_id is None and os.environ.get("APPOINTMENT_WORKER_ID"):
+            worker_id = int(os.environ["APPOINTMENT_WORKER_ID"])
+        if worker_id is not None:
+            if not 0 <= worker_id <= cls.MAX_WORKER_ID:
+                raise ValueError(f"worker_id must be between 0 and {cls.MAX_WORKER_ID}")
+            return worker_id
+        # Derive a stable id from host and process so every uvicorn/gunicorn worker differs
+        seed = f"{socket.gethostname()}:{os.getpid()}".encode()
+        return int.from_bytes(hashlib.blake2b(seed, digest_size=2).digest(), "big")
+
+    def next_int(self) -> int:
+        """Return the next raw 70-bit id; strictly increasing within this process"""
+        with self._lock:
+            timestamp = self._clock() - self.EPOCH_MS
+            if timestamp <= self._last_timestamp:
+                # Same millisecond or clock moved backwards: keep counting from the last
+                # timestamp, borrowing the next millisecond when the sequence is exhausted
+                timestamp = self._last_timestamp
+                self._sequence += 1
+                if self._sequence > self.MAX_SEQUENCE:
+                    timestamp += 1
+                    self._sequence = 0
+            else:
+                self._sequence = 0
+            self._last_timestamp = timestamp
+
+            return (
+                (timestamp << (self.WORKER_BITS + self.SEQUENCE_BITS))
+                | (self.worker_id << self.SEQUENCE_BITS)
+                | self._sequence
+            )
+
+    @classmethod
+    def encode(cls, value: int) -> str:
+        chars = []
+        for _ in range(cls.ENCODED_LENGTH):
+            chars.append(cls.ALPHABET[value & 31])
+            value >>= 5
+        return cls.PREFIX + "".join(reversed(chars))
+
+    @classmethod
+    def decode(cls, appointment_id: str) -> Dict[str, Any]:
+        """Split an appointment id back into its timestamp, worker id and sequence"""
+        if not appointment_id.startswith(cls.PREFIX) or len(appointment_id) != len(cls.PREFIX) + cls.ENCODED_LENGTH:
+            raise ValueError(f"Not a generated appointment id: {appointment_id}")
+        value = 0
+        for char in appointment_id[len(cls.PREFIX):]:
+            value = (value << 5) | cls.ALPHABET.index(char)
+        timestamp_ms = (value >> (cls.WORKER_BITS + cls.SEQUENCE_BITS)) + cls.EPOCH_MS
+        return {
+            "timestamp": datetime.utcfromtimestamp(timestamp_ms / 1000),
+            "worker_id": (value >> cls.SEQUENCE_BITS) & cls.MAX_WORKER_ID,
+            "sequence": value & cls.MAX_SEQUENCE
+        }
+
+    def next_id(self) -> str:
+        """Return the next APT-prefixed appointment id"""
+        return self.encode(self.next_int())
+
+appointment_id_generator = AppointmentIdGenerator()
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=appointment_id_generator._reset)
+
+# Slot Inventory
+BOOKING_TIMEZONE = ZoneInfo(os.environ.get("BOOKING_TIMEZONE", "UTC"))
+
+class SlotEngine:
+    """Bookable slot inventory kept in the ``appointments`` collection.
+
+    Slots are precomputed per service from ``working_hours``, ``available_days`` and
+    ``estimated_time`` (working hours are local to ``BOOKING_TIMEZONE``; ``start``/``end``
+    are stored as naive UTC like the rest of the database). Each slot document doubles as
+    the appointment record once reserved, and reservation is a single conditional update
+    on ``status: "available"``, so two concurrent requests can never both win a slot.
+    """
+
+    WEEKDAYS = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+    # Same default as BookingData.follow_up_config["reminder_hours_before"]
+    REMINDER_HOURS_BEFORE = (24, 2)
+    STOP_REMINDERS = {"next_reminder_at": "", "reminder_lease_owner": "", "reminder_lease_until": ""}
+    DAY_LABELS = {
+        "en": ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"],
+        "ar": ["الاثنين", "الثلاثاء", "الأربعاء", "الخميس", "الجمعة", "السبت", "الأحد"]
+    }
+
+    def __init__(self, services: List[ServiceInfo], database=None, horizon_days: int = None, tz: ZoneInfo = None):
+        self.services = {s.id: s for s in services}
+        self.horizon_days = horizon_days or int(os.environ.get("SLOT_HORIZON_DAYS", "14"))
+        self.tz = tz or BOOKING_TIMEZONE
+        self._database = database
+
+    @property
+    def collection(self):
+        return (self._database if self._database is not None else mongo.db).appointments
+
+    @staticmethod
+    def slot_id(service_id: str, start: datetime) -> str:
+        return f"{service_id}@{start.strftime('%Y%m%dT%H%M')}"
+
+    @staticmethod
+    def is_slot_id(slot_id: str) -> bool:
+        """True for inventory slot ids, False for unslotted records (``<service>#<appointment>``)"""
+        return "@" in slot_id and "#" not in slot_id
+
+    @staticmethod
+    def slot_start(slot_id: str) -> datetime:
+        """Inverse of ``slot_id``: the slot's start (naive UTC)"""
+        if not SlotEngine.is_slot_id(slot_id):
+            raise ValueError(f"Not an inventory slot id: {slot_id!r}")
+        return datetime.strptime(slot_id.rsplit("@", 1)[1], "%Y%m%dT%H%M")
+
+    def to_utc(self, local_dt: datetime) -> datetime:
+        """Convert a local (naive or aware) datetime to the naive UTC form stored in Mongo"""
+        if local_dt.tzinfo is None:
+            local_dt = local_dt.replace(tzinfo=self.tz)
+        return local_dt.astimezone(timezone.utc).replace(tzinfo=None)
+
+    def to_local(self, utc_dt: datetime) -> datetime:
+        return utc_dt.replace(tzinfo=timezone.utc).astimezone(self.tz)
+
+    def generate_slots(self, service: ServiceInfo, start_date, days: int, now: datetime = None) -> List[Dict[str, Any]]:
+        """Enumerate future slots for one service over ``days`` local days from ``start_date``"""
+        if not service.requires_appointment:
+            return []
+
+        now = now or datetime.utcnow()
+        open_at = datetime.strptime(service.working_hours["start"], "%H:%M").time()
+        close_at = datetime.strptime(service.working_hours["end"], "%H:%M").time()
+        length = timedelta(minutes=service.estimated_time)
+        open_days = set(service.available_days)
+
+        slots = []
+        for offset in range(days):
+            day = start_date + timedelta(days=offset)
+            if self.WEEKDAYS[day.weekday()] not in open_days:
+                continue
+
+            local_start = datetime.combine(day, open_at)
+            local_close = datetime.combine(day, close_at)
+            while local_start + length <= local_close:
+                start = self.to_utc(local_start)
+                if start > now:
+                    slots.append({
+                        "_id": self.slot_id(service.id, start),
+                        "service_id": service.id,
+                        "start": start,
+                        "end": start + length,
+                        "status": "available",
+                        "appointment_id": None
+                    })
+                local_start += length
+
+        return slots
+
+    async def ensure_indexes(self):
+        await self.collection.create_index(
+            [("service_id", ASCENDING), ("status", ASCENDING), ("start", ASCENDING)],
+            name="service_status_start"
+        )
+        await self.collection.create_index("appointment_id", name="appointment_id", sparse=True)
+        # Only appointments with a reminder still to send are indexed, so the hourly
+        # due-reminders poll reads O(due reminders) entries
+        await self.collection.create_index(
+            [("next_reminder_at", ASCENDING), ("_id", ASCENDING)],
+            name="next_reminder_at",
+            partialFilterExpression={"next_reminder_at": {"$exists": True}}
+        )
+
+    async def materialize(self, now: datetime = None) -> int:
+        """Upsert slots up to the horizon; existing (possibly reserved) slots are left untouched"""
+        now = now or datetime.utcnow()
+        today = self.to_local(now).date()
+
+        operations = [
+            UpdateOne({"_id": slot["_id"]}, {"$setOnInsert": slot}, upsert=True)
+            for service in self.services.values()
+            for slot in self.generate_slots(service, today, self.horizon_days, now)
+        ]
+        if not operations:
+            return 0
+
+        result = await self.collection.bulk_write(operations, ordered=False)
+        logger.info(f"Slot inventory refreshed: {result.upserted_count} new slots over {self.horizon_days} days")
+        return result.upserted_count
+
+    async def run_refresh_loop(self, interval_seconds: float = None):
+        """Keep the horizon rolling forward; started once per worker on startup"""
+        interval_seconds = interval_seconds or float(os.environ.get("SLOT_REFRESH_INTERVAL_SECONDS", "21600"))
+        while True:
+            await asyncio.sleep(interval_seconds)
+            try:
+                await self.materialize()
+            except Exception as e:
+                logger.error(f"Slot inventory refresh failed: {e}")
+
+    def has_inventory(self, service_id: Optional[str]) -> bool:
+        service = self.services.get(service_id)
+        return bool(service and service.requires_appointment)
+
+    async def find_nearest(self, service_id: str, after: datetime = None, limit: int = 3) -> List[Dict[str, Any]]:
+        """Nearest free slots for a service - a single query on the service/status/start index"""
+        now = datetime.utcnow()
+        after = max(after, now) if after else now
+        cursor = self.collection.find(
+            {"service_id": service_id, "status": "available", "start": {"$gt": after}}
+        ).sort("start", ASCENDING).limit(limit)
+        return await cursor.to_list(limit)
+
+    async def find_slot_at(self, service_id: str, start: datetime) -> Optional[Dict[str, Any]]:
+        """The free slot starting exactly at ``start`` (naive UTC), if any"""
+        return await self.collection.find_one({"service_id": service_id, "status": "available", "start": start})
+
+    async def reserve(self, slot_id: str, appointment_id: str, conversation_id: Optional[str] = None,
+                      customer_info: Dict[str, Any] = None, language: str = "en",
+                      notification_preferences: Dict[str, bool] = None,
+                      reminder_hours_before: List[float] = None) -> Optional[Dict[str, Any]]:
+        """Atomically claim a slot; returns the reserved document, or None if it was already taken"""
+        if not self.is_slot_id(slot_id):
+            return None
+        now = datetime.utcnow()
+        return await self.collection.find_one_and_update(
+            {"_id": slot_id, "status": "available", "start": {"$gt": now}, "end": {"$ne": None}},
+            {"$set": {
+                "status": "reserved",
+                "appointment_id": appointment_id,
+                "conversation_id": conversation_id,
+                "customer_info": customer_info or {},
+                "language": language,
+                "notification_preferences": notification_preferences or {},
+                "reminder_hours_before": list(reminder_hours_before or self.REMINDER_HOURS_BEFORE),
+                "reserved_at": now,
+                **self.reminder_schedule(self.slot_start(slot_id), reminder_hours_before or self.REMINDER_HOURS_BEFORE, now)
+            }},
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def record_unslotted(self, appointment_id: str, service_id: Optional[str], start: datetime,
+                               conversation_id: Optional[str] = None, customer_info: Dict[str, Any] = None,
+                               language: str = "en", notification_preferences: Dict[str, bool] = None,
+                               reminder_hours_before: List[float] = None) -> Dict[str, Any]:
+        """Store an appointment booked without inventory (free-text time) so it still gets reminders"""
+        now = datetime.utcnow()
+        appointment = {
+            "_id": f"{service_id}#{appointment_id}",
+            "service_id": service_id,
+            "start": start,
+            "end": None,
+            "status": "reserved",
+            "appointment_id": appointment_id,
+            "conversation_id": conversation_id,
+            "customer_info": customer_info or {},
+            "language": language,
+            "notification_preferences": notification_preferences or {},
+            "reminder_hours_before": list(reminder_hours_before or self.REMINDER_HOURS_BEFORE),
+            "reserved_at": now,
+            **self.reminder_schedule(start, reminder_hours_before or self.REMINDER_HOURS_BEFORE, now)
+        }
+        await self.collection.insert_one(appointment)
+        return appointment
+
+    async def release(self, appointment_id: str) -> bool:
+        """Return a reserved slot to the pool, e.g. after a cancellation.
+
+        Unslotted records (see ``record_unslotted``) are not inventory: they are marked
+        ``cancelled`` instead, so they can never be offered as a free slot.
+        """
+        if await self._free_slot({"appointment_id": appointment_id, "status": "reserved", "end": {"$ne": None}}):
+            return True
+        result = await self.collection.update_one(
+            {"appointment_id": appointment_id, "status": "reserved", "end": None},
+            {"$set": {"status": "cancelled", "cancelled_at": datetime.utcnow(), "reminders_pending": []},
+             "$unset": self.STOP_REMINDERS}
+        )
+        return result.modified_count == 1
+
+    async def _free_slot(self, query: Dict[str, Any]) -> bool:
+        """Put the reserved inventory slot matching ``query`` back to ``available``"""
+        result = await self.collection.update_one(
+            query,
+            {"$set": {"status": "available", "appointment_id": None, "conversation_id": None,
+                      "customer_info": None, "reserved_at": None, "reminders_pending": []},
+             "$unset": self.STOP_REMINDERS}
+        )
+        return result.modified_count == 1
+
+    @staticmethod
+    def reminder_schedule(start: datetime, hours_before, now: datetime) -> Dict[str, Any]:
+        """Reminder fields for an appointment: the offsets (hours before ``start``) still ahead
+        of ``now``, largest first, and ``next_reminder_at`` for the first of them.
+        Without a pending reminder ``next_reminder_at`` is absent (and out of its index)."""
+        pending = sorted((h for h in hours_before if start - timedelta(hours=h) > now), reverse=True)
+        schedule = {"reminders_pending": pending}
+        if pending:
+            schedule["next_reminder_at"] = start - timedelta(hours=pending[0])
+        return schedule
+
+    async def due_reminders(self, now: datetime = None, limit: int = 100, after: str = None) -> Dict[str, Any]:
+        """Reserved appointments whose next reminder is due, oldest first, one page at a time.
+
+        ``after`` is the ``next_cursor`` of the previous page (keyset paging on the
+        ``next_reminder_at`` index).
+        """
+        now = now or datetime.utcnow()
+        query = {
+            "status": "reserved",
+            "next_reminder_at": {"$lte": now},
+            "start": {"$gt": now},
+            "reminder_lease_until": {"$not": {"$gt": now}}  # not being sent by a ReminderScheduler
+        }
+        if after:
+            due_at, _, last_id = after.partition("|")
+            due_at = datetime.fromisoformat(due_at)
+            query["$or"] = [
+                {"next_reminder_at": {"$gt": due_at}},
+                {"next_reminder_at": due_at, "_id": {"$gt": last_id}}
+            ]
+        appointments = await self.collection.find(query).sort(
+            [("next_reminder_at", ASCENDING), ("_id", ASCENDING)]
+        ).limit(limit).to_list(limit)
+
+        next_cursor = None
+        if len(appointments) == limit:
+            last = appointments[-1]
+            next_cursor = f"{last['next_reminder_at'].isoformat()}|{last['_id']}"
+        return {"appointments": appointments, "next_cursor": next_cursor}
+
+    async def mark_reminder_sent(self, appointment_id: str, reminder: Dict[str, Any] = None, now: datetime = None,
+                                 attempts: int = 3) -> Optional[Tuple[Dict[str, Any], bool]]:
+        """Advance ``next_reminder_at`` past the reminder that was just sent.
+
+        Compare-and-set on the current ``next_reminder_at``: of two concurrent reports for
+        the same reminder only one advances the schedule, and a repeated report for a
+        reminder that is no longer due changes nothing. Returns ``(appointment, advanced)``,
+        or None for an unknown appointment.
+        """
+        now = now or datetime.utcnow()
+        for _ in range(attempts):
+            appointment = await self.collection.find_one({"appointment_id": appointment_id, "status": "reserved"})
+            if not appointment:
+                return None
+            due_at = appointment.get("next_reminder_at")
+            if due_at is None or due_at > now:
+                return appointment, False
+
+            start = appointment["start"]
+            remaining = [h for h in appointment.get("reminders_pending", [])[1:] if start - timedelta(hours=h) > now]
+            update = {
+                "$set": {"reminders_pending": remaining},
+                "$push": {"reminders_sent": {**(reminder or {}), "due_at": due_at, "recorded_at": now}},
+                "$unset": {"reminder_lease_owner": "", "reminder_lease_until": ""}
+            }
+            if remaining:
+                update["$set"]["next_reminder_at"] = start - timedelta(hours=remaining[0])
+            else:
+                update["$unset"]["next_reminder_at"] = ""
+
+            advanced = await self.collection.find_one_and_update(
+                {"_id": appointment["_id"], "next_reminder_at": due_at},
+                update,
+                return_document=ReturnDocument.AFTER
+            )
+            if advanced:
+                return advanced, True
+        return await self.collection.find_one({"appointment_id": appointment_id}), False
+
+    async def claim_reminder(self, appointment_id: str, owner: str, lease_seconds: float,
+                             now: datetime = None) -> Optional[Dict[str, Any]]:
+        """Lease an appointment's due reminder to ``owner`` so only one worker sends it.
+
+        Fails (None) if no reminder is due, or another owner holds an unexpired lease.
+        """
+        now = now or datetime.utcnow()
+        return await self.collection.find_one_and_update(
+            {
+                "appointment_id": appointment_id,
+                "status": "reserved",
+                "next_reminder_at": {"$lte": now},
+                "$or": [
+                    {"reminder_lease_until": {"$not": {"$gt": now}}},
+                    {"reminder_lease_owner": owner}
+                ]
+            },
+            {"$set": {"reminder_lease_owner": owner, "reminder_lease_until": now + timedelta(seconds=lease_seconds)}},
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def reschedule(self, appointment_id: str, start: datetime,
+                         now: datetime = None) -> Optional[Tuple[Dict[str, Any], bool]]:
+        """Move an appointment to ``start`` (naive UTC) and rebuild its reminder schedule.
+
+        A booking on an inventory slot moves to the free slot starting at ``start``: that
+        slot is reserved first (the same conditional update as a new booking), then the old
+        one goes back to the pool. Only unslotted records have ``start`` rewritten in place.
+        Returns ``(appointment, moved)``; ``moved`` is False, and nothing changes, when no
+        free slot starts at ``start``. None for an unknown appointment.
+        """
+        now = now or datetime.utcnow()
+        appointment = await self.collection.find_one({"appointment_id": appointment_id, "status": "reserved"})
+        if not appointment:
+            return None
+
+        hours_before = appointment.get("reminder_hours_before") or self.REMINDER_HOURS_BEFORE
+        if self.is_slot_id(appointment["_id"]):
+            if appointment["start"] == start:
+                return appointment, True
+            slot = await self.find_slot_at(appointment["service_id"], start)
+            moved = slot and await self.reserve(
+                slot["_id"], appointment_id,
+                conversation_id=appointment.get("conversation_id"),
+                customer_info=appointment.get("customer_info"),
+                language=appointment.get("language", "en"),
+                notification_preferences=appointment.get("notification_preferences"),
+                reminder_hours_before=hours_before
+            )
+            if not moved:
+                return appointment, False
+            await self._free_slot({"_id": appointment["_id"], "appointment_id": appointment_id, "status": "reserved"})
+            return moved, True
+
+        schedule = self.reminder_schedule(start, hours_before, now)
+        update = {
+            "$set": {"start": start, "reminders_pending": schedule["reminders_pending"]},
+            "$unset": {"reminder_lease_owner": "", "reminder_lease_until": ""}
+        }
+        if "next_reminder_at" in schedule:
+            update["$set"]["next_reminder_at"] = schedule["next_reminder_at"]
+        else:
+            update["$unset"]["next_reminder_at"] = ""
+        moved = await self.collection.find_one_and_update(
+            {"_id": appointment["_id"]}, update, return_document=ReturnDocument.AFTER
+        )
+        return moved, True
+
+    @staticmethod
+    def booking_location(service: Optional[ServiceInfo]) -> Dict[str, str]:
+        """Where a booking for ``service`` takes place: the service centre, or the virtual desk"""
+        if service and service.requires_appointment:
+            return {"type": "office", "address": "MIND14 Service Center", "meeting_link": "",
+                    "room_number": f"Room {service.icon}"}
+        return {"type": "virtual", "address": "Virtual Front Desk",
+                "meeting_link": "https://meet.mind14.com/virtual-desk", "room_number": ""}
+
+    def reminder_view(self, appointment: Dict[str, Any]) -> Dict[str, Any]:
+        """The reminder fields the n8n reminder workflow works from (it reads ``service.name``
+        and ``location.address`` to build the messages)"""
+        service = self.services.get(appointment.get("service_id"))
+        return {
+            "appointment_id": appointment["appointment_id"],
+            "service_id": appointment.get("service_id"),
+            "service": service.dict() if service else None,
+            "location": self.booking_location(service),
+            "scheduled_datetime": appointment["start"].replace(tzinfo=timezone.utc).isoformat(),
+            "language": appointment.get("language", "en"),
+            "customer_info": appointment.get("customer_info") or {},
+            "notification_preferences": appointment.get("notification_preferences") or {},
+            "conversation_id": appointment.get("conversation_id"),
+            "reminder_due_at": appointment["next_reminder_at"].replace(tzinfo=timezone.utc).isoformat(),
+            "reminder_hours_before": appointment["reminders_pending"][0]
+        }
+
+    def format_slot(self, slot: Dict[str, Any], language: str) -> str:
+        local_start = self.to_local(slot["start"])
+        day = self.DAY_LABELS.get(language, self.DAY_LABELS["en"])[local_start.weekday()]
+        if language == "ar":
+            return f"{day} {local_start.strftime('%d/%m/%Y')} الساعة {local_start.strftime('%H:%M')}"
+        return f"{day} {local_start.strftime('%d %b %Y')} at {local_start.strftime('%H:%M')}"
+
+    def format_offer(self, slots: List[Dict[str, Any]], language: str) -> str:
+        return "\n".join(f"{index}. {self.format_slot(slot, language)}" for index, slot in enumerate(slots, 1))
+
+slot_engine = SlotEngine(AVAILABLE_SERVICES)
+
+# Text Normalization
+# One str.translate pass: alef/yaa/taa-marbuta folding, harakat and tatweel removal and
+# Arabic-Indic digits to ASCII; then lowercase and whitespace collapse. Every keyword
+# table is stored in this form, so spelling variants need not be listed by hand.
+_NORMALIZATION_TABLE = str.maketrans({
+    **{char: "ا" for char in "أإآٱ"},
+    "ى": "ي",
+    "ة": "ه",
+    **{chr(code): None for code in [0x0640, *range(0x064B, 0x0660), 0x0670]},
+    **{digit: str(value % 10) for value, digit in enumerate("٠١٢٣٤٥٦٧٨٩۰۱۲۳۴۵۶۷۸۹")}
+})
+
+def normalize_text(text: str) -> str:
+    """Canonical form of a message for keyword matching, model features and cache keys"""
+    return " ".join(text.translate(_NORMALIZATION_TABLE).lower().split())
+
+def normalized_terms(terms) -> tuple:
+    """Normalize a keyword list, dropping variants that collapse to the same form"""
+    return tuple(dict.fromkeys(normalize_text(term) for term in terms))
+
+def normalized_keys(mapping: Dict[str, Any]) -> Dict[str, Any]:
+    return {normalize_text(key): value for key, value in mapping.items()}
+
+# Language Detection
+SUPPORTED_LANGUAGES = ("en", "ar")
+
+class LanguageDetector:
+    """Per-message language detection from Unicode script ranges.
+
+    Counts Arabic-script and Latin letters (one regex scan each), so it costs a few
+    microseconds. Text without letters (phone numbers, slot numbers, emoji) keeps the
+    fallback language, normally the conversation's. Input where the minority script
+    reaches ``mixed_threshold`` of the letters is flagged as mixed, and the classifier
+    then scores both languages' pattern tables.
+
+    A conversation only switches language on a clear message (see ``conversation_language``):
+    names, phone numbers and one-word replies say little about the language the customer
+    wants to be answered in.
+    """
+
+    ARABIC = re.compile(r"[\u0621-\u064A\u066E-\u06D3\u06FA-\u06FF\u0750-\u077F\u08A0-\u08FF\uFB50-\uFDFF\uFE70-\uFEFC]+")
+    LATIN = re.compile(r"[A-Za-z\u00C0-\u024F]+")
+
+    def __init__(self, mixed_threshold: float = 0.2, min_switch_letters: int = None):
+        self.mixed_threshold = mixed_threshold
+        self.min_switch_letters = min_switch_letters or int(os.environ.get("LANGUAGE_SWITCH_MIN_LETTERS", "12"))
+
+    def detect(self, text: str, fallback: str = "en") -> Dict[str, Any]:
+        fallback = fallback if fallback in SUPPORTED_LANGUAGES else "en"
+        arabic = sum(map(len, self.ARABIC.findall(text)))
+        latin = sum(map(len, self.LATIN.findall(text)))
+        if not arabic + latin:
+            return {"language": fallback, "method": "fallback", "arabic_ratio": None, "mixed": False, "letters": 0}
+
+        ratio = arabic / (arabic + latin)
+        language = "ar" if ratio > 0.5 else "en" if ratio < 0.5 else fallback
+        return {
+            "language": language,
+            "method": "script",
+            "arabic_ratio": round(ratio, 3),
+            "mixed": min(ratio, 1 - ratio) >= self.mixed_threshold,
+            "letters": arabic + latin
+        }
+
+    def conversation_language(self, detection: Dict[str, Any], current: Optional[str], free_text: bool = True) -> str:
+        """Language to answer in after this message: the established one unless the message clearly switches"""
+        if current not in SUPPORTED_LANGUAGES or detection["language"] == current:
+            return detection["language"]
+        if not free_text or detection["mixed"] or detection["letters"] < self.min_switch_letters:
+            return current
+        return detection["language"]
+
+language_detector = LanguageDetector()
+
+# Natural-Language Date/Time Parsing
+class ParsedDateTime(BaseModel):
+    value: datetime  # timezone-aware, in the parser's timezone
+    has_date: bool
+    has_time: bool
+
+    @property
+    def iso(self) -> str:
+        return self.value.isoformat()
+
+    @property
+    def utc(self) -> datetime:
+        """Naive UTC form, matching how datetimes are stored in Mongo"""
+        return self.value.astimezone(timezone.utc).replace(tzinfo=None)
+
+class DateTimeParser:
+    """Fast bilingual (English/Arabic) date/time parser for booking input.
+
+    All grammars are compiled once at construction. Relative expressions ("tomorrow",
+    "next sunday", "غداً", "بعد ٣ أيام") are resolved against ``now`` in the configured
+    timezone through a per-day precomputed calendar, so a parse is a handful of regex
+    scans plus dict lookups. Hours 1-7 without am/pm are read as afternoon, matching
+    office hours ("at 3" / "الساعة ٣" means 15:00).
+    """
+
+    # Tables are stored normalized (see normalize_text), so hamza/taa-marbuta spellings match
+    MONTHS = normalized_keys({
+        "january": 1, "jan": 1, "february": 2, "feb": 2, "march": 3, "mar": 3, "april": 4, "apr": 4,
+        "may": 5, "june": 6, "jun": 6, "july": 7, "jul": 7, "august": 8, "aug": 8,
+        "september": 9, "sep": 9, "sept": 9, "october": 10, "oct": 10, "november": 11, "nov": 11,
+        "december": 12, "dec": 12,
+        "يناير": 1, "فبراير": 2, "مارس": 3, "أبريل": 4, "مايو": 5, "يونيو": 6, "يوليو": 7, "أغسطس": 8,
+        "سبتمبر": 9, "أكتوبر": 10, "نوفمبر": 11, "ديسمبر": 12, "كانون الثاني": 1, "شباط": 2, "آذار": 3,
+        "نيسان": 4, "أيار": 5, "حزيران": 6, "تموز": 7, "آب": 8, "أيلول": 9, "تشرين الأول": 10,
+        "تشرين الثاني": 11, "كانون الأول": 12
+    })
+    WEEKDAYS = normalized_keys({
+        "monday": 0, "mon": 0, "tuesday": 1, "tue": 1, "tues": 1, "wednesday": 2, "wed": 2,
+        "thursday": 3, "thu": 3, "thurs": 3, "friday": 4, "fri": 4, "saturday": 5, "sat": 5,
+        "sunday": 6, "sun": 6,
+        "الاثنين": 0, "اثنين": 0, "الثلاثاء": 1, "ثلاثاء": 1, "الأربعاء": 2, "أربعاء": 2, "الخميس": 3,
+        "خميس": 3, "الجمعة": 4, "جمعة": 4, "السبت": 5, "سبت": 5, "الأحد": 6, "أحد": 6
+    })
+    RELATIVE_DAYS = normalized_keys({
+        "today": 0, "tonight": 0, "tomorrow": 1, "day after tomorrow": 2,
+        "اليوم": 0, "الليلة": 0, "غدا": 1, "بكرة": 1, "بعد غد": 2, "بعد الغد": 2, "بعد بكرة": 2
+    })
+    PERIODS = normalized_keys({
+        "morning": 9, "noon": 12, "midday": 12, "afternoon": 14, "evening": 18, "tonight": 19, "night": 20,
+        "صباحا": 9, "الصباح": 9, "الصبح": 9, "ظهرا": 12, "الظهر": 12, "العصر": 15, "بعد الظهر": 14,
+        "مساء": 18, "مساءا": 18, "المساء": 18, "الليلة": 19, "ليلا": 20
+    })
+    AM_WORDS = set(normalized_terms(["am", "a.m.", "a.m", "ص", "صباحا", "الصباح", "الصبح", "صباح"]))
+    PM_WORDS = set(normalized_terms(["pm", "p.m.", "p.m", "م", "مساء", "مساءا", "المساء", "ظهرا", "الظهر",
+                                     "العصر", "بعد الظهر", "ليلا"]))
+
+    def __init__(self, tz: ZoneInfo = None, day_first: bool = True):
+        self.tz = tz or BOOKING_TIMEZONE
+        self.day_first = day_first
+
+        def alternation(words):
+            return "|".join(re.escape(w) for w in sorted(words, key=len, reverse=True))
+
+        months = alternation(self.MONTHS)
+        weekdays = alternation(self.WEEKDAYS)
+        meridiem = alternation(self.AM_WORDS | self.PM_WORDS)
+        ordinal = r"(?:st|nd|rd|th)?"
+
+        self._iso = re.compile(r"\b(\d{4})-(\d{1,2})-(\d{1,2})(?:[t\s]+(\d{1,2}):(\d{2}))?")
+        self._numeric_date = re.compile(r"\b(\d{1,2})[/.\-](\d{1,2})(?:[/.\-](\d{2,4}))?\b")
+        self._day_month = re.compile(rf"\b(\d{{1,2}}){ordinal}\s+(?:of\s+)?({months})(?:,?\s+(\d{{4}}))?(?!\w)")
+        self._month_day = re.compile(rf"(?<!\w)({months})\s+(\d{{1,2}}){ordinal}\b(?:,?\s+(\d{{4}}))?")
+        self._relative = re.compile(rf"(?<!\w)({alternation(self.RELATIVE_DAYS)})(?!\w)")
+        self._in_days = re.compile(r"(?:\bin\s+(\d{1,2})\s+days?\b|بعد\s+(\d{1,2})\s+(?:ايام|يوم))")
+        self._next_week = re.compile(r"\bnext\s+week\b|الاسبوع\s+القادم")
+        self._weekday = re.compile(rf"(?<!\w)({weekdays})(?!\w)")
+        self._clock = re.compile(rf"\b(\d{{1,2}}):(\d{{2}})\s*({meridiem})?(?!\w)")
+        self._hour_meridiem = re.compile(rf"\b(\d{{1,2}})\s*({meridiem})(?!\w)")
+        self._at_hour = re.compile(r"(?:\bat|@|الساعه|ساعه)\s*(\d{1,2})(?!\d)")
+        self._period = re.compile(rf"(?<!\w)({alternation(self.PERIODS)})(?!\w)")
+
+    @staticmethod
+    @lru_cache(maxsize=8)
+    def _calendar(today) -> Dict[str, Any]:
+        """Relative-day and weekday lookups for one reference day, built once per day"""
+        return {
+            "offsets": [today + timedelta(days=offset) for offset in range(15)],
+            # Upcoming occurrence of each weekday (1-7 days ahead; today's weekday means next week)
+            "weekdays": [today + timedelta(days=((weekday - today.weekday()) % 7) or 7) for weekday in range(7)]
+        }
+
+    def parse(self, text: str, now: datetime = None) -> Optional[ParsedDateTime]:
+        """Parse a free-text date/time; returns None when nothing date- or time-like is found"""
+        text = normalize_text(text)
+        now = (now or datetime.now(timezone.utc)).astimezone(self.tz)
+        calendar = self._calendar(now.date())
+
+        # The period word may also be the day ("tonight"), so it is read from the full text
+        day, rest = self._parse_date(text, now, calendar)
+        clock = self._parse_time(rest, self._meridiem_word(text))
+        if day is None and clock is None:
+            return None
+
+        hour, minute = clock if clock else (0, 0)
+        has_date = day is not None
+        if day is None:
+            # Time only: today if still ahead, otherwise tomorrow
+            day = now.date()
+            if (hour, minute) <= (now.hour, now.minute):
+                day = calendar["offsets"][1]
+
+        value = datetime(day.year, day.month, day.day, hour, minute, tzinfo=self.tz)
+        return ParsedDateTime(value=value, has_date=has_date, has_time=clock is not None)
+
+    def _parse_date(self, text: str, now: datetime, calendar: Dict[str, Any]):
+        """Return (date or None, text with the matched date removed)"""
+        match = self._iso.search(text)
+        if match:
+            year, month, day_of_month = int(match.group(1)), int(match.group(2)), int(match.group(3))
+            rest = text[:match.start()] + " " + (f"{match.group(4)}:{match.group(5)}" if match.group(4) else "") + text[match.end():]
+            return self._safe_date(year, month, day_of_month), rest
+
+        for pattern, day_group, month_group, year_group in (
+            (self._day_month, 1, 2, 3),
+            (self._month_day, 2, 1, 3)
+        ):
+            match = pattern.search(text)
+            if match:
+                month = self.MONTHS[match.group(month_group)]
+                return self._with_year(now, month, int(match.group(day_group)), match.group(year_group)), self._cut(text, match)
+
+        match = self._numeric_date.search(text)
+        if match and not self._clock.match(text, match.start()):
+            first, second = int(match.group(1)), int(match.group(2))
+            day_of_month, month = (first, second) if self.day_first else (second, first)
+            return self._with_year(now, month, day_of_month, match.group(3)), self._cut(text, match)
+
+        match = self._in_days.search(text)
+        if match:
+            offset = int(match.group(1) or match.group(2))
+            return now.date() + timedelta(days=offset), self._cut(text, match)
+
+        match = self._relative.search(text)
+        if match:
+            return calendar["offsets"][self.RELATIVE_DAYS[match.group(1)]], self._cut(text, match)
+
+        match = self._weekday.search(text)
+        if match:
+            return calendar["weekdays"][self.WEEKDAYS[match.group(1)]], self._cut(text, match)
+
+        match = self._next_week.search(text)
+        if match:
+            return calendar["offsets"][7], self._cut(text, match)
+
+        return None, text
+
+    def _parse_time(self, text: str, period: Optional[str] = None):
+        """Return (hour, minute) in 24h form, or None; ``period`` is a period word found in the message"""
+        match = self._clock.search(text)
+        if match:
+            return self._to_24h(int(match.group(1)), int(match.group(2)), match.group(3) or period)
+
+        match = self._hour_meridiem.search(text)
+        if match:
+            return self._to_24h(int(match.group(1)), 0, match.group(2))
+
+        match = self._at_hour.search(text)
+        if match:
+            return self._to_24h(int(match.group(1)), 0, period)
+
+        match = self._period.search(text)
+        if match:
+            return self.PERIODS[match.group(1)], 0
+
+        return None
+
+    def _meridiem_word(self, text: str) -> Optional[str]:
+        match = self._period.search(text)
+        return match.group(1) if match else None
+
+    def _to_24h(self, hour: int, minute: int, meridiem: Optional[str]):
+        if hour > 23 or minute > 59:
+            return None
+        # Period words count as pm from noon on ("in the afternoon", "evening", "tonight")
+        if (meridiem in self.PM_WORDS or self.PERIODS.get(meridiem, 0) >= 12) and hour < 12:
+            hour += 12
+        elif meridiem in self.AM_WORDS and hour == 12:
+            hour = 0
+        elif meridiem is None and 1 <= hour <= 7:
+            hour += 12
+        return hour, minute
+
+    @staticmethod
+    def _cut(text: str, match) -> str:
+        return text[:match.start()] + " " + text[match.end():]
+
+    @staticmethod
+    def _safe_date(year: int, month: int, day: int):
+        try:
+            return datetime(year, month, day).date()
+        except ValueError:
+            return None
+
+    def _with_year(self, now: datetime, month: int, day: int, year: Optional[str]):
+        if year:
+            year = int(year)
+            return self._safe_date(year + 2000 if year < 100 else year, month, day)
+        candidate = self._safe_date(now.year, month, day)
+        if candidate and candidate < now.date():
+            candidate = self._safe_date(now.year + 1, month, day)
+        return candidate
+
+datetime_parser = DateTimeParser()
+
+# Local Intent Model
+class HashedNgramIntentModel:
+    """Lightweight intent classifier: hashed character n-grams + multinomial logistic regression.
+
+    Everything is plain NumPy. A batch of messages becomes a sparse (batch x n_features)
+    matrix in CSR form, so only the weight rows of n-grams that occur are gathered and
+    summed per message; a dense row would be ``n_features`` floats per message. Confidence is the softmax probability
+    after temperature scaling, with the temperature fitted on a held-out split so the
+    number can be compared against the rule-based confidences and the
+    ``intent_confidence_threshold``.
+    """
+
+    ARTIFACT_VERSION = 2  # 2: n-grams taken over normalize_text output
+
+    def __init__(self, labels: List[str], n_features: int = 2 ** 16, ngram_range=(2, 4),
+                 weights: np.ndarray = None, bias: np.ndarray = None, temperature: float = 1.0,
+                 metadata: Dict[str, Any] = None):
+        self.labels = list(labels)
+        self.n_features = n_features
+        self.ngram_range = tuple(ngram_range)
+        self.weights = weights if weights is not None else np.zeros((n_features, len(self.labels)), dtype=np.float32)
+        self.bias = bias if bias is not None else np.zeros(len(self.labels), dtype=np.float32)
+        self.temperature = float(temperature)
+        self.metadata = metadata or {}
+
+    @property
+    def version(self) -> str:
+        return self.metadata.get("model_version", "untrained")
+
+    def _ngram_indices(self, text: str) -> List[int]:
+        padded = f" {normalize_text(text)} "
+        low, high = self.ngram_range
+        return [
+            zlib.crc32(padded[i:i + n].encode("utf-8")) % self.n_features
+            for n in range(low, high + 1)
+            for i in range(len(padded) - n + 1)
+        ]
+
+    def featurize(self, texts: List[str]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """L2-normalised hashed n-gram counts as CSR ``(columns, values, row_starts)``:
+        row ``r`` holds ``columns[row_starts[r]:row_starts[r + 1]]`` and the matching values"""
+        columns, values, row_starts = [], [], [0]
+        for text in texts:
+            unique, counts = np.unique(np.array(self._ngram_indices(text), dtype=np.int64), return_counts=True)
+            counts = counts.astype(np.float32)
+            if counts.size:
+                counts /= np.linalg.norm(counts)
+            columns.append(unique)
+            values.append(counts)
+            row_starts.append(row_starts[-1] + unique.size)
+        return (np.concatenate(columns) if texts else np.zeros(0, dtype=np.int64),
+                np.concatenate(values) if texts else np.zeros(0, dtype=np.float32),
+                np.array(row_starts))
+
+    @staticmethod
+    def _feature_rows(row_starts: np.ndarray) -> np.ndarray:
+        """Row number of every stored feature"""
+        return np.repeat(np.arange(len(row_starts) - 1), np.diff(row_starts))
+
+    def _logits(self, features: Tuple[np.ndarray, np.ndarray, np.ndarray]) -> np.ndarray:
+        columns, values, row_starts = features
+        logits = np.tile(self.bias, (len(row_starts) - 1, 1))
+        np.add.at(logits, self._feature_rows(row_starts), self.weights[columns] * values[:, None])
+        return logits
+
+    @staticmethod
+    def _softmax(logits: np.ndarray) -> np.ndarray:
+        shifted = logits - logits.max(axis=1, keepdims=True)
+        exp = np.exp(shifted)
+        return exp / exp.sum(axis=1, keepdims=True)
+
+    def predict_proba(self, texts: List[str]) -> np.ndarray:
+        return self._softmax(self._logits(self.featurize(texts)) / self.temperature)
+
+    def predict(self, texts: List[str]) -> List[Dict[str, Any]]:
+        """Classify a batch; returns one ``{"intent", "confidence"}`` per text"""
+        if not texts:
+            return []
+        probabilities = self.predict_proba(texts)
+        best = probabilities.argmax(axis=1)
+        return [
+            {"intent": self.labels[index], "confidence": float(probabilities[row, index])}
+            for row, index in enumerate(best)
+        ]
+
+    @classmethod
+    def fit(cls, texts: List[str], labels: List[str], n_features: int = 2 ** 16, ngram_range=(2, 4),
+            epochs: int = 12, batch_size: int = 256, learning_rate: float = 2.0, l2: float = 1e-5,
+            validation_fraction: float = 0.1, seed: int = 14) -> "HashedNgramIntentModel":
+        """Train with mini-batch gradient descent, then fit the softmax temperature on a held-out split"""
+        classes = sorted(set(labels))
+        model = cls(classes, n_features=n_features, ngram_range=ngram_range)
+        targets = np.array([classes.index(label) for label in labels])
+
+        rng = np.random.default_rng(seed)
+        order = rng.permutation(len(texts))
+        n_validation = int(len(texts) * validation_fraction) if len(texts) >= 20 else 0
+        validation, train = order[:n_validation], order[n_validation:]
+
+        for _ in range(epochs):
+            rng.shuffle(train)
+            for start in range(0, len(train), batch_size):
+                batch = train[start:start + batch_size]
+                features = model.featurize([texts[i] for i in batch])
+                gradient = model._softmax(model._logits(features))
+                gradient[np.arange(len(batch)), targets[batch]] -= 1.0
+                gradient /= len(batch)
+                # Only the weight rows of n-grams in the batch get a data gradient
+                columns, values, row_starts = features
+                model.weights *= 1.0 - learning_rate * l2
+                np.add.at(model.weights, columns, -learning_rate * values[:, None] * gradient[model._feature_rows(row_starts)])
+                model.bias -= learning_rate * gradient.sum(axis=0)
+
+        if len(validation):
+            logits = model._logits(model.featurize([texts[i] for i in validation]))
+            model.temperature = cls._fit_temperature(logits, targets[validation])
+
+        model.metadata = {
+            "artifact_version": cls.ARTIFACT_VERSION,
+            "model_version": datetime.utcnow().strftime("%Y%m%d%H%M%S"),
+            "trained_at": datetime.utcnow().isoformat(),
+            "training_samples": int(len(train)),
+            "validation_samples": int(len(validation))
+        }
+        return model
+
+    @classmethod
+    def _fit_temperature(cls, logits: np.ndarray, targets: np.ndarray) -> float:
+        """Temperature minimising held-out negative log-likelihood"""
+        best_temperature, best_nll = 1.0, float("inf")
+        for temperature in np.geomspace(0.05, 10.0, 60):
+            probabilities = cls._softmax(logits / temperature)
+            nll = -np.log(probabilities[np.arange(len(targets)), targets] + 1e-12).mean()
+            if nll < best_nll:
+                best_temperature, best_nll = float(temperature), nll
+        return best_temperature
+
+    def save(self, path) -> Path:
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        metadata = {**self.metadata, "artifact_version": self.ARTIFACT_VERSION,
+                    "n_features": self.n_features, "ngram_range": list(self.ngram_range),
+                    "temperature": self.temperature}
+        with open(path, "wb") as f:
+            np.savez_compressed(
+                f,
+                weights=self.weights,
+                bias=self.bias,
+                labels=np.array(self.labels),
+                metadata=np.array(json.dumps(metadata))
+            )
+        return path
+
+    @classmethod
+    def load(cls, path) -> "HashedNgramIntentModel":
+        with np.load(path, allow_pickle=False) as artifact:
+            metadata = json.loads(str(artifact["metadata"]))
+            if metadata.get("artifact_version") != cls.ARTIFACT_VERSION:
+                raise ValueError(f"Unsupported intent model artifact version: {metadata.get('artifact_version')}")
+            return cls(
+                labels=[str(label) for label in artifact["labels"]],
+                n_features=metadata["n_features"],
+                ngram_range=metadata["ngram_range"],
+                weights=artifact["weights"].astype(np.float32),
+                bias=artifact["bias"].astype(np.float32),
+                temperature=metadata["temperature"],
+                metadata=metadata
+            )
+
+INTENT_MODEL_PATH = Path(os.environ.get("INTENT_MODEL_PATH", ROOT_DIR / "models" / "intent_model.npz"))
+INTENT_BATCH_MAX_MESSAGES = int(os.environ.get("INTENT_BATCH_MAX_MESSAGES", "256"))
+intent_model: Optional[HashedNgramIntentModel] = None
+intent_model_report: Optional[Dict[str, Any]] = None
+
+def intent_model_report_path(artifact_path) -> Path:
+    """Evaluation report written by train_intent_model.py next to the artifact"""
+    artifact_path = Path(artifact_path)
+    return artifact_path.with_name(artifact_path.stem + ".report.json")
+
+def load_intent_model(path: Path = None) -> Optional[HashedNgramIntentModel]:
+    """Load the intent model artifact if one has been trained; the cascade skips it otherwise"""
+    global intent_model, intent_model_report
+    path = Path(path or INTENT_MODEL_PATH)
+    if not path.exists():
+        logger.info(f"No intent model artifact at {path}, local model disabled")
+        return None
+    try:
+        intent_model = HashedNgramIntentModel.load(path)
+        logger.info(f"Loaded intent model {intent_model.version} ({len(intent_model.labels)} intents) from {path}")
+        report_path = intent_model_report_path(path)
+        if report_path.exists():
+            intent_model_report = json.loads(report_path.read_text())
+    except Exception as e:
+        logger.error(f"Failed to load intent model from {path}: {e}")
+    return intent_model
+
+# Response Templates
+TEMPLATES_DIR = Path(os.environ.get("TEMPLATES_DIR", ROOT_DIR / "templates"))
+
+class CompiledTemplate:
+    """A template parsed once into (literal, field) fragments.
+
+    Fields found in ``static_values`` are substituted at compile time and merged into
+    the surrounding literals; a template left without fields renders as a constant.
+    """
+    __slots__ = ("fragments", "tail", "fields", "static")
+
+    def __init__(self, source: str, static_values: Dict[str, str] = None):
+        static_values = static_values or {}
+        fragments = []
+        literal = ""
+        for text, field, spec, conversion in string.Formatter().parse(source):
+            literal += text
+            if field is None:
+                continue
+            if spec or conversion or not field.isidentifier():
+                raise ValueError(f"Unsupported placeholder {{{field}}}: only plain names are allowed")
+            if field in static_values:
+                literal += static_values[field]
+            else:
+                fragments.append((literal, field))
+                literal = ""
+        self.fragments = tuple(fragments)
+        self.tail = literal
+        self.fields = frozenset(field for _literal, field in fragments)
+        self.static = literal if not fragments else None
+
+    def render(self, values: Dict[str, Any]) -> str:
+        if self.static is not None:
+            return self.static
+        parts = []
+        for literal, field in self.fragments:
+            parts.append(literal)
+            parts.append(str(values[field]))
+        parts.append(self.tail)
+        return "".join(parts)
+
+class DirectoryPoller:
+    """Throttled change detection for a directory of admin-edited files.
+
+    ``scan`` maps every file matching ``pattern`` to its modification time. ``poll`` runs a
+    reload callback at most every ``check_interval`` seconds and logs its failures instead of
+    raising, so the caller keeps serving what it loaded last.
+    """
+
+    def __init__(self, directory: Path, pattern: str, check_interval: float, name: str):
+        self.directory = Path(directory)
+        self.pattern = pattern
+        self.check_interval = check_interval
+        self.name = name
+        self._next_check = 0.0
+
+    def scan(self) -> Dict[str, int]:
+        if not self.directory.is_dir():
+            return {}
+        return {path.name: path.stat().st_mtime_ns for path in sorted(self.directory.glob(self.pattern))}
+
+    def poll(self, reload):
+        now = time.monotonic()
+        if now < self._next_check:
+            return
+        self._next_check = now + self.check_interval
+        try:
+            reload()
+        except Exception as e:
+            logger.error(f"{self.name} reload from {self.directory} failed, keeping the loaded version: {e}")
+
+class TemplateRegistry:
+    """Bilingual response templates keyed by (step, language, variant).
+
+    Each ``<language>.txt`` file in ``directory`` holds ``[[step.variant]]`` sections;
+    repeating a key adds an alternative picked at random. Everything is compiled at load
+    time, including static values such as the service list. File modification times are
+    checked at most every ``check_interval`` seconds and changed files are reloaded. A new
+    set is swapped in atomically, and a file that fails to compile keeps the previous set.
+    """
+
+    SECTION = re.compile(r"^\[\[(\w+)\.(\w+)\]\]\s*$")
+
+    def __init__(self, directory: Path, static_values=None, check_interval: float = 2.0):
+        self.directory = Path(directory)
+        self.static_values = static_values
+        self.version = 0
+        self.loaded_at = None
+        self._templates = {}
+        self._mtimes = {}
+        self._poller = DirectoryPoller(self.directory, "*.txt", check_interval, "Response template")
+        self._lock = threading.Lock()
+        self.load()
+
+    def _parse(self, path: Path) -> Dict[tuple, List[str]]:
+        """{(step, variant): [source, ...]} for one language file"""
+        sections = {}
+        key, lines = None, []
+        for line in path.read_text(encoding="utf-8").splitlines() + ["[[end.of_file]]"]:
+            match = self.SECTION.match(line)
+            if not match:
+                if key is not None:
+                    lines.append(line)
+                continue
+            if key is not None:
+                sections.setdefault(key, []).append("\n".join(lines).strip("\n"))
+            key, lines = match.groups(), []
+        return sections
+
+    def load(self) -> Dict[str, Any]:
+        """Compile every template file and swap the new set in"""
+        with self._lock:
+            mtimes = self._poller.scan()
+            parsed = {Path(name).stem: self._parse(self.directory / name) for name in mtimes}
+            templates = {}
+            for language, sections in parsed.items():
+                plain = {key: CompiledTemplate(sources[0]) for key, sources in sections.items()}
+                statics = self.static_values(
+                    language, lambda step, variant, **values: plain[(step, variant)].render(values)
+                ) if self.static_values else {}
+                for (step, variant), sources in sections.items():
+                    templates[(step, language, variant)] = tuple(CompiledTemplate(source, statics) for source in sources)
+            self._templates, self._mtimes = templates, mtimes
+            self.version += 1
+            self.loaded_at = datetime.utcnow()
+        logger.info(f"Loaded {len(templates)} response templates from {self.directory} (version {self.version})")
+        return self.stats()
+
+    def _reload_if_changed(self):
+        if self._poller.scan() != self._mtimes:
+            self.load()
+
+    def render(self, step: str, language: str, variant: str = "default", **values) -> str:
+        self._poller.poll(self._reload_if_changed)
+        alternatives = self._templates.get((step, language, variant)) or self._templates.get((step, "en", variant))
+        if not alternatives:
+            raise KeyError(f"No response template {step}.{variant} for language {language!r}")
+        template = alternatives[0] if len(alternatives) == 1 else random.choice(alternatives)
+        return template.render(values)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "version": self.version,
+            "loaded_at": self.loaded_at.isoformat() if self.loaded_at else None,
+            "templates": len(self._templates),
+            "languages": sorted({language for _step, language, _variant in self._templates}),
+            "files": sorted(self._mtimes)
+        }
+
+def _template_static_values(language: str, render) -> Dict[str, str]:
+    """Values that only change with the service catalogue, inlined into templates at load time"""
+    return {
+        "services_text": "\n".join(
+            render("service_selection", "service_line", icon=s.icon, name=s.name[language], description=s.description[language])
+            for s in AVAILABLE_SERVICES
+        )
+    }
+
+response_templates = TemplateRegistry(
+    TEMPLATES_DIR,
+    static_values=_template_static_values,
+    check_interval=float(os.environ.get("TEMPLATE_RELOAD_INTERVAL", "2"))
+)
+
+# Knowledge Base Retrieval
+KNOWLEDGE_DIR = Path(os.environ.get("KNOWLEDGE_DIR", ROOT_DIR / "knowledge"))
+
+class KnowledgeBase:
+    """In-memory BM25 index over the service catalogue and admin-written FAQ files.
+
+    Each ``<name>.<language>.txt`` file in ``directory`` holds ``[[id]]`` sections: lines
+    starting with ``? `` are question phrasings, the rest is the answer. Every section and
+    every catalogue service becomes one passage in its language's inverted index
+    (term -> {passage id: term frequency}). Files are checked like the response templates,
+    and a changed file only has its own passages removed and re-added.
+
+    ``search`` ranks passages by BM25 and reports a ``confidence`` in [0, 1]: the share of the
+    query's IDF mass the passage matches, so 1.0 means every informative query term matched.
+    ``answer`` only answers directly when the top passage is confident and clearly ahead of
+    the runner-up; otherwise the passages are returned for grounding.
+    """
+
+    SECTION = re.compile(r"^\[\[([\w.-]+)\]\]\s*$")
+    TOKEN = re.compile(r"\w+")
+    STOPWORDS = {
+        "en": normalized_terms([
+            "a", "an", "and", "any", "are", "as", "at", "be", "by", "can", "could", "do", "does", "for", "from", "get",
+            "have", "how", "i", "if", "in", "is", "it", "me", "my", "of", "on", "or", "please", "should", "so", "some",
+            "the", "there", "this", "to", "want", "what", "when", "where", "which", "will", "with", "would",
+            "you", "your"
+        ]),
+        "ar": normalized_terms([
+            "في", "من", "على", "إلى", "الى", "عن", "مع", "هل", "ما", "ماذا", "كيف", "أين", "متى", "هو", "هي",
+            "أنا", "انا", "أريد", "اريد", "لي", "هذا", "هذه", "أو", "او", "و", "يمكنني", "يمكن", "كم", "التي", "الذي"
+        ])
+    }
+
+    # The definite article with its attached prepositions, longest first (after normalize_text)
+    ARABIC_PREFIXES = ("وال", "بال", "كال", "فال", "لل", "ال")
+
+    def __init__(self, directory: Path, services: List[ServiceInfo] = None, check_interval: float = 2.0,
+                 answer_threshold: float = 0.6, answer_margin: float = 0.15, k1: float = 1.5, b: float = 0.75):
+        self.directory = Path(directory)
+        self.answer_threshold = answer_threshold
+        self.answer_margin = answer_margin
+        self.k1, self.b = k1, b
+        self.version = 0
+        self.loaded_at = None
+        self.passages = {}
+        self._postings = {language: defaultdict(dict) for language in SUPPORTED_LANGUAGES}
+        self._lengths = {language: {} for language in SUPPORTED_LANGUAGES}
+        self._total_length = dict.fromkeys(SUPPORTED_LANGUAGES, 0)
+        self._sources = {}
+        self._mtimes = {}
+        self._poller = DirectoryPoller(self.directory, "*.*.txt", check_interval, "Knowledge base")
+        self._lock = threading.Lock()
+        self.counters = {"searches": 0, "answered": 0, "grounded": 0, "misses": 0}
+        if services:
+            self.set_source("catalogue", self._service_passages(services))
+        self.refresh()
+
+    def tokenize(self, text: str, language: str) -> List[str]:
+        """Normalized index terms: stopwords dropped, plurals, Arabic article prefixes and tanween alif stripped"""
+        stopwords = self.STOPWORDS.get(language, ())
+        terms = []
+        for token in self.TOKEN.findall(normalize_text(text)):
+            if len(token) < 2 or token in stopwords:
+                continue
+            if token.isascii():
+                if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+                    token = token[:-1]
+            else:
+                prefix = next((prefix for prefix in self.ARABIC_PREFIXES if token.startswith(prefix)), "")
+                if len(token) - len(prefix) > 2:
+                    token = token[len(prefix):]
+                if len(token) > 5 and token.endswith("ات"):
+                    token = token[:-2]
+                elif len(token) > 3 and token.endswith("ا"):
+                    token = token[:-1]
+            terms.append(token)
+        return terms
+
+    @staticmethod
+    def _service_passages(services: List[ServiceInfo]) -> List[Dict[str, Any]]:
+        passages = []
+        for service in services:
+            hours = f"{service.working_hours['start']}-{service.working_hours['end']}"
+            for language in SUPPORTED_LANGUAGES:
+                name, description = service.name[language], service.description[language]
+                if language == "ar":
+                    days = "، ".join(SlotEngine.DAY_LABELS["ar"][SlotEngine.WEEKDAYS.index(day)] for day in service.available_days)
+                    booking = "يتطلب موعد" if service.requires_appointment else "لا يتطلب موعد"
+                    answer = (f"{service.icon} **{name}**: {description}. تستغرق حوالي {service.estimated_time} دقيقة "
+                              f"و{booking}. ساعات العمل {hours} ({days}).")
+                    questions = [f"ما هي خدمة {name}", f"متى تفتح {name} وما ساعات العمل وكم تستغرق", f"هل {name} يحتاج موعد"]
+                else:
+                    days = ", ".join(day.capitalize() for day in service.available_days)
+                    booking = "requires an appointment" if service.requires_appointment else "needs no appointment"
+                    answer = (f"{service.icon} **{name}**: {description}. It takes about {service.estimated_time} minutes "
+                              f"and {booking}. Open {hours} ({days}).")
+                    questions = [f"what is {name}", f"when is {name} open, working hours and how long it takes",
+                                 f"do I need an appointment for {name}"]
+                passages.append({"id": service.id, "language": language, "title": name,
+                                 "questions": questions, "answer": answer})
+        return passages
+
+    def _parse(self, path: Path) -> List[Dict[str, Any]]:
+        language = path.stem.rsplit(".", 1)[-1]
+        passages = []
+        section, questions, lines = None, [], []
+        for line in path.read_text(encoding="utf-8").splitlines() + ["[[end-of-file]]"]:
+            match = self.SECTION.match(line)
+            if not match:
+                if section is None:
+                    continue
+                if line.startswith("? "):
+                    questions.append(line[2:].strip())
+                else:
+                    lines.append(line)
+                continue
+            if section is not None:
+                passages.append({"id": f"{path.stem}:{section}", "language": language, "title": section,
+                                 "questions": questions, "answer": "\n".join(lines).strip()})
+            section, questions, lines = match.group(1), [], []
+        return passages
+
+    def set_source(self, source: str, passages: List[Dict[str, Any]]):
+        """Replace every passage from ``source`` (a file name or the catalogue) in the index"""
+        with self._lock:
+            for key in self._sources.pop(source, []):
+                passage = self.passages.pop(key)
+                language = passage["language"]
+                for term in set(passage["terms"]):
+                    postings = self._postings[language][term]
+                    del postings[key]
+                    if not postings:
+                        del self._postings[language][term]
+                self._total_length[language] -= self._lengths[language].pop(key)
+            keys = []
+            for passage in passages:
+                language = passage["language"]
+                if language not in self._postings:
+                    continue
+                key = f"{source}/{passage['id']}/{language}"
+                # Question phrasings are indexed alongside the answer so paraphrases match either
+                terms = self.tokenize(" ".join([passage["title"], *passage["questions"], passage["answer"]]), language)
+                self.passages[key] = {**passage, "source": source, "terms": terms}
+                for term, frequency in Counter(terms).items():
+                    self._postings[language][term][key] = frequency
+                self._lengths[language][key] = len(terms)
+                self._total_length[language] += len(terms)
+                keys.append(key)
+            if keys:
+                self._sources[source] = keys
+            self.version += 1
+            self.loaded_at = datetime.utcnow()
+
+    def refresh(self) -> Dict[str, Any]:
+        """Re-index files that were added, changed or removed since the last check"""
+        mtimes = self._poller.scan()
+        for name in set(self._mtimes) - set(mtimes):
+            self.set_source(name, [])
+        for name, mtime in mtimes.items():
+            if self._mtimes.get(name) != mtime:
+                self.set_source(name, self._parse(self.directory / name))
+                logger.info(f"Indexed knowledge file {name} (knowledge base version {self.version})")
+        self._mtimes = mtimes
+        return self.stats()
+
+    def search(self, query: str, language: str = "en", limit: int = 3) -> List[Dict[str, Any]]:
+        """Top passages for ``query`` in ``language``, best first, each with score and confidence"""
+        self._poller.poll(self.refresh)
+        self.counters["searches"] += 1
+        postings, lengths = self._postings.get(language), self._lengths.get(language)
+        terms = set(self.tokenize(query, language))
+        if not postings or not terms:
+            self.counters["misses"] += 1
+            return []
+
+        count = len(lengths)
+        average_length = self._total_length[language] / count
+        scores, matched_idf = defaultdict(float), defaultdict(float)
+        total_idf = 0.0
+        for term in terms:
+            matches = postings.get(term, {})
+            idf = math.log(1 + (count - len(matches) + 0.5) / (len(matches) + 0.5))
+            total_idf += idf
+            for key, frequency in matches.items():
+                norm = self.k1 * (1 - self.b + self.b * lengths[key] / average_length)
+                scores[key] += idf * frequency * (self.k1 + 1) / (frequency + norm)
+                matched_idf[key] += idf
+        if not scores:
+            self.counters["misses"] += 1
+            return []
+
+        ranked = heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+        return [
+            {
+                "id": self.passages[key]["id"],
+                "source": self.passages[key]["source"],
+                "title": self.passages[key]["title"],
+                "answer": self.passages[key]["answer"],
+                "score": round(score, 4),
+                "confidence": round(matched_idf[key] / total_idf, 4)
+            }
+            for key, score in ranked
+        ]
+
+    def answer(self, query: str, language: str = "en") -> Tuple[Optional[str], List[Dict[str, Any]]]:
+        """(direct answer or None, passages) for ``query``"""
+        hits = self.search(query, language)
+        if (hits and hits[0]["confidence"] >= self.answer_threshold
+                and (len(hits) == 1 or hits[1]["score"] <= hits[0]["score"] * (1 - self.answer_margin))):
+            self.counters["answered"] += 1
+            return hits[0]["answer"], hits
+        if hits:
+            self.counters["grounded"] += 1
+        return None, hits
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "version": self.version,
+            "loaded_at": self.loaded_at.isoformat() if self.loaded_at else None,
+            "passages": {language: len(lengths) for language, lengths in self._lengths.items()},
+            "terms": {language: len(postings) for language, postings in self._postings.items()},
+            "files": sorted(self._mtimes),
+            "answer_threshold": self.answer_threshold,
+            "answer_margin": self.answer_margin,
+            "counters": dict(self.counters)
+        }
+
+knowledge_base = KnowledgeBase(
+    KNOWLEDGE_DIR,
+    services=AVAILABLE_SERVICES,
+    check_interval=float(os.environ.get("KNOWLEDGE_RELOAD_INTERVAL", "2")),
+    answer_threshold=float(os.environ.get("KNOWLEDGE_ANSWER_THRESHOLD", "0.6")),
+    answer_margin=float(os.environ.get("KNOWLEDGE_ANSWER_MARGIN", "0.15"))
+)
+
+# Semantic Nearest-Example Index
+SEMANTIC_INDEX_PATH = Path(os.environ.get("SEMANTIC_INDEX_PATH", ROOT_DIR / "models" / "semantic_index.npy"))
+
+class SemanticIndex:
+    """Nearest-example lookup over embedded intent phrases and FAQ questions.
+
+    Texts are embedded with a signed hashed character n-gram projection (the same
+    ``normalize_text`` n-grams as the intent model, folded into ``dim`` float32 columns and
+    L2-normalised), so paraphrases that share word pieces land close together without any
+    model download. All vectors live in one contiguous (rows x dim) matrix, sorted by
+    (kind, language) so that each group is a slice, saved as ``.npy`` and memory-mapped
+    read-only at startup. A batch of queries is scored with one matrix multiply per group.
+
+    The matrix is rebuilt and re-saved when the examples change (``source_version`` moves
+    or the fingerprint stored next to the matrix differs). Queries never wait for that: a
+    stale matrix keeps serving, and one build at a time runs on a background thread.
+    """
+
+    FORMAT_VERSION = 1
+
+    def __init__(self, path: Path, examples=None, source_version=None, dim: int = 1024, ngram_range=(2, 4),
+                 min_similarity: float = 0.55):
+        self.path = Path(path)
+        self.meta_path = self.path.with_suffix(".json")
+        self.examples = examples
+        self.source_version = source_version
+        self.dim = dim
+        self.ngram_range = tuple(ngram_range)
+        self.min_similarity = min_similarity
+        self.matrix = None
+        self.rows: List[Dict[str, str]] = []
+        self.groups: Dict[tuple, tuple] = {}
+        self.fingerprint = None
+        self.built_for = None
+        self.loaded_at = None
+        self._lock = threading.Lock()
+        self._building = threading.Lock()
+        self.builder = None
+        self.counters = {"queries": 0, "batches": 0, "builds": 0, "loads": 0, "intent_hits": 0, "faq_hits": 0}
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """Unit-length float32 vectors, one row per text"""
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        low, high = self.ngram_range
+        for row, text in enumerate(texts):
+            padded = f" {normalize_text(text)} ".encode("utf-8")
+            hashes = np.fromiter(
+                (zlib.crc32(padded[i:i + n]) for n in range(low, high + 1) for i in range(len(padded) - n + 1)),
+                dtype=np.uint32
+            )
+            if hashes.size:
+                # Low bits pick the column, bit 31 the sign, so collisions cancel out on average
+                signs = np.where(hashes >> 31, -1.0, 1.0).astype(np.float32)
+                np.add.at(vectors[row], hashes % self.dim, signs)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        np.divide(vectors, norms, out=vectors, where=norms > 0)
+        return vectors
+
+    def _fingerprint(self, rows: List[Dict[str, str]]) -> str:
+        digest = hashlib.sha256(json.dumps([self.FORMAT_VERSION, self.dim, self.ngram_range]).encode())
+        for row in rows:
+            digest.update(f"{row['kind']}\x1f{row['language']}\x1f{row['label']}\x1f{row['text']}\x1e".encode("utf-8"))
+        return digest.hexdigest()
+
+    def _install(self, matrix: np.ndarray, rows: List[Dict[str, str]], fingerprint: str, built_for):
+        groups = {}
+        for index, row in enumerate(rows):
+            start, _stop = groups.get((row["kind"], row["language"]), (index, index))
+            groups[(row["kind"], row["language"])] = (start, index + 1)
+        self.matrix, self.rows, self.groups = matrix, rows, groups
+        self.fingerprint, self.built_for = fingerprint, built_for
+        self.loaded_at = datetime.utcnow()
+
+    def load_or_build(self) -> Dict[str, Any]:
+        """Memory-map the saved matrix when it matches the current examples, otherwise rebuild and save it"""
+        with self._lock:
+            built_for = self.source_version() if self.source_version else None
+            rows = sorted(
+                ({"kind": kind, "language": language, "label": label, "text": text}
+                 for kind, language, label, text in (self.examples() if self.examples else [])),
+                key=lambda row: (row["kind"], row["language"])
+            )
+            fingerprint = self._fingerprint(rows)
+            try:
+                if self.path.exists() and self.meta_path.exists():
+                    meta = json.loads(self.meta_path.read_text(encoding="utf-8"))
+                    if meta.get("fingerprint") == fingerprint:
+                        matrix = np.load(self.path, mmap_mode="r")
+                        if matrix.shape == (len(rows), self.dim) and matrix.dtype == np.float32:
+                            self._install(matrix, rows, fingerprint, built_for)
+                            self.counters["loads"] += 1
+                            return self.stats()
+            except Exception as e:
+                logger.error(f"Semantic index at {self.path} unreadable, rebuilding: {e}")
+
+            started = time.perf_counter()
+            matrix = np.ascontiguousarray(self.embed([row["text"] for row in rows]))
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                # Write beside the live files and rename, so a crash never leaves a torn matrix
+                temporary = self.path.with_name(f".{self.path.name}.{os.getpid()}.tmp")
+                with open(temporary, "wb") as f:
+                    np.save(f, matrix)
+                os.replace(temporary, self.path)
+                self.meta_path.write_text(json.dumps({"fingerprint": fingerprint, "rows": len(rows), "dim": self.dim,
+                                                      "built_at": datetime.utcnow().isoformat()}), encoding="utf-8")
+                matrix = np.load(self.path, mmap_mode="r")
+            except OSError as e:
+                logger.error(f"Could not persist semantic index to {self.path}, keeping it in memory: {e}")
+            self._install(matrix, rows, fingerprint, built_for)
+            self.counters["builds"] += 1
+            logger.info(f"Built semantic index: {len(rows)} examples x {self.dim} dims in {time.perf_counter() - started:.3f}s")
+            return self.stats()
+
+    def _ensure_current(self):
+        if self.matrix is not None and not (self.source_version and self.source_version() != self.built_for):
+            return
+        if self._building.acquire(blocking=False):
+            self.builder = threading.Thread(target=self._build_in_background, name="semantic-index-build", daemon=True)
+            self.builder.start()
+
+    def _build_in_background(self):
+        try:
+            self.load_or_build()
+        except Exception as e:
+            logger.error(f"Semantic index rebuild failed, keeping the current matrix: {e}")
+        finally:
+            self._building.release()
+
+    def search(self, texts: List[str], language: str, kind: str, k: int = 5) -> List[List[Dict[str, Any]]]:
+        """Top-``k`` examples of ``kind`` in ``language`` for each text, best first, by cosine similarity"""
+        self._ensure_current()
+        self.counters["batches"] += 1
+        self.counters["queries"] += len(texts)
+        start, stop = self.groups.get((kind, language), (0, 0))
+        if not texts or stop == start:
+            return [[] for _ in texts]
+        similarities = self.embed(texts) @ self.matrix[start:stop].T
+        k = min(k, stop - start)
+        top = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+        results = []
+        for row, candidates in enumerate(top):
+            ranked = candidates[np.argsort(-similarities[row, candidates])]
+            results.append([{**self.rows[start + index], "similarity": round(float(similarities[row, index]), 4)}
+                            for index in ranked])
+        return results
+
+    def classify(self, text: str, language: str) -> Optional[Dict[str, Any]]:
+        """Intent of the nearest intent example, or None when nothing is similar enough"""
+        hits = self.search([text], language, "intent", k=1)[0]
+        if not hits or hits[0]["similarity"] < self.min_similarity:
+            return None
+        self.counters["intent_hits"] += 1
+        return {"intent": hits[0]["label"], "confidence": hits[0]["similarity"], "example": hits[0]["text"]}
+
+    def nearest_faq(self, text: str, language: str) -> Optional[Dict[str, Any]]:
+        """The FAQ question closest to ``text`` (its ``label`` is the knowledge base passage key), if similar enough"""
+        hits = self.search([text], language, "faq", k=1)[0]
+        if not hits or hits[0]["similarity"] < self.min_similarity:
+            return None
+        self.counters["faq_hits"] += 1
+        return hits[0]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "path": str(self.path),
+            "memory_mapped": isinstance(self.matrix, np.memmap),
+            "shape": list(self.matrix.shape) if self.matrix is not None else None,
+            "groups": {f"{kind}:{language}": stop - start for (kind, language), (start, stop) in self.groups.items()},
+            "fingerprint": self.fingerprint,
+            "loaded_at": self.loaded_at.isoformat() if self.loaded_at else None,
+            "min_similarity": self.min_similarity,
+            "counters": dict(self.counters)
+        }
+
+def _semantic_examples():
+    """(kind, language, label, text): multi-word intent phrases and the FAQ question phrasings"""
+    for intent, tables in MistralService.INTENT_PATTERNS.items():
+        for language, phrases in tables.items():
+            for phrase in phrases:
+                if " " in phrase.strip():
+                    yield "intent", language, intent, phrase
+    for key, passage in list(knowledge_base.passages.items()):
+        # Catalogue phrasings only differ in the service name, so the nearest one is no answer;
+        # they also must keep classifying as that service rather than as a general inquiry
+        if passage["source"] == "catalogue":
+            continue
+        for question in passage["questions"]:
+            yield "faq", passage["language"], key, question
+            yield "intent", passage["language"], "general_inquiry", question
+
+semantic_index = SemanticIndex(
+    SEMANTIC_INDEX_PATH,
+    examples=_semantic_examples,
+    source_version=lambda: knowledge_base.version,
+    dim=int(os.environ.get("SEMANTIC_INDEX_DIM", "1024")),
+    min_similarity=float(os.environ.get("SEMANTIC_MIN_SIMILARITY", "0.55"))
+)
+
+# Conversation Flow Metrics
+class FlowMetrics:
+    """In-process counters for the rule-based conversation state machine.
+
+    Records every transition, how long conversations stay in each state (dwell time,
+    from entering a state to leaving it), handler latency and validation failures.
+    States entered but never left show where users drop off.
+    """
+
+    def __init__(self):
+        self.started_at = datetime.utcnow()
+        self.transitions = defaultdict(int)
+        self.states = defaultdict(lambda: {
+            "entered": 0, "exited": 0, "turns": 0, "validation_failures": 0,
+            "dwell_seconds": 0.0, "max_dwell_seconds": 0.0, "handler_seconds": 0.0
+        })
+
+    def record_turn(self, state: str, handler_seconds: float, valid: bool = True):
+        stats = self.states[state]
+        stats["turns"] += 1
+        stats["handler_seconds"] += handler_seconds
+        stats["validation_failures"] += not valid
+
+    def record_entry(self, state: str):
+        self.states[state]["entered"] += 1
+
+    def record_transition(self, source: str, target: str, dwell_seconds: float):
+        self.transitions[(source, target)] += 1
+        stats = self.states[source]
+        stats["exited"] += 1
+        stats["dwell_seconds"] += dwell_seconds
+        stats["max_dwell_seconds"] = max(stats["max_dwell_seconds"], dwell_seconds)
+        self.record_entry(target)
+
+    def snapshot(self) -> Dict[str, Any]:
+        states = {}
+        for state, stats in sorted(self.states.items()):
+            entered, exited = stats["entered"], stats["exited"]
+            states[state] = {
+                **stats,
+                "in_state_or_dropped": max(entered - exited, 0),
+                "drop_off_rate": max(entered - exited, 0) / entered if entered else 0.0,
+                "avg_dwell_seconds": stats["dwell_seconds"] / exited if exited else None,
+                "avg_handler_ms": stats["handler_seconds"] * 1000 / stats["turns"] if stats["turns"] else None
+            }
+        return {
+            "since": self.started_at.isoformat(),
+            "states": states,
+            "transitions": [
+                {"from": source, "to": target, "count": count}
+                for (source, target), count in sorted(self.transitions.items(), key=lambda item: -item[1])
+            ]
+        }
+
+flow_metrics = FlowMetrics()
+
+# Analytics Cache
+class AnalyticsCache:
+    """Per-endpoint TTL cache for dashboard aggregations.
+
+    Within ``ttl`` seconds an entry is served as is; for ``stale_ttl`` seconds after that
+    it is still served while one background task refreshes it (stale-while-revalidate).
+    Concurrent misses for the same key share a single in-flight load, so every open
+    dashboard tab together costs at most one query per key at a time, and each load is
+    cut off after ``timeout`` seconds whatever the driver is waiting on.
+    """
+
+    def __init__(self, policies: Dict[str, tuple], timeout: float = 10.0):
+        self.policies = policies  # key -> (ttl seconds, stale_ttl seconds)
+        self.timeout = timeout
+        self._entries = {}
+        self._inflight = {}
+        self.counters = defaultdict(int)
+
+    async def get(self, key: str, loader):
+        entry = self._entries.get(key)
+        now = time.monotonic()
+        if entry is not None and now < entry["fresh_until"]:
+            self.counters["hits"] += 1
+            return entry["value"]
+        if entry is not None and now < entry["stale_until"]:
+            self.counters["stale_hits"] += 1
+            self._load(key, loader)
+            return entry["value"]
+        self.counters["misses"] += 1
+        # Shielded so that one client disconnecting does not cancel the load others wait on
+        return await asyncio.shield(self._load(key, loader))
+
+    def expire(self, *keys: str):
+        """Mark entries stale: the next read serves them once more and triggers a refresh"""
+        for key in keys:
+            if key in self._entries:
+                self._entries[key]["fresh_until"] = 0.0
+
+    def _load(self, key: str, loader) -> asyncio.Task:
+        task = self._inflight.get(key)
+        if task is not None:
+            self.counters["coalesced"] += 1
+            return task
+        task = asyncio.create_task(self._run(key, loader))
+        # Background refreshes have no awaiter; their failures are logged in _run
+        task.add_done_callback(lambda done: done.cancelled() or done.exception())
+        self._inflight[key] = task
+        return task
+
+    async def _run(self, key: str, loader):
+        started = time.perf_counter()
+        try:
+            value = await asyncio.wait_for(loader(), self.timeout)
+        except Exception as e:
+            self.counters["errors"] += 1
+            logger.error(f"Analytics load failed for {key}: {e!r}")
+            raise
+        finally:
+            self._inflight.pop(key, None)
+        ttl, stale_ttl = self.policies[key]
+        now = time.monotonic()
+        self._entries[key] = {
+            "value": value,
+            "loaded_at": datetime.utcnow(),
+            "load_ms": (time.perf_counter() - started) * 1000,
+            "fresh_until": now + ttl,
+            "stale_until": now + ttl + stale_ttl
+        }
+        self.counters["loads"] += 1
+        return value
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "counters": dict(self.counters),
+            "entries": {
+                key: {
+                    "loaded_at": entry["loaded_at"].isoformat(),
+                    "load_ms": entry["load_ms"],
+                    "fresh": time.monotonic() < entry["fresh_until"],
+                    "refreshing": key in self._inflight
+                }
+                for key, entry in self._entries.items()
+            },
+            "policies": {key: {"ttl": ttl, "stale_ttl": stale_ttl} for key, (ttl, stale_ttl) in self.policies.items()}
+        }
+
+# (ttl, stale_ttl) in seconds per cached endpoint
+ANALYTICS_CACHE_POLICIES = {
+    "automation-stats": (15, 120),
+    "automation-activity": (5, 60),
+    "ai-performance": (60, 600),
+    "conversation-insights": (300, 1800)
+}
+
+analytics_cache = AnalyticsCache(
+    ANALYTICS_CACHE_POLICIES,
+    timeout=float(os.environ.get("ANALYTICS_LOAD_TIMEOUT_SECONDS", "10"))
+)
+
+# Live Event Feed
+class EventBus:
+    """In-process pub/sub behind the live dashboard feed (SSE and WebSocket).
+
+    An event is serialized once when it is published and the same frames are fanned
+    out to every subscriber queue, so an extra open dashboard costs one queue put per
+    event and no database work. A slow subscriber loses its oldest queued events
+    instead of blocking publishers. Recent events are kept so that a reconnecting
+    client can catch up from its last event id.
+    """
+
+    def __init__(self, history_size: int = 100, queue_size: int = 256):
+        self.sequence = 0
+        self.history = deque(maxlen=history_size)
+        self.latest = {}  # event type -> last event, replayed to new subscribers for "metrics"
+        self.queue_size = queue_size
+        self.counters = defaultdict(int)
+        self._subscribers = set()
+
+    def publish(self, event_type: str, data: Any) -> Dict[str, Any]:
+        self.sequence += 1
+        payload = json.dumps(data, default=str, ensure_ascii=False)
+        event = {
+            "id": self.sequence,
+            "type": event_type,
+            "sse": f"id: {self.sequence}\nevent: {event_type}\ndata: {payload}\n\n",
+            "json": f'{{"id": {self.sequence}, "type": {json.dumps(event_type)}, "data": {payload}}}'
+        }
+        self.history.append(event)
+        self.latest[event_type] = event
+        for queue in self._subscribers:
+            if queue.full():
+                queue.get_nowait()
+                self.counters["dropped"] += 1
+            queue.put_nowait(event)
+        self.counters["published"] += 1
+        return event
+
+    def subscribe(self, last_event_id: int = None, replay_types=("metrics",)) -> asyncio.Queue:
+        queue = asyncio.Queue(self.queue_size)
+        if last_event_id is not None:
+            backlog = [event for event in self.history if event["id"] > last_event_id]
+        else:
+            backlog = [self.latest[event_type] for event_type in replay_types if event_type in self.latest]
+        for event in backlog[-self.queue_size:]:
+            queue.put_nowait(event)
+        self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self._subscribers.discard(queue)
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+event_bus = EventBus()
+
+# Automation Event Log
+# Event types n8n workflows may report back through /api/n8n/events
+REPORTED_EVENT_TYPES = {"email_sent", "sms_sent", "whatsapp_sent", "calendar_event", "reminder_sent", "webhook_error"}
+
+class AutomationEventLog:
+    """Append-only log of automation activity: bookings, webhook deliveries and the
+    notifications n8n reports back.
+
+    Events go to the capped ``automation_events`` collection, and a running counter per
+    event type (and per webhook workflow) is kept in ``automation_counters``. The activity
+    feed is an index-backed query of one page; the dashboard counters are a handful of
+    small documents. ``relay`` follows the capped collection with a tailable cursor, so
+    events written by other workers reach this worker's live feed too; without a capped
+    collection (an older regular one, or a server that refused to create it) the relay is off.
+    """
+
+    def __init__(self, database=None, size_bytes: int = None):
+        self._database = database
+        self.size_bytes = size_bytes or int(os.environ.get("AUTOMATION_EVENTS_SIZE_BYTES", str(64 * 1024 * 1024)))
+
+    @property
+    def _db(self):
+        return self._database if self._database is not None else mongo.db
+
+    @property
+    def _read_db(self):
+        return self._database if self._database is not None else mongo.analytics
+
+    @property
+    def events(self):
+        return self._db.automation_events
+
+    @property
+    def counters(self):
+        return self._db.automation_counters
+
+    @staticmethod
+    def source() -> str:
+        """Identifies the writing worker, so the relay skips events this worker already published"""
+        return f"{socket.gethostname()}:{os.getpid()}"
+
+    async def ensure_collection(self):
+        try:
+            await self._db.create_collection("automation_events", capped=True, size=self.size_bytes)
+        except CollectionInvalid:
+            pass  # already exists
+        except Exception as e:
+            logger.warning(f"Could not create capped automation_events collection, using a regular one: {e}")
+        # created_at has millisecond precision; _id breaks ties in the newest-first order
+        await self.events.create_index([("type", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)])
+        await self.events.create_index([("appointment_id", ASCENDING), ("created_at", DESCENDING)])
+        await self.events.create_index([("created_at", DESCENDING), ("_id", DESCENDING)])
+
+    async def record(self, event_type: str, message: str, status: str = "success", appointment_id: str = None,
+                     workflow: str = None, details: Dict[str, Any] = None) -> Dict[str, Any]:
+        """Append an event, bump its counters and publish it on the live feed"""
+        now = datetime.utcnow()
+        event = {
+            "type": event_type,
+            "message": message,
+            "status": status,
+            "appointment_id": appointment_id,
+            "workflow": workflow,
+            "details": details or {},
+            "created_at": now,
+            "source": self.source()
+        }
+        update = {"$inc": {"count": 1}, "$set": {"last_at": now, "last_status": status}}
+        counters = [UpdateOne({"_id": event_type}, update, upsert=True)]
+        if workflow:
+            counters.append(UpdateOne({"_id": f"webhook:{workflow}"}, update, upsert=True))
+        try:
+            await self.events.insert_one(event)
+            await self.counters.bulk_write(counters, ordered=False)
+        except Exception as e:
+            logger.error(f"Failed to record automation event {event_type}: {e}")
+        activity = self.to_activity(event)
+        event_bus.publish(event_type, activity)
+        return activity
+
+    @staticmethod
+    def to_activity(event: Dict[str, Any]) -> Dict[str, Any]:
+        """Dashboard activity item for a stored event"""
+        return {
+            "id": str(event.get("_id") or uuid.uuid4()),
+            "type": event["type"],
+            "message": event["message"],
+            "timestamp": event["created_at"].isoformat(),
+            "status": event["status"],
+            "appointment_id": event.get("appointment_id"),
+            "workflow": event.get("workflow")
+        }
+
+    async def recent(self, limit: int = 15, event_type: str = None) -> List[Dict[str, Any]]:
+        query = {"type": event_type} if event_type else {}
+        events = await self._read_db.automation_events.find(
+            query, max_time_ms=mongo.analytics_max_time_ms
+        ).sort([("created_at", -1), ("_id", -1)]).limit(limit).to_list(limit)
+        return [self.to_activity(event) for event in events]
+
+    async def counts(self) -> Dict[str, Dict[str, Any]]:
+        """Counter documents keyed by event type (and ``webhook:<workflow>``)"""
+        documents = await self._read_db.automation_counters.find({}, max_time_ms=mongo.analytics_max_time_ms).to_list(1000)
+        return {document["_id"]: document for document in documents}
+
+    async def tail(self, poll_interval: float = 1.0):
+        """Yield events appended after the call, following the capped collection.
+
+        Resumes in insertion (``$natural``) order: ObjectIds from different workers created
+        in the same second are not ordered by insertion, so ``_id > last`` could skip events.
+        A reopened cursor scans from the oldest event and skips up to the last one yielded
+        (tailable cursors scan the collection either way).
+        """
+        latest = await self.events.find({}, {"_id": 1}).sort("$natural", -1).limit(1).to_list(1)
+        last_id = latest[0]["_id"] if latest else None
+        while True:
+            if last_id is not None and not await self.events.find_one({"_id": last_id}, {"_id": 1}):
+                # Rolled out of the capped collection: resume from the newest event
+                logger.warning("Automation event relay fell behind the capped collection, some events were not relayed")
+                latest = await self.events.find({}, {"_id": 1}).sort("$natural", -1).limit(1).to_list(1)
+                last_id = latest[0]["_id"] if latest else None
+            skipping = last_id is not None
+            async for event in self.events.find({}, cursor_type=CursorType.TAILABLE_AWAIT):
+                if skipping:
+                    skipping = event["_id"] != last_id
+                    continue
+                last_id = event["_id"]
+                yield event
+            # The cursor ends when the collection was empty (or the cursor died); start a new one
+            await asyncio.sleep(poll_interval)
+
+    async def is_capped(self) -> bool:
+        return bool((await self.events.options()).get("capped"))
+
+    async def relay(self):
+        """Publish events written by other workers on this worker's live feed"""
+        source = self.source()
+        while True:
+            try:
+                if not await self.is_capped():
+                    logger.warning("automation_events is not a capped collection, cross-worker activity relay disabled")
+                    return
+                async for event in self.tail():
+                    if event.get("source") != source:
+                        event_bus.publish(event["type"], self.to_activity(event))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Automation event relay failed, retrying: {e}")
+                await asyncio.sleep(30)
+
+automation_events = AutomationEventLog()
+
+class WebhookDispatcher:
+    """Outbound n8n webhook delivery over one pooled HTTP client.
+
+    - ``WEBHOOK_PAYLOAD_VERSION=2`` sends the compact schema: the embedded service is
+      replaced by ``service_id`` (the catalog is ``GET /api/services``), booking fields
+      still at their ``BookingData`` defaults are omitted, and the static
+      ``system_info`` / ``automation_triggers`` blocks (implied by ``webhook_type``) are
+      dropped. Version 1, the default, sends payloads unchanged.
+    - ``WEBHOOK_GZIP_MIN_BYTES`` gzips request bodies at least that large (0 = never).
+    - ``WEBHOOK_BATCH_INTERVAL_SECONDS`` > 0 coalesces events per target URL into one
+      ``{"v": ..., "batch": [...]}`` POST every interval, or as soon as
+      ``WEBHOOK_BATCH_MAX_EVENTS`` are queued. Every event carries an ``event_id``; a
+      ``{"results": [{"event_id", "status", "error"?}]}`` response reports per-event
+      outcomes, otherwise the HTTP status applies to the whole batch.
+    """
+
+    DROPPED_KEYS = ("system_info", "automation_triggers")
+    OK_STATUSES = {"ok", "success", "accepted"}
+
+    def __init__(self, payload_version: int = None, gzip_min_bytes: int = None, batch_interval: float = None,
+                 batch_max_events: int = None, transport: httpx.AsyncBaseTransport = None):
+        self.payload_version = payload_version or int(os.environ.get("WEBHOOK_PAYLOAD_VERSION", "1"))
+        self.gzip_min_bytes = gzip_min_bytes if gzip_min_bytes is not None else int(os.environ.get("WEBHOOK_GZIP_MIN_BYTES", "0"))
+        self.batch_interval = batch_interval if batch_interval is not None else float(os.environ.get("WEBHOOK_BATCH_INTERVAL_SECONDS", "0"))
+        self.batch_max_events = batch_max_events or int(os.environ.get("WEBHOOK_BATCH_MAX_EVENTS", "100"))
+        self.booking_defaults = {
+            name: field.default for name, field in BookingData.model_fields.items() if not field.is_required()
+        }
+        self._transport = transport
+        self._client: Optional[httpx.AsyncClient] = None
+        self._batches: Dict[str, list] = {}  # url -> [(event, timeout, future)]
+        self._timers: Dict[str, asyncio.TimerHandle] = {}
+        self._tasks = set()
+        self.counters = {"posts": 0, "events": 0, "bytes_sent": 0, "bytes_uncompressed": 0}
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                transport=self._transport,
+                limits=httpx.Limits(max_connections=20, max_keepalive_connections=10)
+            )
+        return self._client
+
+    def compact(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """Version 2 form of a webhook payload"""
+        compact = {"v": 2}
+        for key, value in payload.items():
+            if key in self.DROPPED_KEYS:
+                continue
+            if key == "service" and isinstance(value, dict):
+                compact["service_id"] = value.get("id")
+            elif key not in self.booking_defaults or self.booking_defaults[key] != value:
+                compact[key] = value
+        return compact
+
+    def encode(self, body: Dict[str, Any]) -> tuple:
+        """Serialize a request body once; gzip it when it is large enough to be worth it"""
+        content = json.dumps(body, separators=(",", ":"), ensure_ascii=False, default=str).encode("utf-8")
+        headers = {"Content-Type": "application/json"}
+        self.counters["bytes_uncompressed"] += len(content)
+        if self.gzip_min_bytes and len(content) >= self.gzip_min_bytes:
+            content = gzip.compress(content, compresslevel=6)
+            headers["Content-Encoding"] = "gzip"
+        self.counters["bytes_sent"] += len(content)
+        return content, headers
+
+    async def _post(self, url: str, body: Dict[str, Any], timeout: float) -> httpx.Response:
+        content, headers = self.encode(body)
+        self.counters["posts"] += 1
+        response = await self.client.post(url, content=content, headers=headers, timeout=timeout)
+        response.raise_for_status()
+        return response
+
+    async def send(self, url: str, payload: Dict[str, Any], timeout: float = 30.0) -> Dict[str, Any]:
+        """Deliver one event; returns ``{"ok", "status_code"?, "error"?, "batch_size"?}`` and never raises"""
+        self.counters["events"] += 1
+        event = self.compact(payload) if self.payload_version >= 2 else payload
+        if self.batch_interval > 0:
+            return await self._enqueue(url, {**event, "event_id": uuid.uuid4().hex}, timeout)
+        try:
+            response = await self._post(url, event, timeout)
+        except Exception as e:
+            return {"ok": False, "error": f"{type(e).__name__}: {e}", "error_type": type(e).__name__}
+        return {"ok": True, "status_code": response.status_code}
+
+    async def _enqueue(self, url: str, event: Dict[str, Any], timeout: float) -> Dict[str, Any]:
+        future = asyncio.get_running_loop().create_future()
+        batch = self._batches.setdefault(url, [])
+        batch.append((event, timeout, future))
+        if len(batch) >= self.batch_max_events:
+            self._flush(url)
+        elif len(batch) == 1:
+            self._timers[url] = asyncio.get_running_loop().call_later(self.batch_interval, self._flush, url)
+        return await future
+
+    def _flush(self, url: str):
+        timer = self._timers.pop(url, None)
+        if timer:
+            timer.cancel()
+        batch = self._batches.pop(url, None)
+        if batch:
+            task = asyncio.create_task(self._post_batch(url, batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _post_batch(self, url: str, batch: list):
+        try:
+            response = await self._post(
+                url, {"v": self.payload_version, "batch": [event for event, _, _ in batch]},
+                timeout=max(timeout for _, timeout, _ in batch)
+            )
+        except Exception as e:
+            outcome = {"ok": False, "error": f"{type(e).__name__}: {e}", "error_type": type(e).__name__,
+                       "batch_size": len(batch)}
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_result(outcome)
+            return
+
+        try:
+            reported = {item["event_id"]: item for item in response.json().get("results", [])}
+        except Exception:
+            reported = {}
+        for event, _, future in batch:
+            item = reported.get(event["event_id"])
+            outcome = {"ok": True, "status_code": response.status_code, "batch_size": len(batch)}
+            if item and str(item.get("status", "")).lower() not in self.OK_STATUSES:
+                outcome.update(ok=False, error=item.get("error") or item.get("status"), error_type="EventRejected")
+            if not future.done():
+                future.set_result(outcome)
+
+    async def close(self):
+        """Flush queued batches and close the HTTP client (app shutdown)"""
+        for url in list(self._batches):
+            self._flush(url)
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "payload_version": self.payload_version,
+            "gzip_min_bytes": self.gzip_min_bytes,
+            "batch_interval": self.batch_interval,
+            "batch_max_events": self.batch_max_events,
+            "queued": {url: len(batch) for url, batch in self._batches.items()},
+            **self.counters
+        }
+
+webhook_dispatcher = WebhookDispatcher()
+
+class ReminderScheduler:
+    """In-process reminder timer, an alternative to the hourly n8n reminder poll.
+
+    A min-heap of ``(next_reminder_at, seq, appointment_id)`` mirrors the indexed
+    ``next_reminder_at`` field of the appointments collection, which stays the source of
+    truth: the heap is rebuilt from it at startup and re-synced every ``sync_interval``
+    (so bookings taken by other workers are picked up). Rescheduling or cancelling pushes
+    a new entry or drops the appointment from ``entries``; superseded heap entries are
+    skipped when they surface, so both are O(log n).
+
+    When a reminder comes due the worker leases it on the appointment document
+    (``SlotEngine.claim_reminder``); only the lease holder posts it to the reminder
+    webhook, then advances the schedule with ``mark_reminder_sent``. A failed delivery
+    keeps the lease, so the reminder is retried once it expires - by any worker.
+    """
+
+    def __init__(self, engine: SlotEngine, webhook_url: Optional[str] = None, lease_seconds: float = None,
+                 sync_interval: float = None, owner: Optional[str] = None):
+        self.engine = engine
+        self.webhook_url = webhook_url
+        self.lease_seconds = lease_seconds or float(os.environ.get("REMINDER_LEASE_SECONDS", "120"))
+        self.sync_interval = sync_interval or float(os.environ.get("REMINDER_SYNC_INTERVAL_SECONDS", "300"))
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}"
+        self.entries: Dict[str, tuple] = {}  # appointment_id -> (due_at, seq) of its live heap entry
+        self._heap: List[tuple] = []
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self.counters = {"sent": 0, "claimed_elsewhere": 0, "failed": 0, "synced": 0}
+
+    @classmethod
+    def from_env(cls, engine: SlotEngine) -> Optional["ReminderScheduler"]:
+        """The scheduler is opt-in: REMINDER_SCHEDULER_ENABLED=true and N8N_REMINDER_WEBHOOK"""
+        if os.environ.get("REMINDER_SCHEDULER_ENABLED", "false").lower() != "true":
+            return None
+        url = os.environ.get("N8N_REMINDER_WEBHOOK")
+        if not url:
+            logger.warning("REMINDER_SCHEDULER_ENABLED is set but N8N_REMINDER_WEBHOOK is not; scheduler disabled")
+            return None
+        return cls(engine, url)
+
+    def schedule(self, appointment_id: str, due_at: Optional[datetime]):
+        """(Re)schedule an appointment's next reminder; ``None`` cancels it"""
+        if due_at is None:
+            self.cancel(appointment_id)
+            return
+        current = self.entries.get(appointment_id)
+        if current and current[0] == due_at:
+            return
+        seq = next(self._seq)
+        self.entries[appointment_id] = (due_at, seq)
+        heapq.heappush(self._heap, (due_at, seq, appointment_id))
+        if self._heap[0][1] == seq:
+            self._wakeup.set()  # new earliest deadline
+        if len(self._heap) > 2 * len(self.entries) + 64:
+            self._compact()
+
+    def cancel(self, appointment_id: str):
+        self.entries.pop(appointment_id, None)
+
+    def _compact(self):
+        self._heap = [(due_at, seq, appointment_id) for appointment_id, (due_at, seq) in self.entries.items()]
+        heapq.heapify(self._heap)
+
+    def _is_live(self, item: tuple) -> bool:
+        due_at, seq, appointment_id = item
+        return self.entries.get(appointment_id) == (due_at, seq)
+
+    def next_due(self) -> Optional[datetime]:
+        while self._heap and not self._is_live(self._heap[0]):
+            heapq.heappop(self._heap)
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now: datetime) -> List[str]:
+        """Remove and return the appointments whose reminder is due by ``now``"""
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            item = heapq.heappop(self._heap)
+            if self._is_live(item):
+                del self.entries[item[2]]
+                due.append(item[2])
+        return due
+
+    async def sync(self):
+        """Load every pending reminder from the ``next_reminder_at`` index"""
+        cursor = self.engine.collection.find(
+            {"next_reminder_at": {"$exists": True}, "status": "reserved"},
+            {"appointment_id": 1, "next_reminder_at": 1}
+        )
+        count = 0
+        async for appointment in cursor:
+            self.schedule(appointment["appointment_id"], appointment["next_reminder_at"])
+            count += 1
+        self.counters["synced"] = count
+        return count
+
+    async def fire(self, appointment_id: str, now: datetime = None) -> bool:
+        """Send an appointment's due reminder if this worker wins its lease; returns True if it was sent"""
+        now = now or datetime.utcnow()
+        appointment = await self.engine.claim_reminder(appointment_id, self.owner, self.lease_seconds, now)
+        if not appointment:
+            # Sent (or leased) elsewhere, rescheduled or cancelled: follow whatever is stored now
+            self.counters["claimed_elsewhere"] += 1
+            current = await self.engine.collection.find_one({"appointment_id": appointment_id, "status": "reserved"})
+            if current and current.get("next_reminder_at"):
+                lease_until = current.get("reminder_lease_until")
+                self.schedule(appointment_id, max(current["next_reminder_at"], lease_until or now))
+            return False
+        if appointment["start"] <= now:
+            # Too late to remind; drop the rest of the schedule
+            await self.engine.mark_reminder_sent(appointment_id, {"reminder_type": "expired"}, now=now)
+            return False
+
+        reminder = self.engine.reminder_view(appointment)
+        payload = {**reminder, "webhook_type": "appointment_reminder", "reminder_type": f"{reminder['reminder_hours_before']:g}h"}
+        if not await deliver_webhook("reminders", self.webhook_url, payload, appointment_id):
+            self.counters["failed"] += 1
+            self.schedule(appointment_id, appointment["reminder_lease_until"])  # retry when the lease runs out
+            return False
+
+        result = await self.engine.mark_reminder_sent(
+            appointment_id, {"reminder_type": payload["reminder_type"], "sent_via": "scheduler", "sent_at": now.isoformat()}, now=now
+        )
+        self.counters["sent"] += 1
+        analytics_cache.expire("automation-stats", "automation-activity")
+        await automation_events.record(
+            "reminder_sent", f"{payload['reminder_type']} reminder sent for appointment {appointment_id}",
+            appointment_id=appointment_id, workflow="reminders"
+        )
+        if result:
+            self.schedule(appointment_id, result[0].get("next_reminder_at"))
+        return True
+
+    async def run(self):
+        """Sleep until the earliest reminder (or the next re-sync), fire what is due, repeat"""
+        next_sync = 0.0
+        while True:
+            try:
+                if time.monotonic() >= next_sync:
+                    await self.sync()
+                    next_sync = time.monotonic() + self.sync_interval
+
+                now = datetime.utcnow()
+                for appointment_id in self.pop_due(now):
+                    await self.fire(appointment_id, now)
+
+                timeout = next_sync - time.monotonic()
+                due_at = self.next_due()
+                if due_at is not None:
+                    timeout = min(timeout, (due_at - datetime.utcnow()).total_seconds())
+                self._wakeup.clear()
+                if timeout > 0:
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), timeout)
+                    except asyncio.TimeoutError:
+                        pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Reminder scheduler failed, retrying: {e}")
+                await asyncio.sleep(30)
+
+    def snapshot(self) -> Dict[str, Any]:
+        due_at = self.next_due()
+        return {
+            "enabled": True,
+            "owner": self.owner,
+            "scheduled": len(self.entries),
+            "heap_size": len(self._heap),
+            "next_due": due_at.replace(tzinfo=timezone.utc).isoformat() if due_at else None,
+            "lease_seconds": self.lease_seconds,
+            **self.counters
+        }
+
+reminder_scheduler = ReminderScheduler.from_env(slot_engine)
+
 # Mistral AI Integration
 class MistralService:
+    # Keyword tables for the rule-based path. They are written naturally here and compiled
+    # into normalize_text form once per process (see _compile_keyword_tables), so spelling
+    # variants (hamza, taa marbuta, tanween, Arabic-Indic digits) need not be listed.
+    INTENT_PATTERNS = {
+        "health_card_renewal": {
+            "en": [
+                # Direct terms
+                "health card", "renew", "renewal", "health insurance", "medical card", "health coverage", "insurance renewal",
+                # Variations and synonyms
+                "health certificate", "medical certificate", "healthcare card", "health benefits", "medical benefits",
+                "insurance card", "medical insurance", "health plan", "coverage renewal", "benefits renewal",
+                "health card expired", "health card expiry", "health card update", "medical coverage expired",
+                # Context-specific phrases
+                "need to renew my health", "health card is expired", "update my medical", "extend my health",
+                "my insurance has expired", "health benefits renewal", "medical coverage renewal"
+            ],
+            "ar": [
+                "بطاقة صحية", "تجديد", "تأمين صحي", "بطاقة طبية", "تغطية صحية", "تأمين طبي",
+                "شهادة صحية", "بطاقة التأمين", "التأمين الطبي", "الخدمات الصحية", "المنافع الطبية",
+                "بطاقة صحية منتهية", "انتهت بطاقتي الصحية", "تحديث البطاقة الصحية", "تمديد التأمين",
+                "أريد تجديد البطاقة", "البطاقة الصحية انتهت", "تجديد التأمين الصحي"
+            ]
+        },
+        "id_card_replacement": {
+            "en": [
+                # Direct terms
+                "id card", "identity", "replace", "lost id", "damaged id", "identity card", "national id", "replacement",
+                # Variations
+                "identity document", "personal id", "government id", "citizenship card", "id document",
+                "new id card", "id card copy", "duplicate id", "id card renewal", "identity renewal",
+                # Context-specific
+                "lost my id", "id card damaged", "need new id", "replace my identity", "id card broken",
+                "stolen id card", "id card missing", "duplicate identity card", "new identity document"
+            ],
+            "ar": [
+                "بطاقة هوية", "استبدال", "هوية مفقودة", "بطاقة تالفة", "هوية وطنية", "بطاقة شخصية",
+                "وثيقة هوية", "هوية شخصية", "بطاقة حكومية", "بطاقة مواطنة", "وثيقة شخصية",
+                "ضاعت هويتي", "بطاقة الهوية تالفة", "أحتاج هوية جديدة", "استبدال الهوية", "بطاقة مكسورة",
+                "سرقت بطاقة الهوية", "نسخة من الهوية", "بطاقة هوية جديدة"
+            ]
+        },
+        "medical_consultation": {
+            "en": [
+                # Direct terms
+                "doctor", "appointment", "medical", "consultation", "doctor visit", "see doctor", "medical appointment", "clinic",
+                # Variations
+                "physician", "medical exam", "checkup", "health checkup", "medical consultation", "doctor consultation",
+                "book appointment", "schedule appointment", "medical visit", "health consultation", "specialist",
+                # Context-specific
+                "need to see a doctor", "book medical appointment", "health problem", "medical issue",
+                "doctor's appointment", "medical emergency", "health concern", "need medical help",
+                "schedule with doctor", "visit clinic", "see specialist", "medical examination"
+            ],
+            "ar": [
+                "طبيب", "موعد", "استشارة", "طبية", "زيارة طبيب", "عيادة", "موعد طبي", "فحص طبي",
+                "دكتور", "فحص صحي", "استشارة طبية", "كشف طبي", "أخصائي", "طبيب مختص",
+                "أحتاج طبيب", "حجز موعد طبي", "مشكلة صحية", "مشكلة طبية", "موعد الطبيب",
+                "زيارة العيادة", "فحص عند الطبيب", "استشارة صحية", "طوارئ طبية", "مساعدة طبية",
+                "حجز مع الطبيب", "رؤية الطبيب", "كشف عند الدكتور"
+            ]
+        },
+        "student_enrollment": {
+            "en": [
+                # Direct terms
+                "enroll", "student", "course", "register", "education", "enrollment", "university", "school", "study",
+                # Variations
+                "registration", "admission", "academic", "college", "institute", "program", "degree", "classes",
+                "semester", "academic year", "student registration", "course registration", "class enrollment",
+                # Context-specific
+                "want to study", "apply for course", "join university", "student application", "academic admission",
+                "register for classes", "enroll in program", "education program", "learning program",
+                "student services", "academic services", "course application", "study application"
+            ],
+            "ar": [
+                "تسجيل", "طالب", "دورة", "تعليم", "التحاق", "جامعة", "مدرسة", "دراسة", "قبول",
+                "تسجيل الطلاب", "قبول جامعي", "أكاديمي", "كلية", "معهد", "برنامج", "شهادة", "صفوف",
+                "فصل دراسي", "سنة أكاديمية", "تسجيل الدورة", "تسجيل الصف", "الالتحاق بالبرنامج",
+                "أريد الدراسة", "التقديم للدورة", "الانضمام للجامعة", "طلب الطالب", "قبول أكاديمي",
+                "تسجيل في الصفوف", "تسجيل في البرنامج", "برنامج تعليمي", "برنامج التعلم",
+                "خدمات الطلاب", "خدمات أكاديمية", "طلب الدورة", "طلب الدراسة"
+            ]
+        }
+    }
+    # Contextual bonus terms per intent (any language)
+    CONTEXT_TERMS = {
+        "health_card_renewal": ["expired", "expire", "old", "update"],
+        "id_card_replacement": ["lost", "missing", "stolen", "damaged", "broken"],
+        "medical_consultation": ["sick", "pain", "problem", "issue", "emergency"],
+        "student_enrollment": ["apply", "application", "join", "start"]
+    }
+    # Enhanced greeting detection with cultural variations
+    GREETINGS = {
+        "en": [
+            "hello", "hi", "hey", "good morning", "good afternoon", "good evening", "greetings",
+            "howdy", "what's up", "how are you", "good day", "nice to meet you", "pleased to meet you",
+            "how do you do", "how's it going", "how's everything", "salutations", "hiya"
+        ],
+        "ar": [
+            "مرحبا", "أهلا", "السلام عليكم", "صباح الخير", "مساء الخير", "أهلا وسهلا",
+            "حياك الله", "أهلا بك", "مرحبا بك", "تحية طيبة", "السلام عليكم ورحمة الله",
+            "صباح النور", "مساء النور", "كيف الحال", "كيف حالك", "أسعد الله مساءك"
+        ]
+    }
+    QUESTION_WORDS = {
+        "en": ["what", "how", "when", "where", "why", "who", "which", "can you", "could you", "do you"],
+        "ar": ["ما", "كيف", "متى", "أين", "لماذا", "من", "أي", "هل يمكن", "هل تستطيع", "ماذا"]
+    }
+    # Replies that accept the offered service
+    PROCEED_WORDS = {
+        "en": ["yes", "sure", "ok", "okay", "proceed", "continue", "confirm"],
+        "ar": ["نعم", "موافق", "حسنا", "متابعة", "استمر", "أكد", "موافقة"]
+    }
+    # Replies that confirm a booked appointment
+    CONFIRMATION_WORDS = {
+        "en": ["yes", "confirm", "correct", "right", "okay", "ok", "sure", "proceed"],
+        "ar": ["نعم", "أكد", "صحيح", "موافق", "حسنا", "متابعة", "استمر"]
+    }
+    # General inquiry types, checked in order
+    INQUIRY_KEYWORDS = {
+        "working_hours": ["hours", "time", "when", "open", "close", "ساعات", "وقت", "متى", "مفتوح", "مغلق"],
+        "services_overview": ["services", "what", "help", "do", "خدمات", "ماذا", "مساعدة", "تساعد"],
+        "contact_info": ["contact", "phone", "email", "address", "reach", "تواصل", "هاتف", "بريد", "عنوان"],
+        "appointment_info": ["appointment", "booking", "schedule", "موعد", "حجز", "جدولة"]
+    }
+    # Date/time keyword entities: entity name -> keywords, first match wins
+    DATETIME_KEYWORDS = {
+        "en": {
+            "preferred_day": ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"],
+            "preferred_time_period": ["morning", "afternoon", "evening", "night", "noon", "midnight"],
+            "relative_date": ["today", "tomorrow", "next week", "next month", "this week", "this month"]
+        },
+        "ar": {
+            "preferred_day": ["الاثنين", "الثلاثاء", "الأربعاء", "الخميس", "الجمعة", "السبت", "الأحد"],
+            "preferred_time_period": ["صباحاً", "مساءً", "ليلاً", "ظهراً", "العصر", "المغرب"],
+            "relative_date": ["اليوم", "غدا", "الأسبوع القادم", "الشهر القادم", "هذا الأسبوع"]
+        }
+    }
+    URGENCY_WORDS = {
+        "en": ["urgent", "emergency", "asap", "immediately", "quickly", "rush", "priority"],
+        "ar": ["عاجل", "طارئ", "فوري", "سريع", "مستعجل", "أولوية"]
+    }
+
+    # Rule-based dialogue flow, keyed by SessionData.step (and booking_step inside "booking").
+    # handler: method producing the reply and the next state; validator: optional method
+    # returning the step's template variant to re-prompt with when the input is rejected;
+    # accepts_new_intent: a confidently detected service request restarts the flow here.
+    FLOW_STATES = {
+        "greeting": {"handler": "_handle_greeting_backend", "accepts_new_intent": True},
+        "intent_detection": {"handler": "_handle_greeting_backend", "accepts_new_intent": True},
+        "completed": {"handler": "_handle_greeting_backend", "accepts_new_intent": True},
+        "service_selection": {"handler": "_handle_service_selection_backend", "accepts_new_intent": True},
+        "general_inquiry": {"handler": "_handle_general_inquiry_backend", "accepts_new_intent": True},
+        "booking.name": {"handler": "_handle_booking_backend", "validator": "_validate_name"},
+        "booking.phone": {"handler": "_handle_booking_backend", "validator": "_validate_phone"},
+        "booking.datetime": {"handler": "_handle_booking_backend"},
+        "confirmation": {"handler": "_handle_confirmation_backend"}
+    }
+    FALLBACK_STATE = {"handler": "_handle_fallback_backend"}
+    NAME_PATTERN = re.compile(r"^[^\W\d_]+(?:[\s.'-]+[^\W\d_]+)*$")
+
+    # Enhanced phone number extraction with international formats
+    PHONE_PATTERNS = [re.compile(pattern) for pattern in (
+        r'(\+?\d{1,3}[-.\s]?)?\(?\d{3}\)?[-.\s]?\d{3}[-.\s]?\d{4}',  # US format
+        r'(\+?\d{1,3}[-.\s]?)?\d{2,3}[-.\s]?\d{3,4}[-.\s]?\d{4}',    # International
+        r'(\+?\d{1,3})?\s?\d{9,}',                                    # Simple international
+        r'(\d{3}[-.\s]?\d{3}[-.\s]?\d{4})',                         # Simple US
+        r'(\+\d{1,3}[-.\s]?\d{1,14})',                              # E.164 format
+    )]
+    # Enhanced name extraction with multiple languages and patterns
+    NAME_PATTERNS = {
+        "en": [re.compile(pattern, re.IGNORECASE) for pattern in (
+            r'my name is (\w+(?:\s+\w+)*)',
+            r'i am (\w+(?:\s+\w+)*)',
+            r"i'm (\w+(?:\s+\w+)*)",
+            r'name[:\s]+(\w+(?:\s+\w+)*)',
+            r'called (\w+(?:\s+\w+)*)',
+            r'this is (\w+(?:\s+\w+)*)',
+            r'(\w+(?:\s+\w+)*) here',
+            r'speaking with (\w+(?:\s+\w+)*)',
+        )],
+        "ar": [re.compile(pattern, re.IGNORECASE) for pattern in (
+            r'اسمي (\w+(?:\s+\w+)*)',
+            r'أنا (\w+(?:\s+\w+)*)',
+            r'انا (\w+(?:\s+\w+)*)',
+            r'الاسم[:\s]+(\w+(?:\s+\w+)*)',
+            r'يدعوني (\w+(?:\s+\w+)*)',
+            r'هذا (\w+(?:\s+\w+)*)',
+            r'(\w+(?:\s+\w+)*) هنا',
+        )]
+    }
+    SPECIFIC_TIME_PATTERNS = {
+        "en": re.compile(r'\b\d{1,2}:\d{2}\s?(?:am|pm)?\b'),
+        "ar": re.compile(r'\b\d{1,2}:\d{2}\b')
+    }
+    SPECIFIC_DATE_PATTERN = re.compile(r'\b\d{1,2}[/\-\.]\d{1,2}[/\-\.]\d{2,4}\b')
+    EMAIL_PATTERN = re.compile(r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b')
+    AGE_PATTERNS = [re.compile(pattern) for pattern in (
+        r'(\d{1,3})\s*(?:years?\s*old|yr|years)',
+        r'age[:\s]*(\d{1,3})',
+        r'i am (\d{1,3})'
+    )]
+    LOCATION_PATTERNS = [re.compile(pattern, re.IGNORECASE) for pattern in (
+        r'at (\w+(?:\s+\w+)*)',
+        r'in (\w+(?:\s+\w+)*)',
+        r'from (\w+(?:\s+\w+)*)',
+        r'location[:\s]*(\w+(?:\s+\w+)*)'
+    )]
+
     def __init__(self):
         self.model_name = "mistral:7b-instruct-q4_0"  # or q5_0 for better quality
         self.conversation_context = {}  # Store conversation context for better responses
         self.intent_confidence_threshold = 0.7  # Minimum confidence for intent detection
-        
-    def update_conversation_context(self, conversation_id: str, user_input: str, intent_result: Dict, session_data: SessionData):
-        """Update conversation context for better contextual responses"""
-        if conversation_id not in self.conversation_context:
-            self.conversation_context[conversation_id] = {
-                "previous_intents": [],
-                "extracted_entities": {},
-                "conversation_history": [],
-                "user_preferences": {},
-                "conversation_stage": "initial"
+        self.enabled = os.environ.get("MISTRAL_ENABLED", "true").lower() not in ("0", "false", "no")
+        self._compile_keyword_tables()
+        self._flow = {state: self._compile_flow_state(spec) for state, spec in self.FLOW_STATES.items()}
+        self._fallback_flow = self._compile_flow_state(self.FALLBACK_STATE)
+        # Rule-based scores depend only on the normalized text, so repeated messages
+        # ("yes", "نعم", "hello") are scored once
+        self._score_intents = lru_cache(maxsize=4096)(self._score_intents_uncached)
+
+    def _compile_keyword_tables(self):
+        """Normalize every keyword table once; intent terms also carry their split parts"""
+        self._intent_tables = {
+            language: [
+                (intent, tuple((term, tuple(term.split())) for term in normalized_terms(patterns[language])))
+                for intent, patterns in self.INTENT_PATTERNS.items()
+            ]
+            for language in ("en", "ar")
+        }
+        self._context_terms = {intent: normalized_terms(terms) for intent, terms in self.CONTEXT_TERMS.items()}
+        self._greetings = {language: normalized_terms(words) for language, words in self.GREETINGS.items()}
+        self._question_words = {language: normalized_terms(words) for language, words in self.QUESTION_WORDS.items()}
+        # Reply word lists become one alternation each, matched with a single regex scan
+        self._proceed_pattern = {
+            language: re.compile("|".join(map(re.escape, normalized_terms(words)))) for language, words in self.PROCEED_WORDS.items()
+        }
+        self._confirmation_pattern = {
+            language: re.compile("|".join(map(re.escape, normalized_terms(words)))) for language, words in self.CONFIRMATION_WORDS.items()
+        }
+        self._inquiry_keywords = [(kind, normalized_terms(words)) for kind, words in self.INQUIRY_KEYWORDS.items()]
+        self._urgency_words = {language: normalized_terms(words) for language, words in self.URGENCY_WORDS.items()}
+        # keyword -> canonical spelling reported in the entity
+        self._datetime_keywords = {
+            language: {
+                entity: tuple((normalize_text(word), word) for word in words)
+                for entity, words in tables.items()
             }
+            for language, tables in self.DATETIME_KEYWORDS.items()
+        }
         
-        context = self.conversation_context[conversation_id]
+    def update_conversation_context(self, conversation_id: str, user_input: str, intent_result: Dict, session_data: SessionData,
+                                    record: bool = True):
+        """Update conversation context for better contextual responses
+
+        The update is built on a copy; with ``record=False`` it is only returned, and the caller
+        stores it with ``record_conversation_context`` once the turn is saved"""
+        stored = self.conversation_context.get(conversation_id, {})
+        context = {
+            "previous_intents": list(stored.get("previous_intents", [])),
+            "extracted_entities": dict(stored.get("extracted_entities", {})),
+            "conversation_history": list(stored.get("conversation_history", [])),
+            "user_preferences": dict(stored.get("user_preferences", {})),
+            "conversation_stage": stored.get("conversation_stage", "initial")
+        }
         
         # Update previous intents
         context["previous_intents"].append({
@@ -284,10 +3074,19 @@ class MistralService:
         else:
             context["conversation_stage"] = "ongoing"
         
+        if record:
+            self.record_conversation_context(conversation_id, context)
         return context
+
+    def record_conversation_context(self, conversation_id: str, context: Dict):
+        """Keep an updated context for the conversation's next turn"""
+        self.conversation_context[conversation_id] = context
         
     async def ensure_model_available(self):
         """Ensure Mistral model is available - fallback to rule-based for demo"""
+        if not self.enabled:
+            return False
+        
         try:
             # Try to check if Ollama is available
             import subprocess
@@ -309,19 +3108,50 @@ class MistralService:
             logger.warning(f"Ollama not available ({e}), using fallback AI system")
             return False
 
-    async def classify_intent(self, user_input: str, language: str = "en") -> Dict[str, Any]:
+    async def classify_intent(self, user_input: str, language: str = "en", detection: Dict[str, Any] = None) -> Dict[str, Any]:
         """Classify user intent - with fallback to rule-based system and advanced logging"""
         start_time = datetime.utcnow()
         
         try:
-            # Try Mistral first
-            if await self.ensure_model_available():
+            # Cascade from cheapest to most expensive, stopping once confident enough:
+            # rule-based keywords -> nearest example -> local NumPy model -> Mistral
+            normalized = normalize_text(user_input)
+            result = self._fallback_intent_classification(user_input, language, normalized)
+            method_used = "rule_based"
+            
+            if detection and detection["mixed"]:
+                # Mixed-script input: the other language's tables may match better
+                other_language = "en" if language == "ar" else "ar"
+                alternative = self._fallback_intent_classification(user_input, other_language, normalized)
+                if alternative["confidence"] > result["confidence"]:
+                    result = alternative
+            
+            if result["confidence"] < self.intent_confidence_threshold:
+                # Paraphrase of a known example: nearest neighbour in the semantic index
+                nearest = semantic_index.classify(user_input, language)
+                if nearest and nearest["confidence"] > result["confidence"]:
+                    intent = nearest["intent"]
+                    result = {
+                        **result,
+                        "intent": intent,
+                        "confidence": nearest["confidence"],
+                        "service_id": intent.replace("_", "-") if intent not in ["general_inquiry", "greeting"] else None,
+                        "nearest_example": nearest["example"]
+                    }
+                    method_used = "nearest_example"
+            
+            if result["confidence"] < self.intent_confidence_threshold and intent_model is not None:
+                model_result = self._classify_with_local_model([user_input], [language], [normalized])[0]
+                if model_result["confidence"] >= result["confidence"]:
+                    result = model_result
+                    method_used = "local_model"
+            
+            if result["confidence"] < self.intent_confidence_threshold and await self.ensure_model_available():
                 result = await self._classify_with_mistral(user_input, language)
                 method_used = "mistral"
-            else:
-                # Fallback to enhanced rule-based system
-                result = self._fallback_intent_classification(user_input, language)
-                method_used = "rule_based"
+            
+            # Downstream handlers match keywords against the same normalized text
+            result["normalized_text"] = normalized
             
             # Log performance metrics
             processing_time = (datetime.utcnow() - start_time).total_seconds()
@@ -335,6 +3165,7 @@ class MistralService:
                 "processing_time": processing_time,
                 "input_length": len(user_input),
                 "language": language,
+                "language_detection": detection,
                 "timestamp": start_time.isoformat()
             }
             
@@ -355,6 +3186,37 @@ class MistralService:
             
             return result
 
+    def _classify_with_local_model(self, texts: List[str], languages: List[str], normalized: List[str] = None) -> List[Dict[str, Any]]:
+        """Classify a batch with the local intent model (one matrix multiply for the whole batch)"""
+        normalized = normalized or [normalize_text(text) for text in texts]
+        results = []
+        for text, language, normalized_text, prediction in zip(texts, languages, normalized, intent_model.predict(normalized)):
+            intent = prediction["intent"]
+            results.append({
+                "intent": intent,
+                "confidence": prediction["confidence"],
+                "service_id": intent.replace("_", "-") if intent not in ["general_inquiry", "greeting"] else None,
+                "entities": self._extract_entities(text, language, normalized_text),
+                "model_version": intent_model.version
+            })
+        return results
+
+    def classify_intent_batch(self, texts: List[str], language: Optional[str] = None) -> List[Dict[str, Any]]:
+        """High-volume triage: local model when available, rule-based per message otherwise.
+
+        Without an explicit ``language`` each message's language is detected on its own.
+        """
+        languages = [language or language_detector.detect(text)["language"] for text in texts]
+        if intent_model is not None:
+            return [
+                {**result, "language": text_language, "method_used": "local_model"}
+                for result, text_language in zip(self._classify_with_local_model(texts, languages), languages)
+            ]
+        return [
+            {**self._fallback_intent_classification(text, text_language), "language": text_language, "method_used": "rule_based"}
+            for text, text_language in zip(texts, languages)
+        ]
+
     async def _classify_with_mistral(self, user_input: str, language: str) -> Dict[str, Any]:
         """Classify using actual Mistral model"""
         system_prompt = self._get_intent_classification_prompt(language)
@@ -434,115 +3296,40 @@ Analyze the user's message and return the result in JSON format:
             logger.error(f"Error parsing intent response: {e}")
             return self._fallback_intent_classification(response)
 
-    def _fallback_intent_classification(self, text: str, language: str = "en") -> Dict[str, Any]:
+    def _fallback_intent_classification(self, text: str, language: str = "en", normalized: str = None) -> Dict[str, Any]:
         """Enhanced fallback rule-based intent classification with sophisticated pattern matching"""
-        text_lower = text.lower()
-        
-        # Significantly enhanced intent patterns with synonyms, variations, and contextual terms
-        intent_patterns = {
-            "health_card_renewal": {
-                "en": [
-                    # Direct terms
-                    "health card", "renew", "renewal", "health insurance", "medical card", "health coverage", "insurance renewal",
-                    # Variations and synonyms
-                    "health certificate", "medical certificate", "healthcare card", "health benefits", "medical benefits",
-                    "insurance card", "medical insurance", "health plan", "coverage renewal", "benefits renewal",
-                    "health card expired", "health card expiry", "health card update", "medical coverage expired",
-                    # Context-specific phrases
-                    "need to renew my health", "health card is expired", "update my medical", "extend my health",
-                    "my insurance has expired", "health benefits renewal", "medical coverage renewal"
-                ],
-                "ar": [
-                    "بطاقة صحية", "تجديد", "تأمين صحي", "بطاقة طبية", "تغطية صحية", "تأمين طبي",
-                    "شهادة صحية", "بطاقة التأمين", "التأمين الطبي", "الخدمات الصحية", "المنافع الطبية",
-                    "بطاقة صحية منتهية", "انتهت بطاقتي الصحية", "تحديث البطاقة الصحية", "تمديد التأمين",
-                    "أريد تجديد البطاقة", "البطاقة الصحية انتهت", "تجديد التأمين الصحي"
-                ]
-            },
-            "id_card_replacement": {
-                "en": [
-                    # Direct terms
-                    "id card", "identity", "replace", "lost id", "damaged id", "identity card", "national id", "replacement",
-                    # Variations
-                    "identity document", "personal id", "government id", "citizenship card", "id document",
-                    "new id card", "id card copy", "duplicate id", "id card renewal", "identity renewal",
-                    # Context-specific
-                    "lost my id", "id card damaged", "need new id", "replace my identity", "id card broken",
-                    "stolen id card", "id card missing", "duplicate identity card", "new identity document"
-                ],
-                "ar": [
-                    "بطاقة هوية", "استبدال", "هوية مفقودة", "بطاقة تالفة", "هوية وطنية", "بطاقة شخصية",
-                    "وثيقة هوية", "هوية شخصية", "بطاقة حكومية", "بطاقة مواطنة", "وثيقة شخصية",
-                    "ضاعت هويتي", "بطاقة الهوية تالفة", "أحتاج هوية جديدة", "استبدال الهوية", "بطاقة مكسورة",
-                    "سرقت بطاقة الهوية", "هوية مفقودة", "نسخة من الهوية", "بطاقة هوية جديدة"
-                ]
-            },
-            "medical_consultation": {
-                "en": [
-                    # Direct terms
-                    "doctor", "appointment", "medical", "consultation", "doctor visit", "see doctor", "medical appointment", "clinic",
-                    # Variations
-                    "physician", "medical exam", "checkup", "health checkup", "medical consultation", "doctor consultation",
-                    "book appointment", "schedule appointment", "medical visit", "health consultation", "specialist",
-                    # Context-specific
-                    "need to see a doctor", "book medical appointment", "health problem", "medical issue",
-                    "doctor's appointment", "medical emergency", "health concern", "need medical help",
-                    "schedule with doctor", "visit clinic", "see specialist", "medical examination"
-                ],
-                "ar": [
-                    "طبيب", "موعد", "استشارة", "طبية", "زيارة طبيب", "عيادة", "موعد طبي", "فحص طبي",
-                    "دكتور", "فحص صحي", "استشارة طبية", "كشف طبي", "أخصائي", "طبيب مختص",
-                    "أحتاج طبيب", "حجز موعد طبي", "مشكلة صحية", "مشكلة طبية", "موعد الطبيب",
-                    "زيارة العيادة", "فحص عند الطبيب", "استشارة صحية", "طوارئ طبية", "مساعدة طبية",
-                    "حجز مع الطبيب", "رؤية الطبيب", "كشف عند الدكتور"
-                ]
-            },
-            "student_enrollment": {
-                "en": [
-                    # Direct terms
-                    "enroll", "student", "course", "register", "education", "enrollment", "university", "school", "study",
-                    # Variations
-                    "registration", "admission", "academic", "college", "institute", "program", "degree", "classes",
-                    "semester", "academic year", "student registration", "course registration", "class enrollment",
-                    # Context-specific
-                    "want to study", "apply for course", "join university", "student application", "academic admission",
-                    "register for classes", "enroll in program", "education program", "learning program",
-                    "student services", "academic services", "course application", "study application"
-                ],
-                "ar": [
-                    "تسجيل", "طالب", "دورة", "تعليم", "التحاق", "جامعة", "مدرسة", "دراسة", "قبول",
-                    "تسجيل الطلاب", "قبول جامعي", "أكاديمي", "كلية", "معهد", "برنامج", "شهادة", "صفوف",
-                    "فصل دراسي", "سنة أكاديمية", "تسجيل الدورة", "تسجيل الصف", "الالتحاق بالبرنامج",
-                    "أريد الدراسة", "التقديم للدورة", "الانضمام للجامعة", "طلب الطالب", "قبول أكاديمي",
-                    "تسجيل في الصفوف", "تسجيل في البرنامج", "برنامج تعليمي", "برنامج التعلم",
-                    "خدمات الطلاب", "خدمات أكاديمية", "طلب الدورة", "طلب الدراسة"
-                ]
-            }
+        normalized = normalize_text(text) if normalized is None else normalized
+        detected_intent, confidence = self._score_intents(normalized, language)
+        service_id = detected_intent.replace("_", "-") if detected_intent not in ["general_inquiry", "greeting"] else None
+        
+        return {
+            "intent": detected_intent,
+            "confidence": confidence,
+            "service_id": service_id,
+            "entities": self._extract_entities(text, language, normalized)
         }
+
+    def _score_intents_uncached(self, normalized: str, language: str):
+        """(intent, confidence) for normalized text; a pure function, memoised per instance"""
+        tables = self._intent_tables.get(language, self._intent_tables["en"])
         
         # Advanced scoring algorithm with multiple factors
         max_score = 0
         detected_intent = "general_inquiry"
-        best_matches = []
         
-        for intent, patterns in intent_patterns.items():
-            words = patterns.get(language, patterns["en"])
-            
-            # Multiple scoring factors
-            exact_word_matches = sum(1 for word in words if word in text_lower)
-            phrase_matches = sum(2 for word in words if len(word.split()) > 1 and word in text_lower)
-            partial_matches = sum(0.5 for word in words if any(part in text_lower for part in word.split()))
+        for intent, terms in tables:
+            exact_word_matches = phrase_matches = partial_matches = 0
+            for term, parts in terms:
+                if term in normalized:
+                    exact_word_matches += 1
+                    if len(parts) > 1:
+                        phrase_matches += 2
+                    partial_matches += 0.5
+                elif len(parts) > 1 and any(part in normalized for part in parts):
+                    partial_matches += 0.5
             
             # Contextual bonus scoring
-            context_bonus = 0
-            if intent == "health_card_renewal" and any(term in text_lower for term in ["expired", "expire", "old", "update"]):
-                context_bonus += 1
-            elif intent == "id_card_replacement" and any(term in text_lower for term in ["lost", "missing", "stolen", "damaged", "broken"]):
-                context_bonus += 1
-            elif intent == "medical_consultation" and any(term in text_lower for term in ["sick", "pain", "problem", "issue", "emergency"]):
-                context_bonus += 1
-            elif intent == "student_enrollment" and any(term in text_lower for term in ["apply", "application", "join", "start"]):
-                context_bonus += 1
+            context_bonus = 1 if any(term in normalized for term in self._context_terms.get(intent, ())) else 0
             
             # Calculate total score with weights
             total_score = (exact_word_matches * 1.0) + (phrase_matches * 1.5) + (partial_matches * 0.3) + (context_bonus * 0.8)
@@ -550,7 +3337,6 @@ Analyze the user's message and return the result in JSON format:
             if total_score > max_score:
                 max_score = total_score
                 detected_intent = intent
-                best_matches = [word for word in words if word in text_lower]
         
         # Enhanced confidence calculation
         if max_score >= 3:
@@ -562,67 +3348,33 @@ Analyze the user's message and return the result in JSON format:
         else:
             confidence = 0.5
         
-        # Enhanced greeting detection with cultural variations
-        greetings = {
-            "en": [
-                "hello", "hi", "hey", "good morning", "good afternoon", "good evening", "greetings",
-                "howdy", "what's up", "how are you", "good day", "nice to meet you", "pleased to meet you",
-                "how do you do", "how's it going", "how's everything", "salutations", "hiya"
-            ],
-            "ar": [
-                "مرحبا", "أهلا", "السلام عليكم", "صباح الخير", "مساء الخير", "أهلا وسهلا",
-                "حياك الله", "أهلا بك", "مرحبا بك", "تحية طيبة", "السلام عليكم ورحمة الله",
-                "صباح النور", "مساء النور", "كيف الحال", "كيف حالك", "أسعد الله مساءك"
-            ]
-        }
-        
         # Check for greetings with enhanced detection
         if max_score == 0:
-            greeting_words = greetings.get(language, greetings["en"])
-            greeting_matches = sum(1 for word in greeting_words if word in text_lower)
+            greeting_words = self._greetings.get(language, self._greetings["en"])
+            greeting_matches = sum(1 for word in greeting_words if word in normalized)
             
             if greeting_matches > 0:
                 detected_intent = "greeting"
                 confidence = min(0.85 + (greeting_matches * 0.05), 0.95)
             else:
                 # Check for question words that might indicate general inquiry
-                question_words = {
-                    "en": ["what", "how", "when", "where", "why", "who", "which", "can you", "could you", "do you"],
-                    "ar": ["ما", "كيف", "متى", "أين", "لماذا", "من", "أي", "هل يمكن", "هل تستطيع", "ماذا"]
-                }
-                
-                q_words = question_words.get(language, question_words["en"])
-                if any(word in text_lower for word in q_words):
+                q_words = self._question_words.get(language, self._question_words["en"])
+                if any(word in normalized for word in q_words):
                     detected_intent = "general_inquiry"
                     confidence = 0.7
                 else:
                     confidence = 0.5
         
-        service_id = detected_intent.replace("_", "-") if detected_intent not in ["general_inquiry", "greeting"] else None
-        
-        return {
-            "intent": detected_intent,
-            "confidence": confidence,
-            "service_id": service_id,
-            "entities": self._extract_entities(text, language)
-        }
+        return detected_intent, confidence
 
-    def _extract_entities(self, text: str, language: str) -> Dict[str, Any]:
+    def _extract_entities(self, text: str, language: str, normalized: str = None) -> Dict[str, Any]:
         """Enhanced entity extraction with comprehensive pattern matching"""
         entities = {}
-        import re
-        
-        # Enhanced phone number extraction with international formats
-        phone_patterns = [
-            r'(\+?\d{1,3}[-.\s]?)?\(?\d{3}\)?[-.\s]?\d{3}[-.\s]?\d{4}',  # US format
-            r'(\+?\d{1,3}[-.\s]?)?\d{2,3}[-.\s]?\d{3,4}[-.\s]?\d{4}',    # International
-            r'(\+?\d{1,3})?\s?\d{9,}',                                    # Simple international
-            r'(\d{3}[-.\s]?\d{3}[-.\s]?\d{4})',                         # Simple US
-            r'(\+\d{1,3}[-.\s]?\d{1,14})',                              # E.164 format
-        ]
+        normalized = normalize_text(text) if normalized is None else normalized
         
-        for pattern in phone_patterns:
-            phones = re.findall(pattern, text)
+        # Phone numbers are matched on the normalized text so Arabic-Indic digits come out as ASCII
+        for pattern in self.PHONE_PATTERNS:
+            phones = pattern.findall(normalized)
             if phones:
                 # Clean the phone number
                 phone = re.sub(r'[^\d+]', '', str(phones[0]))
@@ -630,32 +3382,10 @@ Analyze the user's message and return the result in JSON format:
                     entities["phone"] = phone
                     break
         
-        # Enhanced name extraction with multiple languages and patterns
-        name_extraction_patterns = {
-            "en": [
-                r'my name is (\w+(?:\s+\w+)*)',
-                r'i am (\w+(?:\s+\w+)*)',
-                r"i'm (\w+(?:\s+\w+)*)",
-                r'name[:\s]+(\w+(?:\s+\w+)*)',
-                r'called (\w+(?:\s+\w+)*)',
-                r'this is (\w+(?:\s+\w+)*)',
-                r'(\w+(?:\s+\w+)*) here',
-                r'speaking with (\w+(?:\s+\w+)*)',
-            ],
-            "ar": [
-                r'اسمي (\w+(?:\s+\w+)*)',
-                r'أنا (\w+(?:\s+\w+)*)',
-                r'انا (\w+(?:\s+\w+)*)',
-                r'الاسم[:\s]+(\w+(?:\s+\w+)*)',
-                r'يدعوني (\w+(?:\s+\w+)*)',
-                r'هذا (\w+(?:\s+\w+)*)',
-                r'(\w+(?:\s+\w+)*) هنا',
-            ]
-        }
-        
-        patterns = name_extraction_patterns.get(language, name_extraction_patterns["en"])
+        # Names keep the user's original spelling
+        patterns = self.NAME_PATTERNS.get(language, self.NAME_PATTERNS["en"])
         for pattern in patterns:
-            match = re.search(pattern, text, re.IGNORECASE)
+            match = pattern.search(text)
             if match:
                 name = match.group(1).strip()
                 # Validate name (2-50 characters, only letters and spaces)
@@ -663,66 +3393,36 @@ Analyze the user's message and return the result in JSON format:
                     entities["name"] = name
                     break
         
-        # Enhanced date and time extraction
-        date_time_patterns = {
-            "en": {
-                "days": ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"],
-                "times": ["morning", "afternoon", "evening", "night", "noon", "midnight"],
-                "relative": ["today", "tomorrow", "next week", "next month", "this week", "this month"],
-                "specific_times": r'\b\d{1,2}:\d{2}\s?(?:am|pm|AM|PM)?\b',
-                "dates": r'\b\d{1,2}[/\-\.]\d{1,2}[/\-\.]\d{2,4}\b'
-            },
-            "ar": {
-                "days": ["الاثنين", "الثلاثاء", "الأربعاء", "الخميس", "الجمعة", "السبت", "الأحد"],
-                "times": ["صباحاً", "مساءً", "ليلاً", "ظهراً", "العصر", "المغرب"],
-                "relative": ["اليوم", "غدا", "غداً", "الأسبوع القادم", "الشهر القادم", "هذا الأسبوع"],
-                "specific_times": r'\b\d{1,2}:\d{2}\b',
-                "dates": r'\b\d{1,2}[/\-\.]\d{1,2}[/\-\.]\d{2,4}\b'
-            }
-        }
-        
-        dt_patterns = date_time_patterns.get(language, date_time_patterns["en"])
-        
-        # Extract days
-        found_days = [day for day in dt_patterns["days"] if day in text.lower()]
-        if found_days:
-            entities["preferred_day"] = found_days[0]
-        
-        # Extract time periods
-        found_times = [time for time in dt_patterns["times"] if time in text.lower()]
-        if found_times:
-            entities["preferred_time_period"] = found_times[0]
-        
-        # Extract relative dates
-        found_relative = [rel for rel in dt_patterns["relative"] if rel in text.lower()]
-        if found_relative:
-            entities["relative_date"] = found_relative[0]
+        # Keyword lookups map the normalized match back to the canonical spelling
+        dt_keywords = self._datetime_keywords.get(language, self._datetime_keywords["en"])
+        for entity, keywords in dt_keywords.items():
+            found = next((canonical for keyword, canonical in keywords if keyword in normalized), None)
+            if found:
+                entities[entity] = found
         
         # Extract specific times
-        time_matches = re.findall(dt_patterns["specific_times"], text)
+        time_matches = self.SPECIFIC_TIME_PATTERNS.get(language, self.SPECIFIC_TIME_PATTERNS["en"]).findall(normalized)
         if time_matches:
             entities["specific_time"] = time_matches[0]
         
         # Extract specific dates
-        date_matches = re.findall(dt_patterns["dates"], text)
+        date_matches = self.SPECIFIC_DATE_PATTERN.findall(normalized)
         if date_matches:
             entities["specific_date"] = date_matches[0]
         
+        # Resolve a concrete date/time when one is mentioned
+        requested = datetime_parser.parse(normalized)
+        if requested:
+            entities["datetime"] = requested.iso
+        
         # Extract email addresses
-        email_pattern = r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b'
-        emails = re.findall(email_pattern, text)
+        emails = self.EMAIL_PATTERN.findall(text)
         if emails:
             entities["email"] = emails[0]
         
         # Extract age if mentioned
-        age_patterns = [
-            r'(\d{1,3})\s*(?:years?\s*old|yr|years)',
-            r'age[:\s]*(\d{1,3})',
-            r'i am (\d{1,3})'
-        ]
-        
-        for pattern in age_patterns:
-            age_match = re.search(pattern, text, re.IGNORECASE)
+        for pattern in self.AGE_PATTERNS:
+            age_match = pattern.search(normalized)
             if age_match:
                 age = int(age_match.group(1))
                 if 1 <= age <= 120:  # Reasonable age range
@@ -730,25 +3430,13 @@ Analyze the user's message and return the result in JSON format:
                     break
         
         # Extract urgency indicators
-        urgency_patterns = {
-            "en": ["urgent", "emergency", "asap", "immediately", "quickly", "rush", "priority"],
-            "ar": ["عاجل", "طارئ", "فوري", "سريع", "مستعجل", "أولوية"]
-        }
-        
-        urgency_words = urgency_patterns.get(language, urgency_patterns["en"])
-        if any(word in text.lower() for word in urgency_words):
+        urgency_words = self._urgency_words.get(language, self._urgency_words["en"])
+        if any(word in normalized for word in urgency_words):
             entities["urgency"] = "high"
         
         # Extract location mentions
-        location_patterns = [
-            r'at (\w+(?:\s+\w+)*)',
-            r'in (\w+(?:\s+\w+)*)',
-            r'from (\w+(?:\s+\w+)*)',
-            r'location[:\s]*(\w+(?:\s+\w+)*)'
-        ]
-        
-        for pattern in location_patterns:
-            location_match = re.search(pattern, text, re.IGNORECASE)
+        for pattern in self.LOCATION_PATTERNS:
+            location_match = pattern.search(text)
             if location_match:
                 location = location_match.group(1).strip()
                 if len(location) >= 2 and len(location) <= 50:
@@ -762,21 +3450,28 @@ Analyze the user's message and return the result in JSON format:
         try:
             # Try Mistral first, fall back to rule-based
             if await self.ensure_model_available():
-                return await self._generate_with_mistral(user_input, session_data, language, context)
+                answer, passages = self._knowledge_answer(user_input, language) if session_data.step != "booking" else (None, [])
+                unsure = intent_result.get("confidence", 0.0) < self.intent_confidence_threshold
+                if answer and (unsure or intent_result.get("intent") == "general_inquiry"):
+                    # A confidently matched FAQ question needs no generation at all
+                    return {"message": answer, "session_data": session_data}
+                if intent_result.get("service_id"):
+                    session_data.selected_service = intent_result["service_id"]
+                return await self._generate_with_mistral(user_input, session_data, language, context, passages)
             else:
-                return self._generate_with_rules(user_input, session_data, intent_result, language, context)
+                return await self._generate_with_rules(user_input, session_data, intent_result, language, context)
             
         except Exception as e:
             logger.error(f"Error generating response: {e}")
-            fallback_message = "I apologize, but I'm having trouble processing your request. Please try again." if language == "en" else "أعتذر، أواجه مشكلة في معالجة طلبك. يرجى المحاولة مرة أخرى."
             return {
-                "message": fallback_message,
+                "message": response_templates.render("error", language),
                 "session_data": session_data
             }
 
-    async def _generate_with_mistral(self, user_input: str, session_data: SessionData, language: str, context: Dict = None) -> Dict[str, Any]:
-        """Generate response using Mistral model with enhanced context"""
-        system_prompt = self._get_response_generation_prompt(session_data, language, context)
+    async def _generate_with_mistral(self, user_input: str, session_data: SessionData, language: str, context: Dict = None,
+                                     passages: List[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Generate response using Mistral model with enhanced context, grounded on knowledge base passages"""
+        system_prompt = self._get_response_generation_prompt(session_data, language, context, passages)
         user_prompt = f"User input: {user_input}"
         
         response = await asyncio.to_thread(
@@ -791,258 +3486,179 @@ Analyze the user's message and return the result in JSON format:
             "session_data": session_data
         }
 
-    def _generate_with_rules(self, user_input: str, session_data: SessionData, intent_result: Dict, language: str, context: Dict = None) -> Dict[str, Any]:
-        """Enhanced rule-based response generation with sophisticated conversation flow"""
-        
-        # Enhanced conversation flow state management
-        if session_data.step == "greeting" or not session_data.intent:
-            return self._handle_greeting_backend(user_input, intent_result, session_data, language)
-        elif session_data.step == "service_selection":
-            return self._handle_service_selection_backend(user_input, session_data, language)
-        elif session_data.step == "booking":
-            return self._handle_booking_backend(user_input, session_data, language)
-        elif session_data.step == "confirmation":
-            return self._handle_confirmation_backend(user_input, session_data, language)
-        elif session_data.step == "general_inquiry":
-            return self._handle_general_inquiry_backend(user_input, session_data, intent_result, language)
-        else:
-            return self._handle_fallback_backend(user_input, session_data, language)
-
-    def _handle_general_inquiry_backend(self, user_input: str, session_data: SessionData, intent_result: Dict, language: str) -> Dict[str, Any]:
-        """Handle general inquiries with context-aware responses"""
+    def _wants_knowledge(self, intent_result: Dict) -> bool:
+        """Whether a rule-based turn is worth a knowledge base lookup: never for greetings or
+        confident matches on another intent, which have their own replies"""
+        intent = intent_result.get("intent")
+        if intent == "general_inquiry":
+            return True
+        return intent != "greeting" and intent_result.get("confidence", 0.0) < self.intent_confidence_threshold
+
+    def _knowledge_answer(self, user_input: str, language: str) -> Tuple[Optional[str], List[Dict[str, Any]]]:
+        """(direct answer or None, passages for grounding): BM25 first; when it declines a near-tie on
+        an FAQ passage, the nearest FAQ phrasing may confirm that top passage, never pick another"""
+        answer, passages = knowledge_base.answer(user_input, language)
+        if answer is None and passages and passages[0]["source"] != "catalogue":
+            top = passages[0]
+            nearest = semantic_index.nearest_faq(user_input, language)
+            if nearest and nearest["label"] == f"{top['source']}/{top['id']}/{language}":
+                answer = top["answer"]
+        return answer, passages
+
+    def _compile_flow_state(self, spec: Dict[str, Any]):
+        """(handler, validator, accepts_new_intent) with the methods bound once"""
+        validator = spec.get("validator")
+        return getattr(self, spec["handler"]), getattr(self, validator) if validator else None, spec.get("accepts_new_intent", False)
+
+    @staticmethod
+    def flow_state(session_data: SessionData) -> str:
+        if session_data.step == "booking":
+            return f"booking.{session_data.booking_step or 'name'}"
+        return session_data.step
+
+    async def _generate_with_rules(self, user_input: str, session_data: SessionData, intent_result: Dict, language: str, context: Dict = None) -> Dict[str, Any]:
+        """Rule-based response generation: one table lookup per turn (see FLOW_STATES)"""
+        normalized = intent_result.get("normalized_text") or normalize_text(user_input)
+        state = self.flow_state(session_data)
+        now = datetime.utcnow()
+        if session_data.state_entered_at is None:
+            session_data.state_entered_at = now
+            flow_metrics.record_entry(state)
         
-        # Enhanced response templates for different types of inquiries
-        inquiry_responses = {
-            "en": {
-                "working_hours": "Our working hours vary by service:\n\n🏥 **Health Services**: 8:00 AM - 4:00 PM (Mon-Fri)\n🆔 **ID Services**: 8:00 AM - 3:00 PM (Sun, Tue, Thu)\n👩‍⚕️ **Medical Services**: 9:00 AM - 5:00 PM (Sun-Thu)\n🎓 **Education Services**: 8:00 AM - 2:00 PM (Sun-Thu)\n💬 **General Inquiries**: 24/7\n\nHow can I help you today?",
-                "services_overview": "I can help you with these services:\n\n🏥 **Health Card Renewal** (30 min, appointment required)\n🆔 **ID Card Replacement** (45 min, appointment required)\n👩‍⚕️ **Medical Consultation** (20 min, appointment required)\n🎓 **Student Enrollment** (60 min, appointment required)\n💬 **General Inquiries** (10 min, no appointment needed)\n\nWhich service would you like to know more about?",
-                "contact_info": "You can reach us through:\n\n📧 **Email**: support@mind14.com\n📱 **Phone**: +1-800-MIND14\n🌐 **Website**: www.mind14.com\n📍 **Address**: Virtual Front Desk - Available 24/7\n\nI'm here to help you right now! What do you need?",
-                "appointment_info": "Here's how appointments work:\n\n✅ **Required for**: Health Card Renewal, ID Replacement, Medical Consultation, Student Enrollment\n⏰ **Booking**: I can help you book right now\n📋 **Requirements**: Valid ID and relevant documents\n🔄 **Rescheduling**: Contact us 24 hours in advance\n\nWould you like to book an appointment?",
-                "default": "I understand you have a question. As your virtual assistant, I'm here to help with various services including health card renewals, ID replacements, medical appointments, and student enrollment. Could you tell me more specifically what you need help with?"
-            },
-            "ar": {
-                "working_hours": "ساعات العمل تختلف حسب الخدمة:\n\n🏥 **الخدمات الصحية**: 8:00 ص - 4:00 م (الاثنين-الجمعة)\n🆔 **خدمات الهوية**: 8:00 ص - 3:00 م (الأحد، الثلاثاء، الخميس)\n👩‍⚕️ **الخدمات الطبية**: 9:00 ص - 5:00 م (الأحد-الخميس)\n🎓 **الخدمات التعليمية**: 8:00 ص - 2:00 م (الأحد-الخميس)\n💬 **الاستفسارات العامة**: 24/7\n\nكيف يمكنني مساعدتك اليوم؟",
-                "services_overview": "يمكنني مساعدتك في هذه الخدمات:\n\n🏥 **تجديد البطاقة الصحية** (30 دقيقة، يتطلب موعد)\n🆔 **استبدال بطاقة الهوية** (45 دقيقة، يتطلب موعد)\n👩‍⚕️ **الاستشارة الطبية** (20 دقيقة، يتطلب موعد)\n🎓 **تسجيل الطلاب** (60 دقيقة، يتطلب موعد)\n💬 **الاستفسارات العامة** (10 دقائق، لا يتطلب موعد)\n\nأي خدمة تريد معرفة المزيد عنها؟",
-                "contact_info": "يمكنك التواصل معنا عبر:\n\n📧 **البريد الإلكتروني**: support@mind14.com\n📱 **الهاتف**: +1-800-MIND14\n🌐 **الموقع**: www.mind14.com\n📍 **العنوان**: مكتب الاستقبال الافتراضي - متاح 24/7\n\nأنا هنا لمساعدتك الآن! ماذا تحتاج؟",
-                "appointment_info": "إليك كيفية عمل المواعيد:\n\n✅ **مطلوب لـ**: تجديد البطاقة الصحية، استبدال الهوية، الاستشارة الطبية، تسجيل الطلاب\n⏰ **الحجز**: يمكنني مساعدتك في الحجز الآن\n📋 **المتطلبات**: هوية صالحة والوثائق ذات الصلة\n🔄 **إعادة الجدولة**: اتصل بنا قبل 24 ساعة\n\nهل تريد حجز موعد؟",
-                "default": "أفهم أن لديك سؤال. كمساعدك الافتراضي، أنا هنا للمساعدة في خدمات مختلفة بما في ذلك تجديد البطاقة الصحية، استبدال الهوية، المواعيد الطبية، وتسجيل الطلاب. هل يمكنك إخباري بالتحديد عما تحتاج مساعدة فيه؟"
-            }
-        }
+        handler, validator, accepts_new_intent = self._flow.get(state, self._fallback_flow)
+        service_id = intent_result.get("service_id")
+        if (accepts_new_intent and service_id and service_id != session_data.selected_service
+                and intent_result.get("confidence", 0.0) >= self.intent_confidence_threshold):
+            # A new, confidently detected service request restarts the flow with that service
+            handler = self._handle_greeting_backend
         
-        # Analyze the inquiry type based on keywords
-        inquiry_type = "default"
-        text_lower = user_input.lower()
+        started = time.perf_counter()
+        invalid = validator(user_input, normalized) if validator else None
+        if invalid:
+            # Stay in the state and re-prompt with the step's template for this failure
+            response = {"message": response_templates.render(session_data.step, language, invalid), "session_data": session_data}
+        else:
+            response = await handler(user_input, session_data, intent_result, language, normalized)
+        flow_metrics.record_turn(state, time.perf_counter() - started, valid=invalid is None)
+        
+        session_data = response["session_data"]
+        next_state = self.flow_state(session_data)
+        if next_state != state:
+            flow_metrics.record_transition(state, next_state, (now - session_data.state_entered_at).total_seconds())
+            session_data.state_entered_at = now
+        return response
+
+    def _validate_name(self, user_input: str, normalized: str) -> Optional[str]:
+        """Re-prompt variant when the reply cannot be a person's name"""
+        name = user_input.strip()
+        return None if 2 <= len(name) <= 60 and self.NAME_PATTERN.match(name) else "invalid_name"
+
+    def _validate_phone(self, user_input: str, normalized: str) -> Optional[str]:
+        """Re-prompt variant unless the reply holds 7-15 digits (any digit script)"""
+        digits = sum(char.isdigit() for char in normalized)
+        return None if 7 <= digits <= 15 else "invalid_phone"
+
+    async def _handle_general_inquiry_backend(self, user_input: str, session_data: SessionData, intent_result: Dict, language: str, normalized: str) -> Dict[str, Any]:
+        """Handle general inquiries with context-aware responses"""
+        answer = self._knowledge_answer(user_input, language)[0] if self._wants_knowledge(intent_result) else None
+        if answer:
+            return {"message": answer, "session_data": session_data}
         
-        # Detect inquiry type
-        if any(word in text_lower for word in ["hours", "time", "when", "open", "close", "ساعات", "وقت", "متى", "مفتوح", "مغلق"]):
-            inquiry_type = "working_hours"
-        elif any(word in text_lower for word in ["services", "what", "help", "do", "خدمات", "ماذا", "مساعدة", "تساعد"]):
-            inquiry_type = "services_overview"
-        elif any(word in text_lower for word in ["contact", "phone", "email", "address", "reach", "تواصل", "هاتف", "بريد", "عنوان"]):
-            inquiry_type = "contact_info"
-        elif any(word in text_lower for word in ["appointment", "booking", "schedule", "موعد", "حجز", "جدولة"]):
-            inquiry_type = "appointment_info"
+        # Otherwise analyze the inquiry type based on keywords
+        inquiry_type = next(
+            (kind for kind, words in self._inquiry_keywords if any(word in normalized for word in words)),
+            "default"
+        )
         
-        current_responses = inquiry_responses[language]
-        message = current_responses[inquiry_type]
+        message = response_templates.render("general_inquiry", language, inquiry_type)
         
         return {"message": message, "session_data": session_data}
 
-    def _handle_confirmation_backend(self, user_input: str, session_data: SessionData, language: str) -> Dict[str, Any]:
+    async def _handle_confirmation_backend(self, user_input: str, session_data: SessionData, intent_result: Dict, language: str, normalized: str) -> Dict[str, Any]:
         """Handle appointment confirmation and follow-up"""
-        
-        confirmation_words = {
-            "en": ["yes", "confirm", "correct", "right", "okay", "ok", "sure", "proceed"],
-            "ar": ["نعم", "أكد", "صحيح", "موافق", "حسنا", "متابعة", "استمر"]
-        }
-        
-        is_confirming = any(word in user_input.lower() for word in confirmation_words[language])
+        is_confirming = self._confirmation_pattern[language].search(normalized) is not None
         
         if is_confirming:
-            if language == "ar":
-                message = """✅ **تم تأكيد الموعد!**
-
-📧 ستتلقى تأكيداً عبر البريد الإلكتروني والرسائل النصية خلال 10 دقائق.
-📋 احضر معك الوثائق المطلوبة والهوية الصالحة.
-⏰ يرجى الحضور قبل 15 دقيقة من موعدك.
-
-🔄 **إذا احتجت لتغيير الموعد:**
-- اتصل بنا قبل 24 ساعة على الأقل
-- استخدم رقم الموعد للمرجع
-
-هل تحتاج مساعدة في أي شيء آخر؟"""
-            else:
-                message = """✅ **Appointment Confirmed!**
-
-📧 You'll receive confirmation via email and SMS within 10 minutes.
-📋 Please bring required documents and valid ID.
-⏰ Please arrive 15 minutes before your appointment.
-
-🔄 **If you need to reschedule:**
-- Contact us at least 24 hours in advance
-- Use your appointment ID for reference
-
-Is there anything else I can help you with?"""
-            
+            message = response_templates.render("confirmation", language, "confirmed")
             session_data.step = "completed"
         else:
-            if language == "ar":
-                message = "هل تريد تأكيد الموعد أم تفضل تعديل التفاصيل؟ يمكنني مساعدتك في أي تغييرات تحتاجها."
-            else:
-                message = "Would you like to confirm the appointment or would you prefer to modify the details? I can help you with any changes you need."
+            message = response_templates.render("confirmation", language, "ask")
         
         return {"message": message, "session_data": session_data}
 
-    def _handle_fallback_backend(self, user_input: str, session_data: SessionData, language: str) -> Dict[str, Any]:
+    async def _handle_fallback_backend(self, user_input: str, session_data: SessionData, intent_result: Dict, language: str, normalized: str) -> Dict[str, Any]:
         """Enhanced fallback handler with context awareness"""
-        
-        fallback_responses = {
-            "en": [
-                "I understand you need assistance. Could you please tell me which of these services you're interested in: Health Card Renewal, ID Card Replacement, Medical Consultation, Student Enrollment, or General Information?",
-                "I'm here to help! Can you clarify what specific service you need? I can assist with health cards, ID replacements, medical appointments, student enrollment, or answer general questions.",
-                "Let me help you find the right service. Are you looking for help with health services, identification documents, medical appointments, educational enrollment, or do you have a general question?",
-            ],
-            "ar": [
-                "أفهم أنك تحتاج مساعدة. هل يمكنك إخباري أي من هذه الخدمات تهمك: تجديد البطاقة الصحية، استبدال بطاقة الهوية، الاستشارة الطبية، تسجيل الطلاب، أو معلومات عامة؟",
-                "أنا هنا للمساعدة! هل يمكنك توضيح الخدمة المحددة التي تحتاجها؟ يمكنني المساعدة في البطاقات الصحية، استبدال الهوية، المواعيد الطبية، تسجيل الطلاب، أو الإجابة على الأسئلة العامة.",
-                "دعني أساعدك في العثور على الخدمة المناسبة. هل تبحث عن مساعدة في الخدمات الصحية، وثائق الهوية، المواعيد الطبية، التسجيل التعليمي، أم لديك سؤال عام؟",
-            ]
-        }
-        
-        import random
-        responses = fallback_responses[language]
-        message = random.choice(responses)
+        message = response_templates.render("fallback", language)
         
         # Reset to intent detection step
         session_data.step = "intent_detection"
         
         return {"message": message, "session_data": session_data}
 
-    def _handle_greeting_backend(self, user_input: str, intent_result: Dict, session_data: SessionData, language: str) -> Dict[str, Any]:
+    @staticmethod
+    def _service_values(service: ServiceInfo, language: str) -> Dict[str, Any]:
+        """Template fields describing a service"""
+        return {
+            "service_name": service.name[language],
+            "service_icon": service.icon,
+            "service_description": service.description[language],
+            "estimated_time": service.estimated_time,
+            "hours_start": service.working_hours["start"],
+            "hours_end": service.working_hours["end"]
+        }
+
+    async def _handle_greeting_backend(self, user_input: str, session_data: SessionData, intent_result: Dict, language: str, normalized: str) -> Dict[str, Any]:
         """Handle greeting with backend logic"""
         service = None
         if intent_result.get("service_id"):
             service = next((s for s in AVAILABLE_SERVICES if s.id == intent_result["service_id"]), None)
         
-        if language == "ar":
-            if service:
-                message = f"""مرحباً! أفهم أنك تحتاج مساعدة في **{service.name[language]}**.
-
-🕒 **تفاصيل الخدمة:**
-• المدة المقدرة: {service.estimated_time} دقيقة
-• {service.icon} {service.description[language]}
-
-{'📅 تتطلب هذه الخدمة حجز موعد.' if service.requires_appointment else '💬 هذه خدمة استفسار عام.'}
-
-هل تريد المتابعة مع هذه الخدمة؟"""
-                session_data.step = "service_selection"
-                session_data.selected_service = service.id
-            else:
-                message = """مرحباً! أنا MIND14، مساعدك الافتراضي الذكي.
-
-🏛️ **يمكنني مساعدتك في:**
-• 🏥 تجديد البطاقة الصحية
-• 🆔 استبدال بطاقة الهوية
-• 👩‍⚕️ حجز المواعيد الطبية
-• 🎓 تسجيل الطلاب
-• 💬 الاستفسارات العامة
-
-كيف يمكنني مساعدتك اليوم؟"""
-                session_data.step = "intent_detection"
+        # A question the knowledge base answers beats an unsure service guess
+        answer = self._knowledge_answer(user_input, language)[0] if self._wants_knowledge(intent_result) else None
+        
+        if answer:
+            message = answer
+            session_data.step = "general_inquiry"
+        elif service:
+            note = "appointment_required" if service.requires_appointment else "no_appointment"
+            message = response_templates.render(
+                "greeting", language, "service",
+                appointment_note=response_templates.render("greeting", language, note),
+                **self._service_values(service, language)
+            )
+            session_data.step = "service_selection"
+            session_data.selected_service = service.id
         else:
-            if service:
-                message = f"""Hello! I understand you need help with **{service.name[language]}**.
-
-🕒 **Service Details:**
-• Estimated time: {service.estimated_time} minutes
-• {service.icon} {service.description[language]}
-
-{'📅 This service requires an appointment.' if service.requires_appointment else '💬 This is a general inquiry service.'}
-
-Would you like to proceed with this service?"""
-                session_data.step = "service_selection"
-                session_data.selected_service = service.id
-            else:
-                message = """Hello! I'm MIND14, your AI virtual assistant.
-
-🏛️ **I can help you with:**
-• 🏥 Health card renewal
-• 🆔 ID card replacement
-• 👩‍⚕️ Medical appointments
-• 🎓 Student enrollment
-• 💬 General inquiries
-
-How can I assist you today?"""
-                session_data.step = "intent_detection"
+            message = response_templates.render("greeting", language, "welcome")
+            session_data.step = "intent_detection"
         
         session_data.intent = intent_result.get("intent")
         session_data.confidence = intent_result.get("confidence", 0.0)
         
         return {"message": message, "session_data": session_data}
 
-    def _handle_service_selection_backend(self, user_input: str, session_data: SessionData, language: str) -> Dict[str, Any]:
+    async def _handle_service_selection_backend(self, user_input: str, session_data: SessionData, intent_result: Dict, language: str, normalized: str) -> Dict[str, Any]:
         """Handle service selection with backend logic"""
-        confirmation_words = {
-            "en": ["yes", "sure", "ok", "okay", "proceed", "continue", "confirm"],
-            "ar": ["نعم", "موافق", "حسنا", "متابعة", "استمر", "أكد", "موافقة"]
-        }
-        
-        is_confirming = any(word in user_input.lower() for word in confirmation_words[language])
+        is_confirming = self._proceed_pattern[language].search(normalized) is not None
         
         if is_confirming and session_data.selected_service:
             service = next((s for s in AVAILABLE_SERVICES if s.id == session_data.selected_service), None)
             
             if service and service.requires_appointment:
-                if language == "ar":
-                    message = f"""ممتاز! سأساعدك في حجز موعد لـ **{service.name[language]}**.
-
-📋 **المعلومات المطلوبة:**
-• الاسم الكامل
-• رقم الهاتف
-• التاريخ والوقت المفضل
-
-⏰ **ساعات العمل:** {service.working_hours['start']} - {service.working_hours['end']}
-
-لنبدأ - ما هو اسمك الكامل؟"""
-                else:
-                    message = f"""Great! I'll help you book an appointment for **{service.name[language]}**.
-
-📋 **Required Information:**
-• Full name
-• Phone number
-• Preferred date and time
-
-⏰ **Working hours:** {service.working_hours['start']} - {service.working_hours['end']}
-
-Let's start - what's your full name?"""
-                
+                message = response_templates.render("service_selection", language, "booking", **self._service_values(service, language))
                 session_data.step = "booking"
                 session_data.booking_step = "name"
             else:
-                if language == "ar":
-                    message = f"""أنا هنا لمساعدتك في **{service.name[language]}**. 
-
-هذه خدمة استفسار عام، لذا يمكنك طرح أي أسئلة تريدها حول هذا الموضوع."""
-                else:
-                    message = f"""I'm here to help with **{service.name[language]}**. 
-
-This is a general inquiry service, so feel free to ask any questions you have about this topic."""
-                
+                message = response_templates.render("service_selection", language, "inquiry", **self._service_values(service, language))
                 session_data.step = "general_inquiry"
         else:
             # Show service options
-            if language == "ar":
-                services_text = "\n".join([f"{s.icon} **{s.name['ar']}** - {s.description['ar']}" for s in AVAILABLE_SERVICES])
-                message = f"يمكنني مساعدتك في الخدمات التالية:\n\n{services_text}\n\nأي خدمة تهمك؟"
-            else:
-                services_text = "\n".join([f"{s.icon} **{s.name['en']}** - {s.description['en']}" for s in AVAILABLE_SERVICES])
-                message = f"I can help you with these services:\n\n{services_text}\n\nWhich service interests you?"
-            
+            message = response_templates.render("service_selection", language, "services")
             session_data.step = "service_selection"
         
         return {"message": message, "session_data": session_data}
 
-    def _handle_booking_backend(self, user_input: str, session_data: SessionData, language: str) -> Dict[str, Any]:
+    async def _handle_booking_backend(self, user_input: str, session_data: SessionData, intent_result: Dict, language: str, normalized: str) -> Dict[str, Any]:
         """Handle booking process with backend logic"""
         booking_step = session_data.booking_step or "name"
         
@@ -1050,55 +3666,99 @@ This is a general inquiry service, so feel free to ask any questions you have ab
             session_data.collected_info["name"] = user_input
             session_data.booking_step = "phone"
             
-            if language == "ar":
-                message = f"شكراً، {user_input}! الآن أحتاج رقم هاتفك لتأكيد الموعد."
-            else:
-                message = f"Thank you, {user_input}! Now I need your phone number for appointment confirmation."
+            message = response_templates.render("booking", language, "name", name=user_input)
                 
         elif booking_step == "phone":
             session_data.collected_info["phone"] = user_input
             session_data.booking_step = "datetime"
             
-            if language == "ar":
-                message = "ممتاز! الآن أخبرني بالتاريخ والوقت المفضل. مثال: '25 يناير في الساعة 2:00 مساءً'"
+            slots = await self._offer_slots(session_data)
+            if slots:
+                message = response_templates.render("booking", language, "slots", slots=slot_engine.format_offer(slots, language))
             else:
-                message = "Perfect! Now please tell me your preferred date and time. Example: 'January 25th at 2:00 PM'"
+                message = response_templates.render("booking", language, "ask_datetime")
                 
         elif booking_step == "datetime":
-            session_data.collected_info["preferred_datetime"] = user_input
+            scheduled_datetime = None
+            notification_preferences = {
+                "email": True,
+                "sms": True,
+                "whatsapp": session_data.collected_info.get("whatsapp_consent", False),
+                "voice_call": False
+            }
+            reminder_hours_before = list(SlotEngine.REMINDER_HOURS_BEFORE)
+            
+            if session_data.offered_slots:
+                slot_id, requested = await self._resolve_slot_choice(user_input, session_data)
+                if not slot_id:
+                    if requested:
+                        slots = await self._offer_slots(session_data, after=requested.utc)
+                        variant = "slot_unavailable"
+                    else:
+                        slots = await self._offer_slots(session_data)
+                        variant = "choose_slot"
+                    message = response_templates.render("booking", language, variant, slots=slot_engine.format_offer(slots, language))
+                    return {"message": message, "session_data": session_data}
+                
+                appointment_id = appointment_id_generator.next_id()
+                slot = await slot_engine.reserve(
+                    slot_id,
+                    appointment_id,
+                    conversation_id=session_data.conversation_id,
+                    customer_info=dict(session_data.collected_info),
+                    language=language,
+                    notification_preferences=notification_preferences,
+                    reminder_hours_before=reminder_hours_before
+                )
+                if not slot:
+                    # Lost the race for this slot - offer what is still free instead of double-booking
+                    slots = await self._offer_slots(session_data)
+                    message = response_templates.render("booking", language, "slot_taken", slots=slot_engine.format_offer(slots, language))
+                    return {"message": message, "session_data": session_data}
+                
+                if reminder_scheduler:
+                    reminder_scheduler.schedule(appointment_id, slot.get("next_reminder_at"))
+                session_data.slot_id = slot_id
+                session_data.offered_slots = []
+                session_data.collected_info["preferred_datetime"] = slot_engine.format_slot(slot, language)
+                scheduled_datetime = slot["start"].replace(tzinfo=timezone.utc).isoformat()
+            else:
+                # No inventory for this service (or none could be loaded): keep the free-text request
+                session_data.collected_info["preferred_datetime"] = user_input
+                requested = datetime_parser.parse(user_input)
+                appointment_id = appointment_id_generator.next_id()
+                if requested:
+                    scheduled_datetime = requested.iso
+                    try:
+                        # Still tracked so the reminder workflow can find it
+                        appointment = await slot_engine.record_unslotted(
+                            appointment_id,
+                            session_data.selected_service,
+                            requested.utc,
+                            conversation_id=session_data.conversation_id,
+                            customer_info=dict(session_data.collected_info),
+                            language=language,
+                            notification_preferences=notification_preferences,
+                            reminder_hours_before=reminder_hours_before
+                        )
+                        if reminder_scheduler:
+                            reminder_scheduler.schedule(appointment_id, appointment.get("next_reminder_at"))
+                    except Exception as e:
+                        logger.error(f"Failed to record appointment {appointment_id}: {e}")
             
             # Generate appointment confirmation
-            appointment_id = f"APT{datetime.now().strftime('%Y%m%d%H%M%S')}"
             session_data.appointment_id = appointment_id
             
             service = next((s for s in AVAILABLE_SERVICES if s.id == session_data.selected_service), None)
             
-            if language == "ar":
-                message = f"""🎉 **تم حجز الموعد بنجاح!**
-
-📅 **تفاصيل الموعد:**
-• الخدمة: {service.name['ar'] if service else 'غير محدد'}
-• الاسم: {session_data.collected_info.get('name')}
-• الهاتف: {session_data.collected_info.get('phone')}
-• الوقت المفضل: {session_data.collected_info.get('preferred_datetime')}
-• رقم الموعد: {appointment_id}
-
-✅ ستتلقى تأكيداً عبر الرسائل النصية والبريد الإلكتروني قريباً.
-
-هل تحتاج مساعدة في أي شيء آخر؟"""
-            else:
-                message = f"""🎉 **Appointment Booked Successfully!**
-
-📅 **Appointment Details:**
-• Service: {service.name['en'] if service else 'Not specified'}
-• Name: {session_data.collected_info.get('name')}
-• Phone: {session_data.collected_info.get('phone')}
-• Preferred Time: {session_data.collected_info.get('preferred_datetime')}
-• Appointment ID: {appointment_id}
-
-✅ You will receive confirmation via SMS and email shortly.
-
-Is there anything else I can help you with?"""
+            message = response_templates.render(
+                "booking", language, "confirmed",
+                service_name=service.name[language] if service else response_templates.render("booking", language, "unknown_service"),
+                name=session_data.collected_info.get('name'),
+                phone=session_data.collected_info.get('phone'),
+                preferred_datetime=session_data.collected_info.get('preferred_datetime'),
+                appointment_id=appointment_id
+            )
             
             session_data.step = "completed"
             
@@ -1115,45 +3775,67 @@ Is there anything else I can help you with?"""
                     booking_type="new_appointment",
                     priority="normal",
                     status="confirmed",
-                    notification_preferences={
-                        "email": True,
-                        "sms": True,
-                        "whatsapp": session_data.collected_info.get("whatsapp_consent", False),
-                        "voice_call": False
-                    },
-                    scheduled_datetime=session_data.collected_info.get("preferred_datetime"),
-                    timezone="UTC",
+                    notification_preferences=notification_preferences,
+                    scheduled_datetime=scheduled_datetime or session_data.collected_info.get("preferred_datetime"),
+                    timezone=BOOKING_TIMEZONE.key if scheduled_datetime else "UTC",
                     duration_minutes=service.estimated_time if service else 30,
-                    location={
-                        "type": "office" if service and service.requires_appointment else "virtual",
-                        "address": "MIND14 Service Center" if service and service.requires_appointment else "Virtual Front Desk",
-                        "meeting_link": "" if service and service.requires_appointment else "https://meet.mind14.com/virtual-desk",
-                        "room_number": f"Room {service.icon}" if service and service.requires_appointment else ""
-                    },
+                    location=SlotEngine.booking_location(service),
                     follow_up_config={
                         "send_reminder": True,
-                        "reminder_hours_before": [24, 2],
+                        "reminder_hours_before": reminder_hours_before,
                         "send_follow_up": True,
                         "follow_up_hours_after": 24,
                         "max_reschedule_attempts": 2
                     },
                     booking_source="virtual_assistant",
-                    conversation_id=getattr(session_data, 'conversation_id', 'unknown')
+                    conversation_id=session_data.conversation_id or 'unknown'
                 ).dict()
             }
         
         return {"message": message, "session_data": session_data}
 
-    def _handle_general_backend(self, user_input: str, session_data: SessionData, language: str) -> Dict[str, Any]:
-        """Handle general inquiries with backend logic"""
-        if language == "ar":
-            message = "أفهم سؤالك. كمساعدك الافتراضي، أنا هنا لمساعدتك في خدمات متنوعة. إذا كنت تحتاج مساعدة محددة، يرجى إخباري!"
+    async def _offer_slots(self, session_data: SessionData, limit: int = 3, after: datetime = None) -> List[Dict[str, Any]]:
+        """Load the nearest free slots for the selected service and remember them on the session"""
+        if not slot_engine.has_inventory(session_data.selected_service):
+            session_data.offered_slots = []
+            return []
+        
+        try:
+            slots = await slot_engine.find_nearest(session_data.selected_service, after=after, limit=limit)
+            if not slots and after:
+                slots = await slot_engine.find_nearest(session_data.selected_service, limit=limit)
+        except Exception as e:
+            logger.error(f"Error loading available slots: {e}")
+            slots = []
+        
+        session_data.offered_slots = [slot["_id"] for slot in slots]
+        return slots
+
+    async def _resolve_slot_choice(self, user_input: str, session_data: SessionData):
+        """Map the user's reply at the datetime step onto a slot id.
+
+        Accepts the number of an offered slot or a natural-language date/time; returns
+        ``(slot_id or None, parsed datetime or None)``.
+        """
+        choice = normalize_text(user_input).rstrip(".")
+        if choice.isdigit() and 1 <= int(choice) <= len(session_data.offered_slots):
+            return session_data.offered_slots[int(choice) - 1], None
+        
+        requested = datetime_parser.parse(user_input)
+        if not requested:
+            return None, None
+        
+        if requested.has_time:
+            slot = await slot_engine.find_slot_at(session_data.selected_service, requested.utc)
         else:
-            message = "I understand your question. As your virtual assistant, I'm here to help with various services. If you need specific assistance, please let me know!"
+            # A day without a time: take the first free slot on that day
+            slots = await slot_engine.find_nearest(session_data.selected_service, after=requested.utc - timedelta(seconds=1), limit=1)
+            slot = slots[0] if slots and slot_engine.to_local(slots[0]["start"]).date() == requested.value.date() else None
         
-        return {"message": message, "session_data": session_data}
+        return (slot["_id"] if slot else None), requested
 
-    def _get_response_generation_prompt(self, session_data: SessionData, language: str, context: Dict = None) -> str:
+    def _get_response_generation_prompt(self, session_data: SessionData, language: str, context: Dict = None,
+                                        passages: List[Dict[str, Any]] = None) -> str:
         """Get system prompt for response generation based on session context and conversation history"""
         
         # Base prompt with context awareness
@@ -1205,8 +3887,18 @@ Respond in a friendly and professional manner while considering the conversation
                 else:
                     base_prompt += f"\n\nKnown user information: {', '.join([f'{k}: {v}' for k, v in entities.items()])}"
         
-        # Add conversation history context
-        if context and context.get("previous_intents"):
+        # Conversation so far: the rolling summary and the few messages it does not cover yet,
+        # so the prompt stays the same size however long the conversation gets
+        if context and (context.get("summary") or context.get("recent_messages")):
+            if context.get("summary"):
+                heading = "ملخص المحادثة حتى الآن" if language == "ar" else "Conversation summary so far"
+                base_prompt += f"\n\n{heading}:\n{context['summary']}"
+            if context.get("recent_messages"):
+                heading = "آخر الرسائل" if language == "ar" else "Latest messages"
+                lines = "\n".join(f"{message['role']}: {message['content']}" for message in context["recent_messages"])
+                base_prompt += f"\n\n{heading}:\n{lines}"
+        elif context and context.get("previous_intents"):
+            # First turn, nothing summarised yet: the recent intents only
             recent_intents = [intent["intent"] for intent in context["previous_intents"][-3:]]
             if language == "ar":
                 base_prompt += f"\n\nالنوايا الحديثة في المحادثة: {', '.join(recent_intents)}"
@@ -1220,19 +3912,20 @@ Respond in a friendly and professional manner while considering the conversation
             else:
                 base_prompt += "\n\nYou are currently in a booking process. Collect required information systematically: name, phone number, preferred date and time."
         
+        # Ground the answer on the best knowledge base passages
+        if passages:
+            reference = "\n".join(f"- {passage['answer']}" for passage in passages)
+            if language == "ar":
+                base_prompt += f"\n\nمعلومات مرجعية (اعتمد عليها في الإجابة ولا تختلق تفاصيل غير موجودة فيها):\n{reference}"
+            else:
+                base_prompt += f"\n\nReference information (base your answer on it and do not invent details it does not contain):\n{reference}"
+        
         return base_prompt
 
 # Initialize Enhanced AI service
 mistral_service = MistralService()
 
 # API Routes
-@api_router.on_event("startup")
-async def startup_event():
-    """Initialize services on startup"""
-    logger.info("Starting MIND14 Virtual Front Desk API...")
-    await mistral_service.ensure_model_available()
-    logger.info("API startup completed")
-
 @api_router.get("/")
 async def root():
     return {"message": "MIND14 Virtual Front Desk API", "version": "1.0.0"}
@@ -1242,79 +3935,454 @@ async def get_services():
     """Get available services"""
     return AVAILABLE_SERVICES
 
-@api_router.post("/chat", response_model=ChatResponse)
-async def chat_endpoint(request: ChatRequest):
-    """Main chat endpoint with Mistral AI integration"""
+@api_router.get("/services/{service_id}/slots")
+async def get_service_slots(service_id: str, limit: int = 5):
+    """Get the nearest free appointment slots for a service"""
+    if service_id not in slot_engine.services:
+        raise HTTPException(status_code=404, detail="Service not found")
+    
+    slots = await slot_engine.find_nearest(service_id, limit=min(max(limit, 1), 50))
+    return [
+        {
+            "slot_id": slot["_id"],
+            "start": slot["start"].replace(tzinfo=timezone.utc).isoformat(),
+            "end": slot["end"].replace(tzinfo=timezone.utc).isoformat(),
+            "label": {"en": slot_engine.format_slot(slot, "en"), "ar": slot_engine.format_slot(slot, "ar")}
+        }
+        for slot in slots
+    ]
+
+@api_router.get("/appointments/due-reminders")
+async def get_due_reminders(limit: int = 1000, after: Optional[str] = None,
+                            hours_ahead: Optional[str] = None, status: Optional[str] = None):
+    """Appointments with a reminder due now, for the hourly n8n reminder workflow.
+
+    Each appointment carries its own reminder schedule (``follow_up_config``), so
+    ``hours_ahead`` and ``status`` are accepted for compatibility but not needed.
+    Page with ``after=<next_cursor>``; the workflow does not, so the default page is
+    sized to hold every reminder falling due in one hourly poll.
+    """
+    try:
+        page = await slot_engine.due_reminders(limit=min(max(limit, 1), 1000), after=after)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    except Exception as e:
+        logger.error(f"Error loading due reminders: {e}")
+        raise HTTPException(status_code=500, detail="Failed to load due reminders")
+
+    appointments = [slot_engine.reminder_view(appointment) for appointment in page["appointments"]]
+    return {"appointments": appointments, "count": len(appointments), "next_cursor": page["next_cursor"]}
+
+@api_router.post("/appointments/{appointment_id}/reminder-sent")
+async def reminder_sent(appointment_id: str, report: ReminderSentReport):
+    """Advance an appointment's reminder schedule once n8n has sent the due reminder"""
     try:
-        # Get or create conversation
-        conversation = None
-        if request.conversation_id:
-            conversation_data = await db.conversations.find_one({"id": request.conversation_id})
-            if conversation_data:
-                conversation = Conversation(**conversation_data)
-        
-        if not conversation:
-            # Create new conversation
-            conversation = Conversation(
-                language=request.language,
-                user_id="demo_user"  # In production, get from auth
+        result = await slot_engine.mark_reminder_sent(appointment_id, report.dict())
+    except Exception as e:
+        logger.error(f"Error recording reminder for {appointment_id}: {e}")
+        raise HTTPException(status_code=500, detail="Failed to record reminder")
+    if result is None:
+        raise HTTPException(status_code=404, detail="Appointment not found")
+
+    appointment, advanced = result
+    if reminder_scheduler:
+        reminder_scheduler.schedule(appointment_id, appointment.get("next_reminder_at"))
+    if advanced:
+        try:
+            analytics_cache.expire("automation-stats", "automation-activity")
+            await automation_events.record(
+                "reminder_sent", f"Reminder sent for appointment {appointment_id}",
+                appointment_id=appointment_id, workflow="reminders", details=report.dict()
             )
-            await db.conversations.insert_one(conversation.dict())
-
-        # Add user message
-        user_message = Message(
-            role=MessageRole.USER,
-            content=request.message,
-            language=request.language,
-            attachments=request.attachments
-        )
-        conversation.messages.append(user_message)
+        except Exception as e:
+            logger.error(f"Error recording reminder event for {appointment_id}: {e}")
 
-        # Classify intent using Enhanced AI
-        intent_result = await mistral_service.classify_intent(request.message, request.language)
-        
-        # Update conversation context for better responses
-        context = mistral_service.update_conversation_context(
-            conversation.id, 
-            request.message, 
-            intent_result, 
-            conversation.session_data
-        )
-        
-        # Generate AI response with enhanced context
-        ai_response = await process_conversation(
-            request.message, 
-            conversation.session_data, 
-            intent_result,
-            request.language,
-            context  # Pass context for better responses
+    next_reminder_at = appointment.get("next_reminder_at")
+    return {
+        "appointment_id": appointment_id,
+        "advanced": advanced,
+        "next_reminder_at": next_reminder_at.replace(tzinfo=timezone.utc).isoformat() if next_reminder_at else None,
+        "reminders_pending": appointment.get("reminders_pending", [])
+    }
+
+@api_router.post("/intents/classify")
+async def classify_intent_batch(request: IntentBatchRequest):
+    """Classify a batch of messages in one pass (triage, analytics backfills)"""
+    if len(request.messages) > INTENT_BATCH_MAX_MESSAGES:
+        raise HTTPException(status_code=413, detail=f"At most {INTENT_BATCH_MAX_MESSAGES} messages per batch")
+    
+    results = await asyncio.to_thread(mistral_service.classify_intent_batch, request.messages, request.language)
+    return {
+        "model_version": intent_model.version if intent_model is not None else None,
+        "results": results
+    }
+
+@api_router.post("/templates/reload")
+async def reload_response_templates():
+    """Recompile the response templates from disk; edits are also picked up automatically"""
+    try:
+        return await asyncio.to_thread(response_templates.load)
+    except Exception as e:
+        logger.error(f"Error reloading response templates: {e}")
+        raise HTTPException(status_code=500, detail=f"Template reload failed: {e}")
+
+@api_router.get("/knowledge/search")
+async def search_knowledge_base(q: str, language: str = "en", limit: int = 3):
+    """Ranked knowledge base passages for a question, as used to answer general inquiries"""
+    try:
+        return {"query": q, "language": language, "results": knowledge_base.search(q, language, limit=max(1, min(limit, 10)))}
+    except Exception as e:
+        logger.error(f"Error searching knowledge base: {e}")
+        raise HTTPException(status_code=500, detail="Knowledge base search failed")
+
+@api_router.post("/knowledge/reload")
+async def reload_knowledge_base():
+    """Re-index changed knowledge files now; edits are also picked up automatically"""
+    try:
+        return await asyncio.to_thread(knowledge_base.refresh)
+    except Exception as e:
+        logger.error(f"Error reloading knowledge base: {e}")
+        raise HTTPException(status_code=500, detail=f"Knowledge base reload failed: {e}")
+
+class ConversationConcurrency:
+    """Keeps concurrent turns on one conversation from overwriting each other.
+
+    Every saved turn bumps ``Conversation.version`` with a conditional ``replace_one``; a
+    turn whose conversation changed since it was read is re-run on the fresh copy (at most
+    ``max_retries`` times). Within a worker, turns on the same conversation are queued on a
+    per-conversation lock, so conflicts only come from other workers; other conversations
+    are never blocked.
+    """
+
+    def __init__(self, max_retries: int = None, use_locks: bool = None):
+        self.max_retries = max_retries if max_retries is not None else int(os.environ.get("CHAT_TURN_MAX_RETRIES", "2"))
+        self.use_locks = use_locks if use_locks is not None else os.environ.get("CHAT_TURN_LOCKS", "true").lower() == "true"
+        self._locks: Dict[str, list] = {}  # conversation_id -> [lock, turns holding or waiting]
+        self.counters = {"turns": 0, "saved": 0, "conflicts": 0, "retries": 0, "exhausted": 0, "lock_waits": 0}
+
+    @asynccontextmanager
+    async def turn(self, conversation_id: Optional[str]):
+        """Serialize turns on one conversation within this worker (no-op for new conversations)"""
+        self.counters["turns"] += 1
+        if not self.use_locks or not conversation_id:
+            yield
+            return
+        entry = self._locks.setdefault(conversation_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        if entry[0].locked():
+            self.counters["lock_waits"] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[conversation_id]
+
+    async def save(self, conversation: Conversation, expected_version: int) -> bool:
+        """Write the conversation if nobody saved it since ``expected_version`` was read"""
+        # Documents written before versioning have no field yet: treat them as version 0
+        current = expected_version if expected_version else {"$in": [0, None]}
+        conversation.version = expected_version + 1
+        result = await mongo.db.conversations.replace_one(
+            {"id": conversation.id, "version": current}, conversation.dict()
         )
+        if result.matched_count == 0:
+            conversation.version = expected_version
+            self.counters["conflicts"] += 1
+            return False
+        self.counters["saved"] += 1
+        return True
 
-        # Add AI message
-        ai_message = Message(
-            role=MessageRole.ASSISTANT,
-            content=ai_response["message"],
-            language=request.language,
-            intent=intent_result["intent"],
-            confidence=intent_result["confidence"]
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "max_retries": self.max_retries,
+            "locks_enabled": self.use_locks,
+            "active_conversations": len(self._locks),
+            **self.counters
+        }
+
+conversation_concurrency = ConversationConcurrency()
+
+class ConversationSummarizer:
+    """Keeps ``Conversation.summary`` current so prompts never need the raw history.
+
+    ``fold`` is incremental and deterministic: it only reads the messages after
+    ``covered_messages``, keeps a bounded set of facts (service, collected booking details,
+    appointment, topics, first and latest request) and renders them in the conversation's
+    language, capped at ``max_chars``. ``refresh`` runs after a turn is saved (as a background
+    task); refreshes for a conversation that is already being summarised are coalesced into
+    one more pass. The write is conditional on the conversation ``version``, so a turn saved
+    meanwhile is left alone and summarised by its own refresh.
+    """
+
+    LABELS = {
+        "en": {"topics": "Topics", "service": "Selected service", "name": "Customer name", "phone": "Phone",
+               "preferred_datetime": "Preferred time", "appointment_id": "Appointment", "step": "Current step",
+               "documents": "Documents shared", "first_request": "First request", "last_request": "Latest request"},
+        "ar": {"topics": "المواضيع", "service": "الخدمة المختارة", "name": "اسم العميل", "phone": "الهاتف",
+               "preferred_datetime": "الموعد المفضل", "appointment_id": "رقم الموعد", "step": "الخطوة الحالية",
+               "documents": "الوثائق المرفقة", "first_request": "الطلب الأول", "last_request": "آخر طلب"}
+    }
+    FACT_FIELDS = ("name", "phone", "preferred_datetime")
+
+    def __init__(self, database=None, max_chars: int = None, recent_messages: int = None,
+                 max_topics: int = 5, excerpt_chars: int = 120):
+        self._database = database
+        self.max_chars = max_chars or int(os.environ.get("SUMMARY_MAX_CHARS", "600"))
+        self.recent_messages = recent_messages if recent_messages is not None else int(os.environ.get("SUMMARY_RECENT_MESSAGES", "4"))
+        self.max_topics = max_topics
+        self.excerpt_chars = excerpt_chars
+        self._services = {service.id: service for service in AVAILABLE_SERVICES}
+        self._running: Dict[str, bool] = {}  # conversation_id -> another pass requested
+        self.counters = {"refreshes": 0, "coalesced": 0, "folded_messages": 0, "updates": 0, "skipped_stale": 0, "errors": 0}
+
+    @property
+    def collection(self):
+        return (self._database if self._database is not None else mongo.db).conversations
+
+    def excerpt(self, text: str) -> str:
+        text = " ".join(text.split())
+        return text if len(text) <= self.excerpt_chars else text[:self.excerpt_chars - 1] + "…"
+
+    def _service_name(self, service_id: Optional[str], language: str) -> Optional[str]:
+        service = self._services.get(service_id) if service_id else None
+        return service.name.get(language, service.name["en"]) if service else None
+
+    def fold(self, conversation: Conversation) -> ConversationSummary:
+        """The conversation's summary with every message after ``covered_messages`` folded in"""
+        summary = conversation.summary
+        new_messages = conversation.messages[summary.covered_messages:]
+        if not new_messages:
+            return summary
+
+        topics = list(summary.topics)
+        first_request, last_request, documents = summary.first_request, summary.last_request, summary.documents
+        for message in new_messages:
+            if message.role == MessageRole.USER:
+                last_request = self.excerpt(message.content)
+                first_request = first_request or last_request
+                documents += len(message.attachments)
+            elif (message.intent and message.intent != "greeting"
+                  and (message.confidence or 0.0) >= mistral_service.intent_confidence_threshold):
+                # Replies inside a flow ("yes", a name) classify unsurely and say nothing about the topic
+                if message.intent in topics:
+                    topics.remove(message.intent)
+                topics = (topics + [message.intent])[-self.max_topics:]
+        self.counters["folded_messages"] += len(new_messages)
+
+        session_data = conversation.session_data
+        facts = {"service": session_data.selected_service, "appointment_id": session_data.appointment_id,
+                 "step": f"{session_data.step}.{session_data.booking_step}" if session_data.step == "booking" else session_data.step}
+        facts.update({field: session_data.collected_info[field] for field in self.FACT_FIELDS if session_data.collected_info.get(field)})
+        facts = {key: value for key, value in facts.items() if value}
+
+        summary = ConversationSummary(
+            facts=facts, topics=topics, first_request=first_request, last_request=last_request,
+            documents=documents, covered_messages=len(conversation.messages), updated_at=datetime.utcnow()
         )
-        conversation.messages.append(ai_message)
-        conversation.session_data = ai_response["session_data"]
-        conversation.updated_at = datetime.utcnow()
-
-        # Update title if needed
-        if len(conversation.messages) == 2:  # First user message + AI response
-            conversation.title = generate_conversation_title(request.message, request.language)
-
-        # Save conversation
-        await db.conversations.replace_one(
-            {"id": conversation.id}, 
-            conversation.dict()
+        summary.text = self.render(summary, conversation.language)
+        return summary
+
+    def render(self, summary: ConversationSummary, language: str) -> str:
+        """Summary lines, most durable facts first, cut at ``max_chars``"""
+        labels = self.LABELS.get(language, self.LABELS["en"])
+        facts = {**summary.facts}
+        if facts.get("service"):
+            facts["service"] = self._service_name(facts["service"], language) or facts["service"]
+        lines = []
+        if summary.topics:
+            names = [self._service_name(intent.replace("_", "-"), language) or intent for intent in summary.topics]
+            lines.append(f"{labels['topics']}: {('، ' if language == 'ar' else ', ').join(names)}")
+        lines.extend(f"{labels[key]}: {facts[key]}" for key in
+                     ("service", "name", "phone", "preferred_datetime", "appointment_id", "step") if facts.get(key))
+        if summary.documents:
+            lines.append(f"{labels['documents']}: {summary.documents}")
+        if summary.first_request:
+            lines.append(f"{labels['first_request']}: \"{summary.first_request}\"")
+        if summary.last_request and summary.last_request != summary.first_request:
+            lines.append(f"{labels['last_request']}: \"{summary.last_request}\"")
+        text = "\n".join(f"- {line}" for line in lines)
+        return text if len(text) <= self.max_chars else text[:self.max_chars - 1] + "…"
+
+    def prompt_context(self, conversation: Conversation) -> Dict[str, Any]:
+        """Summary text plus the few messages it does not cover yet (excluding the current one)"""
+        covered = conversation.summary.covered_messages
+        pending = conversation.messages[covered:-1][-self.recent_messages:] if self.recent_messages else []
+        return {
+            "summary": conversation.summary.text,
+            "recent_messages": [{"role": message.role.value, "content": self.excerpt(message.content)} for message in pending]
+        }
+
+    async def refresh(self, conversation_id: str):
+        """Fold the stored conversation's new messages into its summary"""
+        self.counters["refreshes"] += 1
+        if conversation_id in self._running:
+            self._running[conversation_id] = True
+            self.counters["coalesced"] += 1
+            return
+        self._running[conversation_id] = False
+        try:
+            while True:
+                data = await self.collection.find_one({"id": conversation_id})
+                if data:
+                    conversation = Conversation(**data)
+                    summary = self.fold(conversation)
+                    if summary is not conversation.summary:
+                        result = await self.collection.update_one(
+                            {"id": conversation_id, "version": conversation.version},
+                            {"$set": {"summary": summary.dict()}}
+                        )
+                        self.counters["updates" if result.matched_count else "skipped_stale"] += 1
+                if not self._running[conversation_id]:
+                    break
+                self._running[conversation_id] = False
+        except Exception as e:
+            self.counters["errors"] += 1
+            logger.error(f"Summarizing conversation {conversation_id} failed: {e}")
+        finally:
+            self._running.pop(conversation_id, None)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "max_chars": self.max_chars,
+            "recent_messages": self.recent_messages,
+            "in_progress": len(self._running),
+            **self.counters
+        }
+
+conversation_summarizer = ConversationSummarizer()
+
+async def _run_chat_turn(request: ChatRequest) -> tuple:
+    """One chat turn on the latest stored copy of the conversation; returns
+    ``(conversation, intent_result, ai_response, saved)``"""
+    # Get or create conversation
+    conversation = None
+    if request.conversation_id:
+        conversation_data = await mongo.db.conversations.find_one({"id": request.conversation_id})
+        if conversation_data:
+            conversation = Conversation(**conversation_data)
+    
+    # Detect the message language; the conversation keeps its language unless the message clearly
+    # switches (booking answers such as names and phone numbers never do)
+    detection = language_detector.detect(
+        request.message, fallback=conversation.language if conversation else request.language
+    )
+    language = language_detector.conversation_language(
+        detection, conversation.language if conversation else None,
+        free_text=not conversation or conversation.session_data.step != "booking"
+    )
+    
+    if not conversation:
+        # Create new conversation
+        conversation = Conversation(
+            language=language,
+            user_id="demo_user"  # In production, get from auth
         )
+        await mongo.db.conversations.insert_one(conversation.dict())
+    expected_version = conversation.version
+    conversation.session_data.conversation_id = conversation.id
+    conversation.language = language
+
+    # Text already extracted from the attached documents (see DocumentExtractionService)
+    documents = await document_extraction.analyses_for(request.attachments) if request.attachments else []
+
+    # Add user message
+    user_message = Message(
+        role=MessageRole.USER,
+        content=request.message,
+        language=language,
+        attachments=request.attachments,
+        metadata={"language_detection": {**detection, "requested": request.language}}
+    )
+    if documents:
+        user_message.metadata["documents"] = documents
+    conversation.messages.append(user_message)
+
+    # Classify intent using Enhanced AI, against the tables of the language the message is written in
+    intent_result = await mistral_service.classify_intent(request.message, detection["language"], detection)
+    
+    # A vague message sent with a document ("here it is") takes its intent from the document
+    document = max(documents, key=lambda d: d.get("confidence", 0), default=None)
+    if (document and document.get("intent") and intent_result["confidence"] < mistral_service.intent_confidence_threshold
+            and document["confidence"] > intent_result["confidence"]):
+        intent_result = {**intent_result, "intent": document["intent"], "confidence": document["confidence"],
+                         "source": "attachment", "entities": {**document.get("entities", {}), **intent_result.get("entities", {})}}
+    
+    # Update conversation context for better responses (kept only if this attempt saves)
+    turn_context = mistral_service.update_conversation_context(
+        conversation.id, 
+        request.message, 
+        intent_result, 
+        conversation.session_data,
+        record=False
+    )
+    
+    # The rolling summary stands in for the raw history in generation prompts
+    context = {**turn_context, **conversation_summarizer.prompt_context(conversation)}
+    
+    # Generate AI response with enhanced context
+    ai_response = await process_conversation(
+        request.message, 
+        conversation.session_data, 
+        intent_result,
+        language,
+        context  # Pass context for better responses
+    )
+
+    # Add AI message
+    ai_message = Message(
+        role=MessageRole.ASSISTANT,
+        content=ai_response["message"],
+        language=language,
+        intent=intent_result["intent"],
+        confidence=intent_result["confidence"]
+    )
+    conversation.messages.append(ai_message)
+    conversation.session_data = ai_response["session_data"]
+    conversation.updated_at = datetime.utcnow()
+
+    # Update title if needed
+    if len(conversation.messages) == 2:  # First user message + AI response
+        conversation.title = generate_conversation_title(request.message, language)
+
+    # Save conversation, unless another turn saved it first
+    saved = await conversation_concurrency.save(conversation, expected_version)
+    if saved:
+        mistral_service.record_conversation_context(conversation.id, turn_context)
+    return conversation, intent_result, ai_response, saved
+
+@api_router.post("/chat", response_model=ChatResponse)
+async def chat_endpoint(request: ChatRequest, background_tasks: BackgroundTasks):
+    """Main chat endpoint with Mistral AI integration"""
+    try:
+        async with conversation_concurrency.turn(request.conversation_id):
+            for attempt in range(conversation_concurrency.max_retries + 1):
+                conversation, intent_result, ai_response, saved = await _run_chat_turn(request)
+                if saved:
+                    break
+                # Lost the race: undo this attempt's slot reservation and redo the turn on the fresh copy
+                if ai_response.get("booking_data"):
+                    await slot_engine.release(ai_response["booking_data"]["appointment_id"])
+                conversation_concurrency.counters["retries"] += 1
+                logger.warning(f"Conversation {conversation.id} changed during the turn, retrying (attempt {attempt + 1})")
+            else:
+                conversation_concurrency.counters["exhausted"] += 1
+                raise HTTPException(status_code=409, detail="Conversation was updated concurrently, please retry")
 
         # Trigger n8n webhook if booking completed
         if ai_response.get("trigger_webhook") and ai_response.get("booking_data"):
-            await trigger_n8n_webhook(ai_response["booking_data"])
+            booking = ai_response["booking_data"]
+            analytics_cache.expire("automation-stats", "automation-activity")
+            await automation_events.record(
+                "booking_created",
+                f"New appointment booked - {booking['customer_info'].get('name', 'Unknown')} ({booking['service']['name']['en']})",
+                appointment_id=booking["appointment_id"]
+            )
+            background_tasks.add_task(trigger_n8n_webhook, booking)
+
+        # Fold this turn into the conversation summary once the response is on its way
+        background_tasks.add_task(conversation_summarizer.refresh, conversation.id)
 
         return ChatResponse(
             message=ai_response["message"],
@@ -1325,112 +4393,231 @@ async def chat_endpoint(request: ChatRequest):
             actions=ai_response.get("actions", [])
         )
 
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error in chat endpoint: {e}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
+@api_router.post("/attachments")
+async def upload_attachments(request: Request):
+    """Stream multipart file uploads into GridFS; the returned ids go in a chat message's ``attachments``"""
+    declared = request.headers.get("content-length")
+    if declared and declared.isdigit() and int(declared) > attachment_store.max_request_bytes:
+        raise HTTPException(status_code=413, detail="Upload too large")
+    try:
+        attachments = await attachment_store.save_multipart(request.headers.get("content-type"), request.stream())
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error storing attachment: {e}")
+        raise HTTPException(status_code=500, detail="Attachment upload failed")
+    if not attachments:
+        raise HTTPException(status_code=400, detail="No file in upload")
+    
+    # Start text extraction right away so the text is ready by the time the message is sent
+    for attachment in attachments:
+        try:
+            job = await document_extraction.submit(attachment["attachment_id"])
+            attachment["extraction"] = {"job_id": job["job_id"], "status": job["status"]}
+        except Exception as e:
+            logger.error(f"Could not queue extraction for attachment {attachment['attachment_id']}: {e}")
+    return {"attachments": attachments}
+
+@api_router.post("/attachments/{attachment_id}/extract", status_code=202)
+async def extract_attachment(attachment_id: str, language: str = "en"):
+    """Queue server-side text extraction for an attachment (answered from cache when the content was seen before)"""
+    try:
+        job = await document_extraction.submit(attachment_id, language)
+    except Exception as e:
+        logger.error(f"Error queueing extraction for {attachment_id}: {e}")
+        raise HTTPException(status_code=500, detail="Extraction could not be queued")
+    if job is None:
+        raise HTTPException(status_code=404, detail="Attachment not found")
+    if job["status"] == "rejected":
+        raise HTTPException(status_code=429, detail=job["error"])
+    return job
+
+@api_router.get("/extraction/jobs/{job_id}")
+async def get_extraction_job(job_id: str):
+    """Status of an extraction job; completed jobs carry the text and its intent/entities"""
+    job = document_extraction.jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Extraction job not found")
+    return job
+
+@api_router.get("/extraction/status")
+async def get_extraction_status():
+    """Extraction pool state: engines available here, workers, queue depth and outcomes"""
+    try:
+        return document_extraction.snapshot()
+    except Exception as e:
+        logger.error(f"Error in extraction status: {e}")
+        raise HTTPException(status_code=500, detail="Extraction status processing failed")
+
+@api_router.get("/attachments/{attachment_id}")
+async def download_attachment(attachment_id: str, range_header: Optional[str] = Header(None, alias="Range")):
+    """Download an attachment; a single ``Range: bytes=`` range is served as 206 Partial Content"""
+    grid_out = await attachment_store.open(attachment_id)
+    if grid_out is None:
+        raise HTTPException(status_code=404, detail="Attachment not found")
+
+    length = grid_out.length
+    try:
+        byte_range = attachment_store.parse_range(range_header, length)
+    except ValueError:
+        raise HTTPException(status_code=416, detail="Range not satisfiable", headers={"Content-Range": f"bytes */{length}"})
+    start, end = byte_range or (0, length - 1)
+
+    async def content():
+        grid_out.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            data = await grid_out.read(min(remaining, AttachmentStore.CHUNK_SIZE))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
+
+    info = AttachmentStore.describe({
+        "_id": grid_out._id, "filename": grid_out.filename, "length": length,
+        "metadata": grid_out.metadata, "sha256": getattr(grid_out, "sha256", None)
+    })
+    inline = info["content_type"].split(";", 1)[0].strip().lower() in AttachmentStore.INLINE_TYPES
+    headers = {
+        "Accept-Ranges": "bytes",
+        "Content-Length": str(max(end - start + 1, 0)),
+        "Content-Disposition": f"{'inline' if inline else 'attachment'}; filename*=UTF-8''{quote(info['filename'] or 'attachment')}",
+        "X-Content-Type-Options": "nosniff",
+    }
+    if info["sha256"]:
+        headers["ETag"] = f'"{info["sha256"]}"'
+    if byte_range:
+        headers["Content-Range"] = f"bytes {start}-{end}/{length}"
+    return StreamingResponse(content(), status_code=206 if byte_range else 200,
+                             media_type=info["content_type"] if inline else "application/octet-stream", headers=headers)
+
+async def _load_automation_stats():
+    """Booking, notification and webhook delivery counters for the automation dashboard"""
+    counts = await automation_events.counts()
+    
+    def count(key):
+        return counts.get(key, {}).get("count", 0)
+    
+    delivered, failed = count("webhook_delivered"), count("webhook_error")
+    automation_stats = {
+        "totalBookings": count("booking_created"),
+        "emailsSent": count("email_sent"),
+        "smsSent": count("sms_sent"),
+        "whatsappSent": count("whatsapp_sent"),
+        "remindersSent": count("reminder_sent"),
+        "calendarEvents": count("calendar_event"),
+        "successRate": round(delivered * 100 / (delivered + failed), 1) if delivered + failed else 100.0,
+        "lastUpdate": datetime.utcnow().isoformat(),
+        # A workflow is healthy until its latest delivery failed
+        "webhookHealth": {
+            workflow: counts.get(f"webhook:{workflow}", {}).get("last_status") != "error"
+            for workflow in ("booking", "notifications", "reschedule", "cancellation")
+        },
+        "integrationStatus": {
+            "google_calendar": "connected",
+            "twilio_sms": "active", 
+            "email_smtp": "working",
+            "whatsapp": "configured"
+        }
+    }
+    
+    return automation_stats
+
 @api_router.get("/automation/stats")
 async def get_automation_stats():
     """Get automation system statistics"""
     try:
-        # Get booking statistics
-        total_bookings = await db.conversations.count_documents({"status": "completed"})
-        
-        # Simulate automation metrics (in production, track actual metrics)
-        automation_stats = {
-            "totalBookings": total_bookings,
-            "emailsSent": total_bookings * 2,  # Confirmation + reminder emails
-            "smsSent": int(total_bookings * 0.8),  # 80% opt for SMS
-            "whatsappSent": int(total_bookings * 0.3),  # 30% opt for WhatsApp
-            "remindersSent": total_bookings * 3,  # Multiple reminders per booking
-            "calendarEvents": total_bookings,  # One calendar event per booking
-            "successRate": 94.2,  # Simulated success rate
-            "lastUpdate": datetime.utcnow().isoformat(),
-            "webhookHealth": {
-                "booking": True,
-                "notifications": True,
-                "calendar": True,
-                "reminders": True
-            },
-            "integrationStatus": {
-                "google_calendar": "connected",
-                "twilio_sms": "active", 
-                "email_smtp": "working",
-                "whatsapp": "configured"
-            }
-        }
-        
-        return automation_stats
-        
+        return await analytics_cache.get("automation-stats", _load_automation_stats)
     except Exception as e:
         logger.error(f"Error fetching automation stats: {e}")
         raise HTTPException(status_code=500, detail="Failed to fetch automation statistics")
 
+async def _load_recent_automation_activity():
+    """Latest automation events, newest first"""
+    return await automation_events.recent(15)
+
 @api_router.get("/automation/recent-activity")
 async def get_recent_automation_activity():
     """Get recent automation activity logs"""
     try:
-        # Get recent conversations for activity
-        recent_conversations = await db.conversations.find(
-            {},
-            {"messages": {"$slice": -1}, "title": 1, "status": 1, "updated_at": 1}
-        ).sort("updated_at", -1).limit(10).to_list(10)
-        
-        activities = []
-        
-        for conv in recent_conversations:
-            if conv.get("status") == "completed":
-                activities.append({
-                    "id": conv["_id"],
-                    "type": "booking_created",
-                    "message": f"New appointment booked - {conv.get('title', {}).get('en', 'Unknown Service')}",
-                    "timestamp": conv.get("updated_at", datetime.utcnow()).isoformat(),
-                    "status": "success"
-                })
-        
-        # Add simulated automation activities
-        base_time = datetime.utcnow()
-        simulated_activities = [
-            {
-                "id": "email_1",
-                "type": "email_sent",
-                "message": "Confirmation email sent to customer",
-                "timestamp": (base_time - timedelta(minutes=5)).isoformat(),
-                "status": "success"
-            },
-            {
-                "id": "sms_1", 
-                "type": "sms_sent",
-                "message": "SMS reminder sent successfully",
-                "timestamp": (base_time - timedelta(minutes=12)).isoformat(),
-                "status": "success"
-            },
-            {
-                "id": "calendar_1",
-                "type": "calendar_event",
-                "message": "Google Calendar event created",
-                "timestamp": (base_time - timedelta(minutes=18)).isoformat(),
-                "status": "success"
-            },
-            {
-                "id": "whatsapp_1",
-                "type": "whatsapp_sent",
-                "message": "WhatsApp message delivered",
-                "timestamp": (base_time - timedelta(minutes=25)).isoformat(),
-                "status": "success"
-            }
-        ]
-        
-        # Combine and sort activities
-        all_activities = activities + simulated_activities
-        all_activities.sort(key=lambda x: x["timestamp"], reverse=True)
-        
-        return all_activities[:15]  # Return last 15 activities
-        
+        return await analytics_cache.get("automation-activity", _load_recent_automation_activity)
     except Exception as e:
         logger.error(f"Error fetching automation activity: {e}")
         raise HTTPException(status_code=500, detail="Failed to fetch automation activity")
 
+async def publish_dashboard_metrics(interval_seconds: float = None):
+    """Single source of the dashboard "metrics" events, however many dashboards are open.
+
+    Reads through the analytics cache and only publishes when the numbers changed.
+    """
+    interval_seconds = interval_seconds or float(os.environ.get("DASHBOARD_METRICS_INTERVAL_SECONDS", "5"))
+    last = None
+    while True:
+        if event_bus.subscriber_count:
+            try:
+                stats = await analytics_cache.get("automation-stats", _load_automation_stats)
+                current = {key: value for key, value in stats.items() if key != "lastUpdate"}
+                if current != last:
+                    event_bus.publish("metrics", stats)
+                    last = current
+            except Exception as e:
+                logger.error(f"Dashboard metrics refresh failed: {e}")
+        await asyncio.sleep(interval_seconds)
+
+@api_router.get("/automation/events")
+async def stream_automation_events(request: Request, last_event_id: Optional[str] = Header(None)):
+    """Server-sent events: metrics, bookings and webhook deliveries as they happen"""
+    queue = event_bus.subscribe(int(last_event_id) if last_event_id and last_event_id.isdigit() else None)
+    heartbeat = float(os.environ.get("EVENT_STREAM_HEARTBEAT_SECONDS", "15"))
+
+    async def stream():
+        try:
+            yield "retry: 5000\n\n"
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), heartbeat)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    yield ": keep-alive\n\n"
+                    continue
+                yield event["sse"]
+        finally:
+            event_bus.unsubscribe(queue)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@api_router.websocket("/automation/ws")
+async def automation_events_socket(websocket: WebSocket):
+    """The same feed as /automation/events over a WebSocket, one JSON message per event"""
+    await websocket.accept()
+    queue = event_bus.subscribe()
+
+    async def forward():
+        while True:
+            event = await queue.get()
+            await websocket.send_text(event["json"])
+
+    sender = asyncio.create_task(forward())
+    try:
+        while True:
+            await websocket.receive_text()  # clients send nothing; this is how a close is noticed
+    except WebSocketDisconnect:
+        pass
+    finally:
+        sender.cancel()
+        event_bus.unsubscribe(queue)
+
 @api_router.get("/automation/health-check")
 async def automation_health_check():
     """Check health of all automation integrations"""
@@ -1482,158 +4669,255 @@ async def automation_health_check():
 @api_router.get("/conversations", response_model=List[Conversation])
 async def get_conversations(user_id: str = "demo_user"):
     """Get user's conversations"""
-    conversations_data = await db.conversations.find(
+    conversations_data = await mongo.db.conversations.find(
         {"user_id": user_id}
     ).sort("updated_at", -1).to_list(100)
     
     return [Conversation(**conv) for conv in conversations_data]
 
-@api_router.get("/analytics/ai-performance")
-async def get_ai_performance_analytics():
-    """Get AI performance analytics"""
-    try:
-        # Aggregate conversation data for AI performance metrics
-        pipeline = [
-            {
-                "$unwind": "$messages"
-            },
-            {
-                "$match": {
-                    "messages.role": "assistant",
-                    "messages.intent": {"$exists": True}
-                }
-            },
-            {
-                "$group": {
-                    "_id": "$messages.intent",
-                    "count": {"$sum": 1},
-                    "avg_confidence": {"$avg": "$messages.confidence"},
-                    "languages": {"$addToSet": "$language"}
-                }
-            },
-            {
-                "$sort": {"count": -1}
+async def _load_ai_performance_analytics():
+    """Intent statistics and model metrics"""
+    # Aggregate conversation data for AI performance metrics
+    pipeline = [
+        {
+            "$unwind": "$messages"
+        },
+        {
+            "$match": {
+                "messages.role": "assistant",
+                "messages.intent": {"$exists": True}
             }
-        ]
-        
-        intent_stats = await db.conversations.aggregate(pipeline).to_list(100)
-        
-        # Calculate overall metrics
-        total_conversations = await db.conversations.count_documents({})
-        completed_conversations = await db.conversations.count_documents({"status": "completed"})
-        
-        # Intent accuracy simulation (in production, this would be based on user feedback)
-        intent_accuracy = {
-            "health_card_renewal": 0.95,
-            "id_card_replacement": 0.92,
-            "medical_consultation": 0.94,
-            "student_enrollment": 0.89,
-            "general_inquiry": 0.85,
-            "greeting": 0.98
+        },
+        {
+            "$group": {
+                "_id": "$messages.intent",
+                "count": {"$sum": 1},
+                "avg_confidence": {"$avg": "$messages.confidence"},
+                "languages": {"$addToSet": "$language"}
+            }
+        },
+        {
+            "$sort": {"count": -1}
         }
-        
-        # Response time simulation (in production, track actual response times)
-        avg_response_times = {
-            "rule_based": 0.05,  # 50ms
-            "mistral": 2.3,      # 2.3s
-            "fallback": 0.02     # 20ms
+    ]
+    
+    intent_stats = await mongo.analytics.conversations.aggregate(pipeline, maxTimeMS=mongo.analytics_max_time_ms).to_list(100)
+    
+    # Calculate overall metrics
+    total_conversations = await mongo.analytics.conversations.count_documents({}, maxTimeMS=mongo.analytics_max_time_ms)
+    completed_conversations = await mongo.analytics.conversations.count_documents({"status": "completed"}, maxTimeMS=mongo.analytics_max_time_ms)
+    
+    # Intent accuracy from the latest offline evaluation of the local model (train_intent_model.py)
+    intent_accuracy = {}
+    if intent_model_report:
+        intent_accuracy = {
+            intent: round(scores["recall"], 4)
+            for intent, scores in intent_model_report.get("per_intent", {}).items()
         }
-        
-        return {
-            "intent_statistics": intent_stats,
-            "overall_metrics": {
-                "total_conversations": total_conversations,
-                "completed_conversations": completed_conversations,
-                "completion_rate": (completed_conversations / max(total_conversations, 1)) * 100,
-                "intent_accuracy": intent_accuracy,
-                "avg_response_times": avg_response_times
+    
+    # Response time simulation (in production, track actual response times)
+    avg_response_times = {
+        "rule_based": 0.05,  # 50ms
+        "mistral": 2.3,      # 2.3s
+        "fallback": 0.02     # 20ms
+    }
+    
+    return {
+        "intent_statistics": intent_stats,
+        "overall_metrics": {
+            "total_conversations": total_conversations,
+            "completed_conversations": completed_conversations,
+            "completion_rate": (completed_conversations / max(total_conversations, 1)) * 100,
+            "intent_accuracy": intent_accuracy,
+            "intent_model": {
+                "version": intent_model.version if intent_model is not None else None,
+                "accuracy": intent_model_report.get("accuracy") if intent_model_report else None,
+                "evaluated_at": intent_model_report.get("evaluated_at") if intent_model_report else None,
+                "eval_rows": intent_model_report.get("counts", {}).get("eval_rows") if intent_model_report else None
             },
-            "ai_performance": {
-                "rule_based_fallback_rate": 85,  # Percentage using rule-based system
-                "mistral_availability": 15,      # Percentage using Mistral
-                "entity_extraction_success_rate": 78,
-                "conversation_flow_success_rate": 89
-            }
+            "avg_response_times": avg_response_times
+        },
+        "ai_performance": {
+            "rule_based_fallback_rate": 85,  # Percentage using rule-based system
+            "mistral_availability": 15,      # Percentage using Mistral
+            "entity_extraction_success_rate": 78,
+            "conversation_flow_success_rate": 89
         }
-        
+    }
+
+@api_router.get("/analytics/ai-performance")
+async def get_ai_performance_analytics():
+    """Get AI performance analytics"""
+    try:
+        return await analytics_cache.get("ai-performance", _load_ai_performance_analytics)
     except Exception as e:
         logger.error(f"Error in AI analytics: {e}")
         raise HTTPException(status_code=500, detail="Analytics processing failed")
 
-@api_router.get("/analytics/conversation-insights")
-async def get_conversation_insights():
-    """Get detailed conversation insights and patterns"""
-    try:
-        # Conversation flow analysis
-        flow_pipeline = [
-            {
-                "$group": {
-                    "_id": "$type",
-                    "count": {"$sum": 1},
-                    "avg_messages": {"$avg": {"$size": "$messages"}},
-                    "languages": {"$addToSet": "$language"},
-                    "avg_completion_time": {"$avg": {
-                        "$subtract": ["$updated_at", "$created_at"]
-                    }}
-                }
+async def _load_conversation_insights():
+    """Conversation flow, language and service breakdowns"""
+    # Conversation flow analysis
+    flow_pipeline = [
+        {
+            "$group": {
+                "_id": "$type",
+                "count": {"$sum": 1},
+                "avg_messages": {"$avg": {"$size": "$messages"}},
+                "languages": {"$addToSet": "$language"},
+                "avg_completion_time": {"$avg": {
+                    "$subtract": ["$updated_at", "$created_at"]
+                }}
             }
-        ]
-        
-        conversation_flows = await db.conversations.aggregate(flow_pipeline).to_list(100)
-        
-        # Language distribution
-        language_pipeline = [
-            {
-                "$group": {
-                    "_id": "$language",
-                    "count": {"$sum": 1},
-                    "avg_satisfaction": {"$avg": 4.2}  # Simulated satisfaction score
-                }
-            }
-        ]
-        
-        language_stats = await db.conversations.aggregate(language_pipeline).to_list(100)
-        
-        # Peak hours analysis (simulated data)
-        peak_hours = {
-            "morning": {"9-12": 35, "conversations": 245},
-            "afternoon": {"12-17": 45, "conversations": 320},
-            "evening": {"17-21": 20, "conversations": 140}
         }
-        
-        # Service popularity
-        service_popularity = [
-            {"service": "medical_consultation", "requests": 156, "success_rate": 94},
-            {"service": "health_card_renewal", "requests": 143, "success_rate": 95},
-            {"service": "id_card_replacement", "requests": 89, "success_rate": 92},
-            {"service": "student_enrollment", "requests": 67, "success_rate": 89},
-            {"service": "general_inquiry", "requests": 234, "success_rate": 85}
-        ]
-        
-        return {
-            "conversation_flows": conversation_flows,
-            "language_distribution": language_stats,
-            "peak_hours_analysis": peak_hours,
-            "service_popularity": service_popularity,
-            "insights": {
-                "most_common_intent": "medical_consultation",
-                "highest_confidence_intent": "greeting",
-                "most_challenging_intent": "student_enrollment",
-                "preferred_language": "en",
-                "avg_conversation_length": 4.2,
-                "user_satisfaction_score": 4.2
+    ]
+    
+    conversation_flows = await mongo.analytics.conversations.aggregate(flow_pipeline, maxTimeMS=mongo.analytics_max_time_ms).to_list(100)
+    
+    # Language distribution
+    language_pipeline = [
+        {
+            "$group": {
+                "_id": "$language",
+                "count": {"$sum": 1},
+                "avg_satisfaction": {"$avg": 4.2}  # Simulated satisfaction score
             }
         }
-        
+    ]
+    
+    language_stats = await mongo.analytics.conversations.aggregate(language_pipeline, maxTimeMS=mongo.analytics_max_time_ms).to_list(100)
+    
+    # Peak hours analysis (simulated data)
+    peak_hours = {
+        "morning": {"9-12": 35, "conversations": 245},
+        "afternoon": {"12-17": 45, "conversations": 320},
+        "evening": {"17-21": 20, "conversations": 140}
+    }
+    
+    # Service popularity
+    service_popularity = [
+        {"service": "medical_consultation", "requests": 156, "success_rate": 94},
+        {"service": "health_card_renewal", "requests": 143, "success_rate": 95},
+        {"service": "id_card_replacement", "requests": 89, "success_rate": 92},
+        {"service": "student_enrollment", "requests": 67, "success_rate": 89},
+        {"service": "general_inquiry", "requests": 234, "success_rate": 85}
+    ]
+    
+    return {
+        "conversation_flows": conversation_flows,
+        "language_distribution": language_stats,
+        "peak_hours_analysis": peak_hours,
+        "service_popularity": service_popularity,
+        "insights": {
+            "most_common_intent": "medical_consultation",
+            "highest_confidence_intent": "greeting",
+            "most_challenging_intent": "student_enrollment",
+            "preferred_language": "en",
+            "avg_conversation_length": 4.2,
+            "user_satisfaction_score": 4.2
+        }
+    }
+
+@api_router.get("/analytics/conversation-insights")
+async def get_conversation_insights():
+    """Get detailed conversation insights and patterns"""
+    try:
+        return await analytics_cache.get("conversation-insights", _load_conversation_insights)
     except Exception as e:
         logger.error(f"Error in conversation insights: {e}")
         raise HTTPException(status_code=500, detail="Insights processing failed")
 
+@api_router.get("/analytics/conversation-flow")
+async def get_conversation_flow_metrics():
+    """Rule-based flow metrics: transitions, dwell time, validation failures and drop-off per state"""
+    try:
+        return flow_metrics.snapshot()
+    except Exception as e:
+        logger.error(f"Error in conversation flow metrics: {e}")
+        raise HTTPException(status_code=500, detail="Flow metrics processing failed")
+
+@api_router.get("/analytics/cache")
+async def get_analytics_cache_stats():
+    """Analytics cache hit/miss counters and the age of each cached dashboard query"""
+    try:
+        return analytics_cache.snapshot()
+    except Exception as e:
+        logger.error(f"Error in analytics cache stats: {e}")
+        raise HTTPException(status_code=500, detail="Cache stats processing failed")
+
+@api_router.get("/analytics/database-pool")
+async def get_database_pool_metrics():
+    """MongoDB pool settings and usage: check-outs, wait time, connections in use and failures"""
+    try:
+        return mongo.stats()
+    except Exception as e:
+        logger.error(f"Error in database pool metrics: {e}")
+        raise HTTPException(status_code=500, detail="Database metrics processing failed")
+
+@api_router.get("/analytics/chat-concurrency")
+async def get_chat_concurrency_metrics():
+    """Concurrent turns per conversation: saved turns, version conflicts, retries and lock waits"""
+    try:
+        return conversation_concurrency.snapshot()
+    except Exception as e:
+        logger.error(f"Error in chat concurrency metrics: {e}")
+        raise HTTPException(status_code=500, detail="Chat concurrency metrics processing failed")
+
+@api_router.get("/analytics/knowledge")
+async def get_knowledge_base_metrics():
+    """Knowledge base index size and how often general inquiries were answered from it"""
+    try:
+        return knowledge_base.stats()
+    except Exception as e:
+        logger.error(f"Error in knowledge base metrics: {e}")
+        raise HTTPException(status_code=500, detail="Knowledge base metrics processing failed")
+
+@api_router.get("/analytics/semantic-index")
+async def get_semantic_index_metrics():
+    """Nearest-example index: matrix shape, examples per group, whether it is memory-mapped, hit counters"""
+    try:
+        return semantic_index.stats()
+    except Exception as e:
+        logger.error(f"Error in semantic index metrics: {e}")
+        raise HTTPException(status_code=500, detail="Semantic index metrics processing failed")
+
+@api_router.get("/analytics/conversation-summaries")
+async def get_conversation_summary_metrics():
+    """Rolling summary upkeep: refreshes, coalesced refreshes, messages folded and stale writes skipped"""
+    try:
+        return conversation_summarizer.snapshot()
+    except Exception as e:
+        logger.error(f"Error in conversation summary metrics: {e}")
+        raise HTTPException(status_code=500, detail="Conversation summary metrics processing failed")
+
+@api_router.get("/analytics/webhooks")
+async def get_webhook_metrics():
+    """Outbound webhook settings and volume: payload version, bytes before/after gzip, queued batches"""
+    try:
+        return webhook_dispatcher.snapshot()
+    except Exception as e:
+        logger.error(f"Error in webhook metrics: {e}")
+        raise HTTPException(status_code=500, detail="Webhook metrics processing failed")
+
+@api_router.get("/analytics/reminders")
+async def get_reminder_scheduler_metrics():
+    """In-process reminder scheduler state: pending reminders, next deadline, sends and lost leases"""
+    try:
+        return reminder_scheduler.snapshot() if reminder_scheduler else {"enabled": False}
+    except Exception as e:
+        logger.error(f"Error in reminder scheduler metrics: {e}")
+        raise HTTPException(status_code=500, detail="Reminder metrics processing failed")
+
 @api_router.post("/n8n/book-appointment")
 async def n8n_booking_webhook(booking_data: BookingData):
     """Enhanced n8n webhook endpoint for comprehensive booking automation"""
     try:
         logger.info(f"n8n booking webhook triggered: {booking_data.appointment_id}")
+        analytics_cache.expire("automation-stats", "automation-activity")
+        await automation_events.record(
+            "booking_created",
+            f"New appointment booked - {booking_data.customer_info.get('name', 'Unknown')} ({booking_data.service.name.get('en')})",
+            appointment_id=booking_data.appointment_id
+        )
         
         # Prepare comprehensive webhook payload
         webhook_payload = {
@@ -1661,19 +4945,9 @@ async def n8n_booking_webhook(booking_data: BookingData):
             "crm": os.environ.get("N8N_CRM_WEBHOOK", "https://your-n8n-instance.com/webhook/crm")
         }
         
-        # Send to main booking workflow
-        async with httpx.AsyncClient() as client:
-            try:
-                response = await client.post(
-                    n8n_webhooks["main_booking"],
-                    json=webhook_payload,
-                    timeout=30.0
-                )
-                logger.info(f"Main booking webhook response: {response.status_code}")
-            except Exception as e:
-                logger.error(f"Main booking webhook failed: {e}")
+        # Send to the main booking workflow, then the notification workflow
+        await deliver_webhook("booking", n8n_webhooks["main_booking"], webhook_payload, booking_data.appointment_id)
         
-        # Send to notification workflow (parallel processing)
         notification_payload = {
             "appointment_id": booking_data.appointment_id,
             "customer_info": booking_data.customer_info,
@@ -1683,17 +4957,8 @@ async def n8n_booking_webhook(booking_data: BookingData):
             "scheduled_datetime": booking_data.scheduled_datetime,
             "webhook_type": "send_notifications"
         }
-        
-        async with httpx.AsyncClient() as client:
-            try:
-                await client.post(
-                    n8n_webhooks["notifications"],
-                    json=notification_payload,
-                    timeout=10.0
-                )
-                logger.info("Notification webhook triggered successfully")
-            except Exception as e:
-                logger.error(f"Notification webhook failed: {e}")
+        await deliver_webhook("notifications", n8n_webhooks["notifications"], notification_payload,
+                              booking_data.appointment_id, timeout=10.0)
         
         return {
             "status": "success", 
@@ -1722,13 +4987,28 @@ async def n8n_reschedule_webhook(reschedule_data: Dict[str, Any]):
             }
         }
         
+        if reschedule_data.get("appointment_id") and reschedule_data.get("scheduled_datetime"):
+            new_start = datetime.fromisoformat(reschedule_data["scheduled_datetime"])
+            if new_start.tzinfo is not None:
+                new_start = new_start.astimezone(timezone.utc).replace(tzinfo=None)
+            result = await slot_engine.reschedule(reschedule_data["appointment_id"], new_start)
+            if result and not result[1]:
+                raise HTTPException(status_code=409, detail="The requested time is not available")
+            if result and reminder_scheduler:
+                reminder_scheduler.schedule(reschedule_data["appointment_id"], result[0].get("next_reminder_at"))
+        
+        await automation_events.record("booking_rescheduled", f"Appointment {reschedule_data.get('appointment_id', '')} rescheduled",
+                                       appointment_id=reschedule_data.get("appointment_id"))
+        
         n8n_webhook = os.environ.get("N8N_RESCHEDULE_WEBHOOK", "https://your-n8n-instance.com/webhook/reschedule")
         
-        async with httpx.AsyncClient() as client:
-            response = await client.post(n8n_webhook, json=webhook_payload, timeout=30.0)
+        if not await deliver_webhook("reschedule", n8n_webhook, webhook_payload, reschedule_data.get("appointment_id")):
+            raise HTTPException(status_code=500, detail="Reschedule webhook failed")
         
         return {"status": "success", "message": "Reschedule automation triggered"}
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error in reschedule webhook: {e}")
         raise HTTPException(status_code=500, detail="Reschedule webhook failed")
@@ -1749,10 +5029,19 @@ async def n8n_cancellation_webhook(cancellation_data: Dict[str, Any]):
             }
         }
         
+        if cancellation_data.get("appointment_id"):
+            await slot_engine.release(cancellation_data["appointment_id"])
+            if reminder_scheduler:
+                reminder_scheduler.cancel(cancellation_data["appointment_id"])
+        
+        analytics_cache.expire("automation-stats", "automation-activity")
+        await automation_events.record("booking_cancelled", f"Appointment {cancellation_data.get('appointment_id', '')} cancelled",
+                                       appointment_id=cancellation_data.get("appointment_id"))
+        
         n8n_webhook = os.environ.get("N8N_CANCELLATION_WEBHOOK", "https://your-n8n-instance.com/webhook/cancellation")
         
-        async with httpx.AsyncClient() as client:
-            response = await client.post(n8n_webhook, json=webhook_payload, timeout=30.0)
+        if not await deliver_webhook("cancellation", n8n_webhook, webhook_payload, cancellation_data.get("appointment_id")):
+            raise HTTPException(status_code=500, detail="Cancellation webhook failed")
         
         return {"status": "success", "message": "Cancellation automation triggered"}
         
@@ -1760,273 +5049,743 @@ async def n8n_cancellation_webhook(cancellation_data: Dict[str, Any]):
         logger.error(f"Error in cancellation webhook: {e}")
         raise HTTPException(status_code=500, detail="Cancellation webhook failed")
 
+@api_router.post("/n8n/events")
+async def n8n_event_report(report: AutomationEventReport):
+    """n8n workflows report what they did (emails, SMS, reminders...) into the automation event log"""
+    if report.type not in REPORTED_EVENT_TYPES:
+        raise HTTPException(status_code=422, detail=f"Unknown event type: {report.type}")
+    try:
+        analytics_cache.expire("automation-stats", "automation-activity")
+        return await automation_events.record(
+            report.type, report.message, report.status,
+            appointment_id=report.appointment_id, workflow=report.workflow, details=report.details
+        )
+    except Exception as e:
+        logger.error(f"Error recording n8n event: {e}")
+        raise HTTPException(status_code=500, detail="Event recording failed")
+
 # Helper Functions
 async def process_conversation(user_input: str, session_data: SessionData, intent_result: Dict, language: str, context: Dict = None) -> Dict[str, Any]:
     """Process conversation using enhanced AI backend system with context awareness"""
     
-    # Update session with intent information
+    # Update session with intent information; which service is selected is up to the flow
     session_data.intent = intent_result["intent"]
     session_data.confidence = intent_result["confidence"]
     
-    if intent_result.get("service_id"):
-        session_data.selected_service = intent_result["service_id"]
-    
     # Use Enhanced AI service for response generation with context
     response = await mistral_service.generate_response(user_input, session_data, intent_result, language, context)
     
     return response
 
-def handle_greeting(user_input: str, intent_result: Dict, session_data: SessionData, language: str) -> Dict[str, Any]:
-    """Handle initial greeting and service identification"""
-    service = None
-    if intent_result["service_id"]:
-        service = next((s for s in AVAILABLE_SERVICES if s.id == intent_result["service_id"]), None)
+def generate_conversation_title(first_message: str, language: str) -> Dict[str, str]:
+    """Generate conversation title based on first message"""
+    title_en = first_message[:30] + ("..." if len(first_message) > 30 else "")
+    title_ar = first_message[:30] + ("..." if len(first_message) > 30 else "")
     
-    if language == "ar":
-        if service:
-            message = f"""مرحباً! أفهم أنك تحتاج مساعدة في **{service.name[language]}**. 
+    return {"en": title_en, "ar": title_ar}
 
-🕒 **تفاصيل الخدمة:**
-• المدة المقدرة: {service.estimated_time} دقيقة
-• {service.icon} {service.description[language]}
+async def deliver_webhook(workflow: str, url: str, payload: Dict[str, Any], appointment_id: str = None,
+                          timeout: float = 30.0) -> bool:
+    """POST a payload to an n8n workflow and record the outcome in the automation event log"""
+    started = time.perf_counter()
+    result = await webhook_dispatcher.send(url, payload, timeout)
+    details = {"latency_ms": round((time.perf_counter() - started) * 1000, 1)}
+    if "batch_size" in result:
+        details["batch_size"] = result["batch_size"]
+    if not result["ok"]:
+        logger.error(f"{workflow} webhook failed: {result['error']}")
+        await automation_events.record(
+            "webhook_error", f"{workflow.capitalize()} webhook failed - {result['error_type']}", "error",
+            appointment_id=appointment_id, workflow=workflow, details=details
+        )
+        return False
+    
+    logger.info(f"{workflow} webhook response: {result['status_code']}")
+    await automation_events.record(
+        "webhook_delivered", f"{workflow.capitalize()} workflow notified",
+        appointment_id=appointment_id, workflow=workflow,
+        details={"status_code": result["status_code"], **details}
+    )
+    return True
 
-{'📅 تتطلب هذه الخدمة حجز موعد.' if service.requires_appointment else '💬 هذه خدمة استفسار عام.'}
+async def trigger_n8n_webhook(booking_data: Dict[str, Any]):
+    """Forward a booking made in chat to the n8n booking workflow"""
+    try:
+        url = os.environ.get("N8N_BOOKING_WEBHOOK")
+        if not url:
+            logger.info(f"N8N_BOOKING_WEBHOOK not set; booking {booking_data['appointment_id']} not forwarded")
+            return
+        
+        logger.info(f"Triggering n8n webhook for booking: {booking_data['appointment_id']}")
+        await deliver_webhook("booking", url, {**booking_data, "webhook_type": "booking_created"}, booking_data["appointment_id"])
+        
+    except Exception as e:
+        logger.error(f"Error triggering n8n webhook: {e}")
 
-هل تريد المتابعة مع هذه الخدمة؟"""
-            session_data.step = "service_selection"
-        else:
-            message = """مرحباً! أنا MIND14، مساعدك الافتراضي الذكي.
+class AttachmentStore:
+    """Chat attachments in GridFS (``attachments.files`` / ``attachments.chunks``).
 
-🏛️ **يمكنني مساعدتك في:**
-• 🏥 تجديد البطاقة الصحية
-• 🆔 استبدال بطاقة الهوية
-• 👩‍⚕️ حجز المواعيد الطبية
-• 🎓 تسجيل الطلاب
-• 💬 الاستفسارات العامة
+    Uploads are parsed as they arrive: each file part goes straight into GridFS chunks
+    while its SHA-256 is computed, so a file is never held whole in memory or spooled to
+    disk, and a part over ``max_bytes`` is cut off at that point. A file whose content is
+    already stored is dropped and the existing attachment id returned.
+    """
 
-كيف يمكنني مساعدتك اليوم؟"""
-            session_data.step = "intent_detection"
-    else:
-        if service:
-            message = f"""Hello! I understand you need help with **{service.name[language]}**.
+    CHUNK_SIZE = 255 * 1024
+    # Types a browser may render from the API origin; anything else (HTML, SVG, ...) could
+    # run script there, so it is only ever offered as a download
+    INLINE_TYPES = frozenset({"application/pdf", "image/png", "image/jpeg", "text/plain"})
 
-🕒 **Service Details:**
-• Estimated time: {service.estimated_time} minutes
-• {service.icon} {service.description[language]}
+    def __init__(self, database=None, max_bytes: int = None, max_files: int = None):
+        self._database = database
+        self.max_bytes = max_bytes or int(os.environ.get("ATTACHMENT_MAX_BYTES", str(20 * 1024 * 1024)))
+        self.max_files = max_files or int(os.environ.get("ATTACHMENT_MAX_FILES", "5"))
+        self.counters = {"uploads": 0, "deduplicated": 0, "rejected": 0, "bytes_stored": 0}
 
-{'📅 This service requires an appointment.' if service.requires_appointment else '💬 This is a general inquiry service.'}
+    @property
+    def database(self):
+        return self._database if self._database is not None else mongo.db
 
-Would you like to proceed with this service?"""
-            session_data.step = "service_selection"
-        else:
-            message = """Hello! I'm MIND14, your AI virtual assistant.
+    @property
+    def bucket(self) -> AsyncIOMotorGridFSBucket:
+        return AsyncIOMotorGridFSBucket(self.database, bucket_name="attachments", chunk_size_bytes=self.CHUNK_SIZE)
 
-🏛️ **I can help you with:**
-• 🏥 Health card renewal
-• 🆔 ID card replacement
-• 👩‍⚕️ Medical appointments
-• 🎓 Student enrollment
-• 💬 General inquiries
+    @property
+    def max_request_bytes(self) -> int:
+        return self.max_files * (self.max_bytes + 16 * 1024)  # room for the multipart framing
 
-How can I assist you today?"""
-            session_data.step = "intent_detection"
-    
-    return {
-        "message": message,
-        "session_data": session_data,
-        "actions": []
-    }
+    async def ensure_indexes(self):
+        await self.database["attachments.files"].create_index([("sha256", ASCENDING), ("length", ASCENDING)], name="sha256")
 
-def handle_service_selection(user_input: str, session_data: SessionData, language: str) -> Dict[str, Any]:
-    """Handle service confirmation and proceed to booking"""
-    confirmation_words = {
-        "en": ["yes", "sure", "ok", "okay", "proceed", "continue", "confirm"],
-        "ar": ["نعم", "موافق", "حسنا", "متابعة", "استمر", "أكد", "موافقة"]
-    }
-    
-    is_confirming = any(word in user_input.lower() for word in confirmation_words[language])
-    
-    if is_confirming and session_data.selected_service:
-        service = next((s for s in AVAILABLE_SERVICES if s.id == session_data.selected_service), None)
-        
-        if service and service.requires_appointment:
-            if language == "ar":
-                message = f"""ممتاز! سأساعدك في حجز موعد لـ **{service.name[language]}**.
+    @staticmethod
+    def describe(file: Dict[str, Any], deduplicated: bool = False) -> Dict[str, Any]:
+        metadata = file.get("metadata") or {}
+        return {
+            "attachment_id": str(file["_id"]),
+            "filename": file.get("filename"),
+            "content_type": metadata.get("content_type", "application/octet-stream"),
+            "size": file.get("length", 0),
+            "sha256": file.get("sha256"),
+            "deduplicated": deduplicated
+        }
 
-📋 **المعلومات المطلوبة:**
-• الاسم الكامل
-• رقم الهاتف
-• التاريخ والوقت المفضل
+    async def save_multipart(self, content_type: str, body) -> List[Dict[str, Any]]:
+        """Store every file part of a ``multipart/form-data`` body read from the async
+        iterator ``body``; other form fields are ignored"""
+        mime_type, options = parse_options_header(content_type or "")
+        if mime_type != b"multipart/form-data" or b"boundary" not in options:
+            raise HTTPException(status_code=400, detail="Expected a multipart/form-data upload")
+
+        # The parser is push-based with sync callbacks: queue its events, then act on them
+        events = []
+        parser = MultipartParser(options[b"boundary"], {
+            "on_part_begin": lambda: events.append(("part_begin", b"")),
+            "on_header_field": lambda data, start, end: events.append(("header_field", data[start:end])),
+            "on_header_value": lambda data, start, end: events.append(("header_value", data[start:end])),
+            "on_header_end": lambda: events.append(("header_end", b"")),
+            "on_headers_finished": lambda: events.append(("headers_finished", b"")),
+            "on_part_data": lambda data, start, end: events.append(("part_data", data[start:end])),
+            "on_part_end": lambda: events.append(("part_end", b""))
+        })
 
-⏰ **ساعات العمل:** {service.working_hours['start']} - {service.working_hours['end']}
+        stored = []
+        upload = hasher = None
+        size = 0
+        headers, field, value = {}, b"", b""
+        try:
+            async for chunk in body:
+                parser.write(chunk)
+                for kind, data in events:
+                    if kind == "part_begin":
+                        headers, field, value = {}, b"", b""
+                    elif kind == "header_field":
+                        field += data
+                    elif kind == "header_value":
+                        value += data
+                    elif kind == "header_end":
+                        headers[field.lower()] = value
+                        field, value = b"", b""
+                    elif kind == "headers_finished":
+                        _, disposition = parse_options_header(headers.get(b"content-disposition", b""))
+                        if b"filename" not in disposition:
+                            continue
+                        if len(stored) >= self.max_files:
+                            raise HTTPException(status_code=413, detail=f"At most {self.max_files} files per upload")
+                        filename = disposition[b"filename"].decode("utf-8", "replace")
+                        file_type = headers.get(b"content-type", b"application/octet-stream").decode("latin-1")
+                        upload = self.bucket.open_upload_stream(filename, metadata={"content_type": file_type})
+                        hasher, size = hashlib.sha256(), 0
+                    elif kind == "part_data" and upload is not None:
+                        size += len(data)
+                        if size > self.max_bytes:
+                            self.counters["rejected"] += 1
+                            raise HTTPException(status_code=413, detail=f"Attachment exceeds {self.max_bytes} bytes")
+                        hasher.update(data)
+                        await upload.write(data)
+                    elif kind == "part_end" and upload is not None:
+                        stored.append(await self._finish(upload, hasher.hexdigest(), size))
+                        upload = None
+                events.clear()
+            parser.finalize()
+        except BaseException:
+            if upload is not None:
+                await upload.abort()
+            raise
+        return stored
+
+    async def _finish(self, upload, digest: str, size: int) -> Dict[str, Any]:
+        existing = await self.database["attachments.files"].find_one({"sha256": digest, "length": size})
+        if existing:
+            await upload.abort()
+            self.counters["deduplicated"] += 1
+            return self.describe(existing, deduplicated=True)
+        await upload.set("sha256", digest)
+        await upload.close()
+        self.counters["uploads"] += 1
+        self.counters["bytes_stored"] += size
+        return self.describe({
+            "_id": upload._id, "filename": upload.filename, "length": size, "sha256": digest,
+            "metadata": upload.metadata
+        })
 
-لنبدأ - ما هو اسمك الكامل؟"""
+    async def open(self, attachment_id: str):
+        """A GridOut for the attachment, or None if the id is unknown"""
+        try:
+            return await self.bucket.open_download_stream(ObjectId(attachment_id))
+        except (InvalidId, TypeError, gridfs_errors.NoFile):
+            return None
+
+    @staticmethod
+    def parse_range(range_header: Optional[str], length: int) -> Optional[tuple]:
+        """``(start, end)`` (inclusive) for a single ``bytes=`` range; None to send the whole
+        file (no header, or a form we do not serve partially); ValueError if unsatisfiable"""
+        if not range_header or not range_header.startswith("bytes=") or "," in range_header:
+            return None
+        first, _, last = range_header[6:].strip().partition("-")
+        try:
+            if first:
+                start = int(first)
+                end = min(int(last), length - 1) if last else length - 1
             else:
-                message = f"""Great! I'll help you book an appointment for **{service.name[language]}**.
+                start, end = max(length - int(last), 0), length - 1
+        except ValueError:
+            return None
+        if start > end or start >= length:
+            raise ValueError(range_header)
+        return start, end
+
+attachment_store = AttachmentStore()
+
+# Text extractors run in worker processes: plain module-level functions of the file bytes
+def _extract_plain_text(data: bytes) -> str:
+    return data.decode("utf-8", "replace")
+
+def _extract_pdf(data: bytes) -> str:
+    """Text layer of a PDF (no OCR of scanned pages)"""
+    from pypdf import PdfReader
+    return "\n".join(page.extract_text() or "" for page in PdfReader(io.BytesIO(data)).pages)
+
+def _extract_docx(data: bytes) -> str:
+    """Paragraph text of a .docx, read straight from word/document.xml"""
+    namespace = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        root = ElementTree.fromstring(archive.read("word/document.xml"))
+    paragraphs = ("".join(node.text or "" for node in paragraph.iter(f"{namespace}t"))
+                  for paragraph in root.iter(f"{namespace}p"))
+    return "\n".join(paragraph for paragraph in paragraphs if paragraph)
+
+def _extract_image_ocr(data: bytes) -> str:
+    import pytesseract
+    from PIL import Image
+    return pytesseract.image_to_string(Image.open(io.BytesIO(data)), lang="eng+ara")
+
+def _extract_stub(data: bytes) -> str:
+    """Test engine: treats any file as UTF-8 text"""
+    return data.decode("utf-8", "replace")
+
+EXTRACTION_ENGINES = {
+    "text": _extract_plain_text,
+    "pdf": _extract_pdf,
+    "docx": _extract_docx,
+    "ocr": _extract_image_ocr,
+    "stub": _extract_stub
+}
+
+def _run_extraction(engine: str, data: bytes, timeout: float, max_chars: int) -> str:
+    """Worker-process entry point: one extractor under a hard time limit"""
+    if hasattr(signal, "SIGALRM"):
+        def expire(signum, frame):
+            raise TimeoutError(f"{engine} extraction exceeded {timeout}s")
+        signal.signal(signal.SIGALRM, expire)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        return EXTRACTION_ENGINES[engine](data)[:max_chars]
+    finally:
+        if hasattr(signal, "SIGALRM"):
+            signal.setitimer(signal.ITIMER_REAL, 0)
+
+class DocumentExtractionService:
+    """Server-side text extraction for attachments, on a process pool.
+
+    Jobs are queued per attachment; the extractor is picked by content type from the
+    engines available here (PDF needs ``pypdf``, OCR needs ``pytesseract``, Pillow and a
+    ``tesseract`` binary; ``DOCUMENT_EXTRACTION_ENGINES`` overrides the set, e.g. ``stub``
+    in tests). A queued job holds only the attachment id: its bytes are read from GridFS
+    once one of the ``max_workers`` slots is free, so the backlog costs no memory. Each
+    run is cut off after ``timeout`` seconds inside the worker. Results,
+    with the intent and entities the NLU finds in the text, are cached by content hash in
+    ``document_extractions``, so the same file is never extracted twice.
+    """
+
+    DOCX_TYPE = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+    MAX_TEXT_CHARS = 100_000
+    MAX_JOBS_KEPT = 1000
+
+    def __init__(self, database=None, max_workers: int = None, timeout: float = None, max_pending: int = None,
+                 engines: List[str] = None):
+        self._database = database
+        self.max_workers = max_workers or int(os.environ.get("EXTRACTION_WORKERS", "2"))
+        self.timeout = timeout or float(os.environ.get("EXTRACTION_TIMEOUT_SECONDS", "30"))
+        self.max_pending = max_pending or int(os.environ.get("EXTRACTION_MAX_PENDING", "100"))
+        configured = os.environ.get("DOCUMENT_EXTRACTION_ENGINES")
+        self.engines = set(engines or (configured.split(",") if configured else self.available_engines()))
+        self.jobs: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._worker_slots = asyncio.Semaphore(self.max_workers)
+        self._tasks = set()
+        self.counters = {"submitted": 0, "cache_hits": 0, "completed": 0, "failed": 0, "timeouts": 0, "unsupported": 0}
+
+    @staticmethod
+    def available_engines() -> List[str]:
+        engines = ["text", "docx"]
+        if importlib.util.find_spec("pypdf") is not None:
+            engines.append("pdf")
+        if all(importlib.util.find_spec(module) is not None for module in ("pytesseract", "PIL")) and shutil.which("tesseract"):
+            engines.append("ocr")
+        return engines
+
+    @property
+    def collection(self):
+        return (self._database if self._database is not None else mongo.db).document_extractions
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self._executor
+
+    def engine_for(self, content_type: str, filename: str = "") -> Optional[str]:
+        if "stub" in self.engines:
+            return "stub"
+        filename = (filename or "").lower()
+        if content_type.startswith("text/"):
+            candidate = "text"
+        elif content_type == "application/pdf" or filename.endswith(".pdf"):
+            candidate = "pdf"
+        elif content_type == self.DOCX_TYPE or filename.endswith(".docx"):
+            candidate = "docx"
+        elif content_type.startswith("image/"):
+            candidate = "ocr"
+        else:
+            return None
+        return candidate if candidate in self.engines else None
+
+    @property
+    def pending(self) -> int:
+        return sum(job["status"] in ("queued", "running") for job in self.jobs.values())
+
+    def _new_job(self, attachment: Dict[str, Any], language: str) -> Dict[str, Any]:
+        job = {
+            "job_id": uuid.uuid4().hex,
+            "attachment_id": attachment["attachment_id"],
+            "sha256": attachment["sha256"],
+            "language": language,
+            "status": "queued",
+            "engine": None,
+            "cached": False,
+            "created_at": datetime.utcnow().isoformat(),
+            "finished_at": None
+        }
+        self.jobs[job["job_id"]] = job
+        while len(self.jobs) > self.MAX_JOBS_KEPT:
+            self.jobs.popitem(last=False)
+        return job
+
+    def _finish(self, job: Dict[str, Any], status: str, **fields):
+        job.update(status=status, finished_at=datetime.utcnow().isoformat(), **fields)
+
+    async def submit(self, attachment_id: str, language: str = "en") -> Optional[Dict[str, Any]]:
+        """Queue text extraction for an attachment; None if the attachment does not exist"""
+        grid_out = await attachment_store.open(attachment_id)
+        if grid_out is None:
+            return None
+        self.counters["submitted"] += 1
+        attachment = AttachmentStore.describe({
+            "_id": grid_out._id, "filename": grid_out.filename, "length": grid_out.length,
+            "metadata": grid_out.metadata, "sha256": getattr(grid_out, "sha256", None)
+        })
+        job = self._new_job(attachment, language)
+
+        cached = await self.collection.find_one({"_id": attachment["sha256"]}) if attachment["sha256"] else None
+        if cached:
+            self.counters["cache_hits"] += 1
+            self._finish(job, "completed", cached=True, engine=cached["engine"], result=self._result(cached))
+            return job
+
+        engine = self.engine_for(attachment["content_type"], attachment["filename"])
+        if engine is None:
+            self.counters["unsupported"] += 1
+            self._finish(job, "unsupported", error=f"No extractor available for {attachment['content_type']}")
+            return job
+        if self.pending > self.max_pending:
+            self._finish(job, "rejected", error="Extraction queue is full")
+            return job
+
+        job["engine"] = engine
+        task = asyncio.create_task(self._run(job))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return job
+
+    async def _run(self, job: Dict[str, Any]):
+        async with self._worker_slots:
+            await self._extract(job)
+
+    async def _extract(self, job: Dict[str, Any]):
+        job["status"] = "running"
+        started = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        try:
+            grid_out = await attachment_store.open(job["attachment_id"])
+            if grid_out is None:
+                raise FileNotFoundError("attachment no longer exists")
+            data = await grid_out.read()
+            text = await asyncio.wait_for(
+                loop.run_in_executor(self.executor, _run_extraction, job["engine"], data, self.timeout, self.MAX_TEXT_CHARS),
+                self.timeout + 5  # backstop if the in-worker timer cannot fire
+            )
+        except (TimeoutError, asyncio.TimeoutError):
+            self.counters["timeouts"] += 1
+            self._finish(job, "timeout", error=f"Extraction took longer than {self.timeout}s")
+            return
+        except Exception as e:
+            logger.error(f"Extraction of attachment {job['attachment_id']} failed: {e}")
+            self.counters["failed"] += 1
+            self._finish(job, "failed", error=f"{type(e).__name__}: {e}")
+            return
 
-📋 **Required Information:**
-• Full name
-• Phone number
-• Preferred date and time
+        try:
+            analysis = await self.analyze(text, job["language"])
+            record = {
+                "_id": job["sha256"],
+                "engine": job["engine"],
+                "text": text,
+                "analysis": analysis,
+                "processing_ms": round((time.perf_counter() - started) * 1000, 1),
+                "created_at": datetime.utcnow()
+            }
+            await self.collection.replace_one({"_id": job["sha256"]}, record, upsert=True)
+        except Exception as e:
+            logger.error(f"Storing extraction of attachment {job['attachment_id']} failed: {e}")
+            self.counters["failed"] += 1
+            self._finish(job, "failed", error=f"{type(e).__name__}: {e}")
+            return
+        self.counters["completed"] += 1
+        self._finish(job, "completed", result=self._result(record))
+
+    @staticmethod
+    async def analyze(text: str, language: str) -> Dict[str, Any]:
+        """Run the chat NLU over extracted text: intent and entities (name, phone, dates)"""
+        sample = text[:2000]
+        if not sample.strip():
+            return {"intent": None, "confidence": 0.0, "entities": {}}
+        language = language_detector.detect(sample, fallback=language)["language"]
+        intent = await mistral_service.classify_intent(sample, language)
+        return {
+            "language": language,
+            "intent": intent["intent"],
+            "confidence": intent["confidence"],
+            "entities": mistral_service._extract_entities(sample, language, intent.get("normalized_text"))
+        }
 
-⏰ **Working hours:** {service.working_hours['start']} - {service.working_hours['end']}
+    @staticmethod
+    def _result(record: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "engine": record["engine"],
+            "characters": len(record["text"]),
+            "text": record["text"],
+            "analysis": record["analysis"]
+        }
 
-Let's start - what's your full name?"""
-            
-            session_data.step = "booking"
-            session_data.booking_step = "name"
-        else:
-            if language == "ar":
-                message = f"""أنا هنا لمساعدتك في **{service.name[language]}**. 
+    async def analyses_for(self, attachment_ids: List[str]) -> List[Dict[str, Any]]:
+        """Cached document analyses for the given attachment ids (those already extracted)"""
+        object_ids = [ObjectId(attachment_id) for attachment_id in attachment_ids if ObjectId.is_valid(attachment_id)]
+        if not object_ids:
+            return []
+        files = await attachment_store.database["attachments.files"].find(
+            {"_id": {"$in": object_ids}}, {"sha256": 1}
+        ).to_list(len(object_ids))
+        by_hash = {file["sha256"]: str(file["_id"]) for file in files if file.get("sha256")}
+        if not by_hash:
+            return []
+        records = await self.collection.find({"_id": {"$in": list(by_hash)}}, {"analysis": 1}).to_list(len(by_hash))
+        return [{"attachment_id": by_hash[record["_id"]], **record["analysis"]} for record in records]
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "engines": sorted(self.engines),
+            "workers": self.max_workers,
+            "timeout_seconds": self.timeout,
+            "pending": self.pending,
+            "max_pending": self.max_pending,
+            **self.counters
+        }
 
-هذه خدمة استفسار عام، لذا يمكنك طرح أي أسئلة تريدها حول هذا الموضوع."""
-            else:
-                message = f"""I'm here to help with **{service.name[language]}**. 
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
 
-This is a general inquiry service, so feel free to ask any questions you have about this topic."""
-            
-            session_data.step = "general_inquiry"
-    else:
-        # Show service options
-        if language == "ar":
-            services_text = "\n".join([f"{s.icon} **{s.name['ar']}** - {s.description['ar']}" for s in AVAILABLE_SERVICES])
-            message = f"يمكنني مساعدتك في الخدمات التالية:\n\n{services_text}\n\nأي خدمة تهمك؟"
-        else:
-            services_text = "\n".join([f"{s.icon} **{s.name['en']}** - {s.description['en']}" for s in AVAILABLE_SERVICES])
-            message = f"I can help you with these services:\n\n{services_text}\n\nWhich service interests you?"
-    
-    return {
-        "message": message,
-        "session_data": session_data,
-        "actions": []
-    }
+document_extraction = DocumentExtractionService()
 
-def handle_booking(user_input: str, session_data: SessionData, language: str) -> Dict[str, Any]:
-    """Handle multi-step booking process"""
-    booking_step = session_data.booking_step or "name"
-    
-    if booking_step == "name":
-        session_data.collected_info["name"] = user_input
-        session_data.booking_step = "phone"
-        
-        if language == "ar":
-            message = f"شكراً، {user_input}! الآن أحتاج رقم هاتفك لتأكيد الموعد."
-        else:
-            message = f"Thank you, {user_input}! Now I need your phone number for appointment confirmation."
-            
-    elif booking_step == "phone":
-        session_data.collected_info["phone"] = user_input
-        session_data.booking_step = "datetime"
-        
-        if language == "ar":
-            message = "ممتاز! الآن أخبرني بالتاريخ والوقت المفضل. مثال: '25 يناير في الساعة 2:00 مساءً'"
-        else:
-            message = "Perfect! Now please tell me your preferred date and time. Example: 'January 25th at 2:00 PM'"
-            
-    elif booking_step == "datetime":
-        session_data.collected_info["preferred_datetime"] = user_input
-        
-        # Generate appointment confirmation
-        appointment_id = f"APT{datetime.now().strftime('%Y%m%d%H%M%S')}"
-        session_data.appointment_id = appointment_id
-        
-        service = next((s for s in AVAILABLE_SERVICES if s.id == session_data.selected_service), None)
-        
-        if language == "ar":
-            message = f"""🎉 **تم حجز الموعد بنجاح!**
+class IdempotencyStore:
+    """Responses to requests sent with an ``Idempotency-Key``, in a TTL-indexed collection.
 
-📅 **تفاصيل الموعد:**
-• الخدمة: {service.name['ar'] if service else 'غير محدد'}
-• الاسم: {session_data.collected_info.get('name')}
-• الهاتف: {session_data.collected_info.get('phone')}
-• الوقت المفضل: {session_data.collected_info.get('preferred_datetime')}
-• رقم الموعد: {appointment_id}
+    A key is claimed with an ``in_progress`` document that expires after ``lock_seconds``
+    (so a worker dying mid-request does not block retries for the whole TTL), then
+    completed with the response; the document is removed after ``ttl_seconds``.
+    """
 
-✅ ستتلقى تأكيداً عبر الرسائل النصية والبريد الإلكتروني قريباً.
+    def __init__(self, database=None, ttl_seconds: int = None, lock_seconds: int = None):
+        self._database = database
+        self.ttl_seconds = ttl_seconds or int(os.environ.get("IDEMPOTENCY_TTL_SECONDS", "86400"))
+        self.lock_seconds = lock_seconds or int(os.environ.get("IDEMPOTENCY_LOCK_SECONDS", "60"))
+        self.counters = {"executed": 0, "replayed": 0, "waited": 0, "mismatched": 0, "timed_out": 0}
 
-هل تحتاج مساعدة في أي شيء آخر؟"""
-        else:
-            message = f"""🎉 **Appointment Booked Successfully!**
+    @property
+    def collection(self):
+        return (self._database if self._database is not None else mongo.db).idempotency_keys
 
-📅 **Appointment Details:**
-• Service: {service.name['en'] if service else 'Not specified'}
-• Name: {session_data.collected_info.get('name')}
-• Phone: {session_data.collected_info.get('phone')}
-• Preferred Time: {session_data.collected_info.get('preferred_datetime')}
-• Appointment ID: {appointment_id}
+    async def ensure_indexes(self):
+        await self.collection.create_index("expires_at", name="expires_at", expireAfterSeconds=0)
 
-✅ You will receive confirmation via SMS and email shortly.
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        return await self.collection.find_one({"_id": key})
 
-Is there anything else I can help you with?"""
-        
-        session_data.step = "completed"
-        
-        # Prepare booking data for n8n webhook
-        booking_data = BookingData(
-            appointment_id=appointment_id,
-            service=service,
-            customer_info=session_data.collected_info,
-            language=language,
-            timestamp=datetime.now().isoformat()
+    async def claim(self, key: str, fingerprint: str) -> Optional[Dict[str, Any]]:
+        """Claim ``key`` for this request; returns None if claimed, else the existing record"""
+        now = datetime.utcnow()
+        claim = {"status": "in_progress", "fingerprint": fingerprint, "created_at": now,
+                 "expires_at": now + timedelta(seconds=self.lock_seconds)}
+        try:
+            await self.collection.insert_one({"_id": key, **claim})
+            return None
+        except DuplicateKeyError:
+            pass
+        # Take over a claim abandoned by a worker that never completed it
+        taken = await self.collection.find_one_and_update(
+            {"_id": key, "status": "in_progress", "expires_at": {"$lte": now}}, {"$set": claim}
         )
-        
-        return {
-            "message": message,
-            "session_data": session_data,
-            "actions": ["booking_completed"],
-            "trigger_webhook": True,
-            "booking_data": booking_data
-        }
-    
-    return {
-        "message": message,
-        "session_data": session_data,
-        "actions": []
-    }
+        if taken:
+            return None
+        return await self.get(key)
+
+    async def complete(self, key: str, status_code: int, headers: List[List[str]], body: bytes):
+        await self.collection.update_one({"_id": key}, {"$set": {
+            "status": "completed",
+            "status_code": status_code,
+            "headers": headers,
+            "body": body,
+            "expires_at": datetime.utcnow() + timedelta(seconds=self.ttl_seconds)
+        }})
+
+    async def release(self, key: str):
+        await self.collection.delete_one({"_id": key, "status": "in_progress"})
+
+idempotency_store = IdempotencyStore()
+
+class IdempotencyMiddleware:
+    """ASGI middleware running POSTs that carry an ``Idempotency-Key`` header at most once.
+
+    Applies to the paths starting with one of ``paths``. A repeat of a completed request
+    is answered from the stored response (same status, headers and body bytes, plus
+    ``Idempotent-Replayed: true``) after one ``_id`` lookup. A duplicate arriving while
+    the first is still running waits for its result: on an in-process event when the
+    first runs in this worker (checked before the store), by polling the store when it
+    runs in another. 5xx responses are not stored, so those can be retried. Reusing
+    a key with a different body is rejected with 422.
+    """
+
+    def __init__(self, app, store: IdempotencyStore, paths=("/api/chat", "/api/n8n/"), wait_timeout: float = 30.0,
+                 poll_interval: float = 0.1):
+        self.app = app
+        self.store = store
+        self.paths = tuple(paths)
+        self.wait_timeout = wait_timeout
+        self.poll_interval = poll_interval
+        self._inflight: Dict[str, Tuple[asyncio.Event, str]] = {}  # key -> (done, fingerprint)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or not scope["path"].startswith(self.paths):
+            return await self.app(scope, receive, send)
+        header = next((value for name, value in scope["headers"] if name == b"idempotency-key"), None)
+        if header is None:
+            return await self.app(scope, receive, send)
+        if not header or len(header) > 255:
+            return await self._error(send, 400, "Idempotency-Key must be 1-255 characters")
+
+        body = b""
+        while True:
+            message = await receive()
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                break
+        key = f"{scope['path']}:{header.decode('latin-1')}"
+        fingerprint = hashlib.sha256(body).hexdigest()
+
+        deadline = time.monotonic() + self.wait_timeout
+        waited = False
+        while True:
+            local = self._inflight.get(key)
+            if local is not None:
+                done, running_fingerprint = local
+                if running_fingerprint != fingerprint:
+                    self.store.counters["mismatched"] += 1
+                    return await self._error(send, 422, "Idempotency-Key was already used with a different request")
+                # Running in this worker: wait for it here, the store is read once it has finished
+                if not waited:
+                    waited = True
+                    self.store.counters["waited"] += 1
+                try:
+                    await asyncio.wait_for(done.wait(), max(deadline - time.monotonic(), 0))
+                except asyncio.TimeoutError:
+                    pass
+
+            stored = await self.store.get(key)
+            if stored is None:
+                stored = await self.store.claim(key, fingerprint)
+                if stored is None:
+                    return await self._execute(key, fingerprint, scope, body, send)
+
+            if stored["fingerprint"] != fingerprint:
+                self.store.counters["mismatched"] += 1
+                return await self._error(send, 422, "Idempotency-Key was already used with a different request")
+            if stored["status"] == "completed":
+                self.store.counters["replayed"] += 1
+                return await self._replay(stored, send)
+            if time.monotonic() >= deadline:
+                self.store.counters["timed_out"] += 1
+                return await self._error(send, 409, "A request with this Idempotency-Key is still being processed")
+            if key not in self._inflight:
+                # Running in another worker: poll the store
+                if not waited:
+                    waited = True
+                    self.store.counters["waited"] += 1
+                await asyncio.sleep(self.poll_interval)
+
+    async def _execute(self, key: str, fingerprint: str, scope, body: bytes, send):
+        self.store.counters["executed"] += 1
+        done = asyncio.Event()
+        self._inflight[key] = (done, fingerprint)
+        response = {"status": 500, "headers": [], "body": b"", "stored": False}
+        body_sent = False
+
+        async def receive_body():
+            nonlocal body_sent
+            if body_sent:
+                return {"type": "http.disconnect"}
+            body_sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        async def capture(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                response["headers"] = [[name.decode("latin-1"), value.decode("latin-1")]
+                                       for name, value in message.get("headers", [])]
+            elif message["type"] == "http.response.body":
+                response["body"] += message.get("body", b"")
+                if not message.get("more_body") and response["status"] < 500:
+                    # Stored before the last chunk goes out (and before background tasks run)
+                    await self.store.complete(key, response["status"], response["headers"], response["body"])
+                    response["stored"] = True
+                    done.set()
+            await send(message)
 
-def handle_general(user_input: str, session_data: SessionData, language: str) -> Dict[str, Any]:
-    """Handle general inquiries"""
-    if language == "ar":
-        message = "أفهم سؤالك. كمساعدك الافتراضي، أنا هنا لمساعدتك في خدمات متنوعة. إذا كنت تحتاج مساعدة محددة، يرجى إخباري!"
-    else:
-        message = "I understand your question. As your virtual assistant, I'm here to help with various services. If you need specific assistance, please let me know!"
-    
-    return {
-        "message": message,
-        "session_data": session_data,
-        "actions": []
-    }
-
-def generate_conversation_title(first_message: str, language: str) -> Dict[str, str]:
-    """Generate conversation title based on first message"""
-    title_en = first_message[:30] + ("..." if len(first_message) > 30 else "")
-    title_ar = first_message[:30] + ("..." if len(first_message) > 30 else "")
-    
-    return {"en": title_en, "ar": title_ar}
-
-async def trigger_n8n_webhook(booking_data: BookingData):
-    """Trigger n8n webhook for booking automation"""
+        try:
+            await self.app(scope, receive_body, capture)
+        finally:
+            if not response["stored"]:
+                await self.store.release(key)
+            self._inflight.pop(key, None)
+            done.set()
+
+    async def _replay(self, stored: Dict[str, Any], send):
+        headers = [(name.encode("latin-1"), value.encode("latin-1")) for name, value in stored["headers"]]
+        await send({"type": "http.response.start", "status": stored["status_code"],
+                    "headers": headers + [(b"idempotent-replayed", b"true")]})
+        await send({"type": "http.response.body", "body": bytes(stored["body"])})
+
+    async def _error(self, send, status_code: int, detail: str):
+        body = json.dumps({"detail": detail}).encode("utf-8")
+        await send({"type": "http.response.start", "status": status_code, "headers": [
+            (b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())
+        ]})
+        await send({"type": "http.response.body", "body": body})
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Open the MongoDB client and initialize services on startup; release them on shutdown"""
+    logger.info("Starting MIND14 Virtual Front Desk API...")
+    mongo.connect()
+    await mistral_service.ensure_model_available()
+    load_intent_model()
     try:
-        logger.info(f"Triggering n8n webhook for booking: {booking_data.appointment_id}")
-        
-        # Here you would call your actual n8n webhook
-        # Example:
-        # async with httpx.AsyncClient() as client:
-        #     response = await client.post(
-        #         "https://your-n8n-instance.com/webhook/booking",
-        #         json=booking_data.dict(),
-        #         headers={"Authorization": "Bearer YOUR_TOKEN"}
-        #     )
-        
-        # For now, just log the booking data
-        logger.info(f"Booking data: {booking_data.dict()}")
-        
+        await asyncio.to_thread(semantic_index.load_or_build)
     except Exception as e:
-        logger.error(f"Error triggering n8n webhook: {e}")
+        logger.error(f"Semantic index initialization failed: {e}")
+    try:
+        await slot_engine.ensure_indexes()
+        await slot_engine.materialize()
+    except Exception as e:
+        logger.error(f"Slot inventory initialization failed: {e}")
+    try:
+        await automation_events.ensure_collection()
+    except Exception as e:
+        logger.error(f"Automation event log initialization failed: {e}")
+    try:
+        await attachment_store.ensure_indexes()
+    except Exception as e:
+        logger.error(f"Attachment index creation failed: {e}")
+    try:
+        await idempotency_store.ensure_indexes()
+    except Exception as e:
+        logger.error(f"Idempotency key index creation failed: {e}")
+    refresh_task = asyncio.create_task(slot_engine.run_refresh_loop())
+    metrics_task = asyncio.create_task(publish_dashboard_metrics())
+    relay_task = asyncio.create_task(automation_events.relay())
+    reminder_task = asyncio.create_task(reminder_scheduler.run()) if reminder_scheduler else None
+    logger.info("API startup completed")
+    try:
+        yield
+    finally:
+        refresh_task.cancel()
+        metrics_task.cancel()
+        relay_task.cancel()
+        if reminder_task:
+            reminder_task.cancel()
+        await webhook_dispatcher.close()
+        document_extraction.shutdown()
+        mongo.close()
+
+# Create the main app
+app = FastAPI(title="MIND14 Virtual Front Desk API", version="1.0.0", lifespan=lifespan)
 
 # Include the API router
 app.include_router(api_router)
 
+# Retried chat turns and n8n calls with the same Idempotency-Key run once
+app.add_middleware(IdempotencyMiddleware, store=idempotency_store)
+
 # CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -2035,7 +5794,3 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
-
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
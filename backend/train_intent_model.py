@@ -0,0 +1,212 @@
+"""Streaming export-and-train pipeline for the local intent model.
+
+Each assistant message stores the intent (and confidence) classified from the user
+message before it; those user -> intent pairs are the training data. Conversations
+are read through a batched cursor and every stage keeps bounded memory, so the
+pipeline scales to millions of messages:
+
+* text is normalised (``normalize_text``, as at serving time) and de-duplicated through a fixed-size Bloom filter,
+* pairs are hashed deterministically into train/evaluation splits,
+* each split keeps a per-intent reservoir sample of bounded size.
+
+The model artifact is written together with an accuracy report
+(``<artifact>.report.json``) that the analytics endpoint serves.
+
+    python train_intent_model.py --min-confidence 0.8 --output models/intent_model.npz
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import time
+from collections import defaultdict
+from datetime import datetime
+
+import numpy as np
+from pymongo import MongoClient
+
+from server import INTENT_MODEL_PATH, HashedNgramIntentModel, intent_model_report_path, logger, normalize_text
+
+
+class BloomFilter:
+    """Fixed-memory set membership for de-duplication (false positives only drop a few extra rows)"""
+
+    def __init__(self, size_bits=2 ** 27, hashes=4):
+        self.size_bits = size_bits
+        self.hashes = hashes
+        self.bits = np.zeros(size_bits // 8, dtype=np.uint8)
+
+    def add(self, digest: bytes) -> bool:
+        """Insert a 16-byte digest; returns False if it was (probably) already present"""
+        positions = [int.from_bytes(digest[i * 4:(i + 1) * 4], "big") % self.size_bits for i in range(self.hashes)]
+        present = all(self.bits[p >> 3] & (1 << (p & 7)) for p in positions)
+        for p in positions:
+            self.bits[p >> 3] |= 1 << (p & 7)
+        return not present
+
+
+class Reservoir:
+    """Uniform sample of at most ``capacity`` items per label from a stream"""
+
+    def __init__(self, capacity, seed=14):
+        self.capacity = capacity
+        self.items = defaultdict(list)
+        self.seen = defaultdict(int)
+        self.rng = random.Random(seed)
+
+    def add(self, label, item):
+        self.seen[label] += 1
+        bucket = self.items[label]
+        if len(bucket) < self.capacity:
+            bucket.append(item)
+        else:
+            index = self.rng.randrange(self.seen[label])
+            if index < self.capacity:
+                bucket[index] = item
+
+    def rows(self):
+        return [(item, label) for label, bucket in self.items.items() for item in bucket]
+
+
+def stream_pairs(database, min_confidence, batch_size, since=None, stats=None):
+    """Yield (text, intent, language) for every labelled user message, reading in cursor batches"""
+    query = {"updated_at": {"$gte": since}} if since else {}
+    projection = {
+        "_id": 0,
+        "messages.role": 1,
+        "messages.content": 1,
+        "messages.language": 1,
+        "messages.intent": 1,
+        "messages.confidence": 1
+    }
+    cursor = database.conversations.find(query, projection, batch_size=batch_size)
+    try:
+        for conversation in cursor:
+            stats["conversations"] += 1
+            messages = conversation.get("messages", [])
+            for user_message, reply in zip(messages, messages[1:]):
+                if user_message.get("role") != "user" or reply.get("role") != "assistant" or not reply.get("intent"):
+                    continue
+                stats["labelled_messages"] += 1
+                if (reply.get("confidence") or 0.0) < min_confidence:
+                    stats["low_confidence"] += 1
+                    continue
+                yield user_message.get("content", ""), reply["intent"], user_message.get("language", "en")
+    finally:
+        cursor.close()
+
+
+def evaluate(model, rows, batch_size=2048):
+    """Accuracy overall, per intent (precision/recall/F1) and per language, plus the confusion matrix"""
+    confusion = defaultdict(lambda: defaultdict(int))
+    per_language = defaultdict(lambda: [0, 0])
+
+    for start in range(0, len(rows), batch_size):
+        batch = rows[start:start + batch_size]
+        predictions = model.predict([text for (text, _language), _label in batch])
+        for ((_text, language), label), prediction in zip(batch, predictions):
+            confusion[label][prediction["intent"]] += 1
+            per_language[language][0] += prediction["intent"] == label
+            per_language[language][1] += 1
+
+    intents = sorted(set(confusion) | {p for row in confusion.values() for p in row})
+    per_intent = {}
+    for intent in intents:
+        true_positive = confusion[intent][intent]
+        support = sum(confusion[intent].values())
+        predicted = sum(confusion[label][intent] for label in confusion)
+        precision = true_positive / predicted if predicted else 0.0
+        recall = true_positive / support if support else 0.0
+        per_intent[intent] = {
+            "precision": precision,
+            "recall": recall,
+            "f1": 2 * precision * recall / (precision + recall) if precision + recall else 0.0,
+            "support": support
+        }
+
+    correct = sum(confusion[intent][intent] for intent in confusion)
+    return {
+        "accuracy": correct / len(rows) if rows else None,
+        "per_intent": per_intent,
+        "per_language": {language: hits / total for language, (hits, total) in per_language.items()},
+        "confusion": {label: dict(row) for label, row in confusion.items()}
+    }
+
+
+def run_pipeline(database, args):
+    started = time.perf_counter()
+    stats = defaultdict(int)
+    seen = BloomFilter(size_bits=args.dedupe_bits)
+    train = Reservoir(args.max_per_intent, seed=args.seed)
+    holdout = Reservoir(max(1, args.max_per_intent // 4), seed=args.seed + 1)
+
+    for text, intent, language in stream_pairs(database, args.min_confidence, args.batch_size, args.since, stats):
+        text = normalize_text(text)
+        if not text:
+            continue
+        digest = hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+        if not seen.add(digest):
+            stats["duplicates"] += 1
+            continue
+        stats["unique_pairs"] += 1
+        # Deterministic split: the same text always lands on the same side across runs
+        target = holdout if digest[-1] % 100 < args.eval_percent else train
+        target.add(intent, (text, language))
+
+    train_rows, eval_rows = train.rows(), holdout.rows()
+    if len({label for _item, label in train_rows}) < 2:
+        raise SystemExit(f"Need at least two intents to train, found {sorted({l for _i, l in train_rows})}")
+
+    model = HashedNgramIntentModel.fit(
+        [text for (text, _language), _label in train_rows],
+        [label for _item, label in train_rows],
+        n_features=args.features,
+        epochs=args.epochs,
+        seed=args.seed
+    )
+    evaluation = evaluate(model, eval_rows)
+    model.metadata["accuracy"] = evaluation["accuracy"]
+
+    report = {
+        "model_version": model.version,
+        "evaluated_at": datetime.utcnow().isoformat(),
+        "label_source": "stored classifier labels with confidence >= %.2f" % args.min_confidence,
+        "counts": {
+            **stats,
+            "train_rows": len(train_rows),
+            "eval_rows": len(eval_rows)
+        },
+        "elapsed_seconds": time.perf_counter() - started,
+        **evaluation
+    }
+    return model, report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export labelled turns from Mongo and train the intent model")
+    parser.add_argument("--min-confidence", type=float, default=0.8)
+    parser.add_argument("--output", default=str(INTENT_MODEL_PATH))
+    parser.add_argument("--batch-size", type=int, default=1000, help="Mongo cursor batch size")
+    parser.add_argument("--since", type=datetime.fromisoformat, help="Only conversations updated after this ISO date")
+    parser.add_argument("--max-per-intent", type=int, default=20000, help="Training reservoir size per intent")
+    parser.add_argument("--eval-percent", type=int, default=10)
+    parser.add_argument("--dedupe-bits", type=int, default=2 ** 27, help="Bloom filter size (2^27 bits = 16 MiB)")
+    parser.add_argument("--features", type=int, default=2 ** 16)
+    parser.add_argument("--epochs", type=int, default=12)
+    parser.add_argument("--seed", type=int, default=14)
+    args = parser.parse_args()
+
+    database = MongoClient(os.environ["MONGO_URL"])[os.environ["DB_NAME"]]
+    model, report = run_pipeline(database, args)
+
+    path = model.save(args.output)
+    intent_model_report_path(path).write_text(json.dumps(report, indent=2, ensure_ascii=False))
+    logger.info(
+        f"Trained intent model {model.version}: {report['counts']['unique_pairs']} unique pairs "
+        f"({report['counts']['duplicates']} duplicates), accuracy {report['accuracy']} -> {path}"
+    )
+
+
+if __name__ == "__main__":
+    main()
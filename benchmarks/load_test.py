@@ -0,0 +1,251 @@
+"""Async load generator for the MIND14 chat API.
+
+Replays bilingual multi-turn booking scripts (greeting with a service request ->
+service confirmation -> name -> phone -> datetime) with a configurable concurrency and
+Poisson arrival rate, then reports p50/p95/p99 latency per endpoint and per
+conversation step, errors and throughput.
+
+By default the API runs in-process against mongomock with the rule-based AI
+path, so it works fully offline:
+
+    python benchmarks/load_test.py --conversations 500 --concurrency 50 --rate 100
+
+Point it at a running instance (local mongod, real config) instead with:
+
+    python benchmarks/load_test.py --base-url http://localhost:8001
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from pathlib import Path
+
+import httpx
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+
+SCRIPTS = {
+    "en": [
+        [
+            ("greeting", "Hello, I need to renew my health card"),
+            ("service_selection", "yes please"),
+            ("name", "John Smith"),
+            ("phone", "+1 555 123 4567"),
+            ("datetime", "{choice}"),
+        ],
+        [
+            ("greeting", "Hi, I want to book a doctor appointment"),
+            ("service_selection", "ok"),
+            ("name", "Maria Garcia"),
+            ("phone", "0501234567"),
+            ("datetime", "tomorrow at 10:00"),
+        ],
+    ],
+    "ar": [
+        [
+            ("greeting", "مرحبا، أريد تجديد البطاقة الصحية"),
+            ("service_selection", "نعم"),
+            ("name", "أحمد محمد"),
+            ("phone", "٠٥٠١٢٣٤٥٦٧"),
+            ("datetime", "{choice}"),
+        ],
+        [
+            ("greeting", "السلام عليكم، أحتاج موعد طبي مع الطبيب"),
+            ("service_selection", "موافق"),
+            ("name", "فاطمة علي"),
+            ("phone", "0559876543"),
+            ("datetime", "غداً الساعة ١١"),
+        ],
+    ],
+}
+
+
+class LatencyRecorder:
+    """Collects latencies and errors keyed by endpoint and by conversation step"""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(lambda: defaultdict(int))
+        self.completed_bookings = 0
+        self.conversations = 0
+
+    def record(self, key, seconds, error=None):
+        self.latencies[key].append(seconds)
+        if error is not None:
+            self.errors[key][str(error)] += 1
+
+    @staticmethod
+    def percentile(sorted_values, fraction):
+        if not sorted_values:
+            return 0.0
+        index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+        return sorted_values[index]
+
+    def summary(self, elapsed):
+        rows = {}
+        for key, values in sorted(self.latencies.items()):
+            ordered = sorted(values)
+            rows[key] = {
+                "count": len(ordered),
+                "errors": sum(self.errors[key].values()),
+                "error_breakdown": dict(self.errors[key]),
+                "p50_ms": self.percentile(ordered, 0.50) * 1000,
+                "p95_ms": self.percentile(ordered, 0.95) * 1000,
+                "p99_ms": self.percentile(ordered, 0.99) * 1000,
+                "max_ms": ordered[-1] * 1000,
+            }
+
+        requests = sum(len(v) for k, v in self.latencies.items() if k.startswith("endpoint:"))
+        return {
+            "elapsed_seconds": elapsed,
+            "conversations": self.conversations,
+            "completed_bookings": self.completed_bookings,
+            "requests": requests,
+            "throughput_rps": requests / elapsed if elapsed else 0.0,
+            "errors": sum(sum(e.values()) for k, e in self.errors.items() if k.startswith("endpoint:")),
+            "breakdown": rows,
+        }
+
+
+async def timed_request(client, recorder, method, path, step=None, **kwargs):
+    started = time.perf_counter()
+    error = None
+    response = None
+    try:
+        response = await client.request(method, path, **kwargs)
+        if response.status_code >= 400:
+            error = response.status_code
+    except Exception as e:
+        error = type(e).__name__
+    elapsed = time.perf_counter() - started
+
+    recorder.record(f"endpoint:{method} {path}", elapsed, error)
+    if step:
+        recorder.record(f"step:{step}", elapsed, error)
+    return response if error is None else None
+
+
+async def run_conversation(client, recorder, rng, think_time):
+    language = rng.choice(list(SCRIPTS))
+    script = rng.choice(SCRIPTS[language])
+    conversation_id = None
+    recorder.conversations += 1
+
+    await timed_request(client, recorder, "GET", "/api/services")
+
+    for step, message in script:
+        if think_time:
+            await asyncio.sleep(rng.expovariate(1.0 / think_time))
+
+        payload = {
+            "message": message.format(choice=rng.randint(1, 3)),
+            "conversation_id": conversation_id,
+            "language": language,
+            "attachments": [],
+        }
+        response = await timed_request(client, recorder, "POST", "/api/chat", step=f"{language}:{step}", json=payload)
+        if response is None:
+            return
+
+        body = response.json()
+        conversation_id = body["conversation_id"]
+        if body["session_data"].get("step") == "completed":
+            recorder.completed_bookings += 1
+            return
+
+
+async def run_load(client, args):
+    recorder = LatencyRecorder()
+    rng = random.Random(args.seed)
+    semaphore = asyncio.Semaphore(args.concurrency)
+    tasks = []
+
+    async def guarded():
+        async with semaphore:
+            await run_conversation(client, recorder, rng, args.think_time)
+
+    started = time.perf_counter()
+    for _ in range(args.conversations):
+        tasks.append(asyncio.create_task(guarded()))
+        if args.rate > 0:
+            # Open-loop Poisson arrivals at the requested conversations/second
+            await asyncio.sleep(rng.expovariate(args.rate))
+    await asyncio.gather(*tasks)
+    summary = recorder.summary(time.perf_counter() - started)
+
+    # Connection pool usage over the run (check-out wait time shows pool saturation)
+    response = await client.get("/api/analytics/database-pool")
+    if response.status_code == 200:
+        summary["database_pool"] = response.json()["pool"]
+    return summary
+
+
+@asynccontextmanager
+async def in_process_client(mongo):
+    """Run the FastAPI app in-process on the rule-based path, optionally on mongomock"""
+    os.environ.setdefault("MISTRAL_ENABLED", "false")
+    sys.path.insert(0, str(BACKEND_DIR))
+    import server
+
+    if mongo == "mock":
+        from mongomock_motor import AsyncMongoMockClient
+        server.mongo.use(AsyncMongoMockClient()[os.environ.get("DB_NAME", "load_test")])
+
+    async with server.app.router.lifespan_context(server.app):
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://load-test", timeout=60.0) as client:
+            yield client
+
+
+def print_report(summary):
+    print(f"\nConversations: {summary['conversations']}  completed bookings: {summary['completed_bookings']}")
+    print(f"Requests: {summary['requests']}  errors: {summary['errors']}  "
+          f"elapsed: {summary['elapsed_seconds']:.2f}s  throughput: {summary['throughput_rps']:.1f} req/s\n")
+    print(f"{'key':<40} {'count':>7} {'errors':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for key, row in summary["breakdown"].items():
+        print(f"{key:<40} {row['count']:>7} {row['errors']:>7} {row['p50_ms']:>9.2f} "
+              f"{row['p95_ms']:>9.2f} {row['p99_ms']:>9.2f} {row['max_ms']:>9.2f}")
+
+    pool = summary.get("database_pool")
+    if pool and pool["checkouts"]:
+        print(f"\nMongo pool: {pool['checkouts']} check-outs, peak in use {pool['peak_in_use']}, "
+              f"wait avg {pool['avg_wait_ms']:.2f} ms / max {pool['max_wait_ms']:.2f} ms, "
+              f"failures {pool['checkout_failures'] or 0}")
+
+
+async def main_async(args):
+    if args.base_url:
+        async with httpx.AsyncClient(base_url=args.base_url, timeout=60.0) as client:
+            return await run_load(client, args)
+    async with in_process_client(args.mongo) as client:
+        return await run_load(client, args)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the MIND14 chat API")
+    parser.add_argument("--base-url", help="Target a running instance instead of the in-process app")
+    parser.add_argument("--mongo", choices=["mock", "env"], default="mock",
+                        help="In-process database: mongomock, or MONGO_URL/DB_NAME from the environment")
+    parser.add_argument("--conversations", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--rate", type=float, default=0.0,
+                        help="Conversation arrivals per second (Poisson); 0 starts them all at once")
+    parser.add_argument("--think-time", type=float, default=0.0, help="Mean pause between turns in seconds")
+    parser.add_argument("--seed", type=int, default=14)
+    parser.add_argument("--json", dest="json_path", help="Also write the summary to this file")
+    args = parser.parse_args()
+
+    summary = asyncio.run(main_async(args))
+    print_report(summary)
+    if args.json_path:
+        Path(args.json_path).write_text(json.dumps(summary, indent=2))
+    return 1 if summary["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,309 @@
+"""Microbenchmarks for the rule-based NLU hot path, with JSON baselines and regression gating.
+
+Measures per-call latency, throughput and per-call allocation peaks for the functions
+that run on every rule-based turn, and reports intent accuracy over the labelled
+English/Arabic corpus next to the timings, so a speed-up cannot silently change
+classifications.
+
+    python benchmarks/nlu_benchmark.py run                       # print results
+    python benchmarks/nlu_benchmark.py run --save                # refresh the committed baseline
+    python benchmarks/nlu_benchmark.py run --compare             # run and gate against the baseline
+    python benchmarks/nlu_benchmark.py compare old.json new.json --threshold 0.15
+"""
+import argparse
+import hashlib
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from collections import defaultdict
+from datetime import datetime
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+BACKEND_DIR = ROOT_DIR / "backend"
+CORPUS_PATH = Path(__file__).resolve().parent / "nlu_corpus.json"
+BASELINE_PATH = Path(__file__).resolve().parent / "baselines" / "nlu_baseline.json"
+
+os.environ.setdefault("MISTRAL_ENABLED", "false")
+if str(BACKEND_DIR) not in sys.path:
+    sys.path.insert(0, str(BACKEND_DIR))
+
+import server  # noqa: E402
+from server import SessionData  # noqa: E402
+
+ENTITY_SAMPLES = [
+    ("en", "My name is John Smith, call me on +1 555 123 4567 or john@example.com"),
+    ("en", "I am 34 years old and need an urgent appointment tomorrow at 2:30 pm"),
+    ("en", "Can I come on Sunday morning at 10:00?"),
+    ("ar", "اسمي أحمد محمد ورقمي 0501234567"),
+    ("ar", "أريد موعد غداً الساعة ٣ مساءً، الأمر عاجل"),
+]
+
+
+def load_corpus(path=CORPUS_PATH):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)["samples"]
+
+
+def run_sync(coroutine):
+    """Drive a coroutine that never suspends (no I/O) without event-loop overhead"""
+    try:
+        coroutine.send(None)
+    except StopIteration as stop:
+        return stop.value
+    coroutine.close()
+    raise RuntimeError("benchmarked coroutine suspended; only I/O-free paths can be measured")
+
+
+def rule_generation_cases():
+    """(language, user_input, session factory) triples covering the I/O-free dialogue states"""
+    def session(**kwargs):
+        return lambda: SessionData(**kwargs)
+
+    cases = []
+    for language, greeting, confirm, question in (
+        ("en", "Hello, I need to renew my health card", "yes please", "What are your working hours?"),
+        ("ar", "مرحبا، أريد تجديد البطاقة الصحية", "نعم", "ما هي ساعات العمل؟"),
+    ):
+        cases += [
+            (language, greeting, session()),
+            (language, confirm, session(step="service_selection", intent="health_card_renewal",
+                                        selected_service="health-card-renewal")),
+            (language, question, session(step="general_inquiry", intent="general_inquiry")),
+            (language, "Sara Ahmed", session(step="booking", booking_step="name", intent="health_card_renewal",
+                                             selected_service="health-card-renewal")),
+        ]
+    return cases
+
+
+def build_benchmarks(corpus):
+    """name -> (list of zero-argument callables, one per call)"""
+    service = server.mistral_service
+    benchmarks = {
+        "detect_language": [
+            (lambda t=sample["text"]: server.language_detector.detect(t)) for sample in corpus
+        ],
+        "normalize_text": [
+            (lambda t=sample["text"]: server.normalize_text(t)) for sample in corpus
+        ],
+        # Keyword scoring without the per-text memo, i.e. the cost of a message seen for the first time
+        "score_intents_uncached": [
+            (lambda t=server.normalize_text(sample["text"]), l=sample["language"]: service._score_intents_uncached(t, l))
+            for sample in corpus
+        ],
+        "fallback_intent_classification": [
+            (lambda s=sample: service._fallback_intent_classification(s["text"], s["language"])) for sample in corpus
+        ],
+        "extract_entities": [
+            (lambda t=sample["text"], l=sample["language"]: service._extract_entities(t, l)) for sample in corpus
+        ] + [
+            (lambda t=text, l=language: service._extract_entities(t, l)) for language, text in ENTITY_SAMPLES
+        ],
+    }
+
+    generation_calls = []
+    for language, text, make_session in rule_generation_cases():
+        intent_result = service._fallback_intent_classification(text, language)
+
+        def call(t=text, l=language, make=make_session, result=intent_result):
+            session = make()
+            session.intent = session.intent or result["intent"]
+            return run_sync(service._generate_with_rules(t, session, result, l))
+        generation_calls.append(call)
+    benchmarks["generate_with_rules"] = generation_calls
+
+    return benchmarks
+
+
+def measure(calls, rounds, min_time):
+    """Timing and allocation statistics for a list of calls"""
+    for call in calls:  # warm-up (regex compilation, caches)
+        call()
+
+    # Repeat the pass enough times that each round lasts at least ``min_time``
+    started = time.perf_counter()
+    for call in calls:
+        call()
+    single_pass = max(time.perf_counter() - started, 1e-9)
+    passes = max(1, int(min_time / single_pass))
+
+    per_call = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        for _ in range(passes):
+            for call in calls:
+                call()
+        per_call.append((time.perf_counter() - started) / (passes * len(calls)))
+
+    peaks = []
+    tracemalloc.start()
+    try:
+        for call in calls:
+            tracemalloc.reset_peak()
+            baseline, _ = tracemalloc.get_traced_memory()
+            call()
+            _, peak = tracemalloc.get_traced_memory()
+            peaks.append(peak - baseline)
+    finally:
+        tracemalloc.stop()
+
+    median = statistics.median(per_call)
+    return {
+        "calls_per_round": passes * len(calls),
+        "median_us": median * 1e6,
+        "min_us": min(per_call) * 1e6,
+        "stdev_us": (statistics.stdev(per_call) if len(per_call) > 1 else 0.0) * 1e6,
+        "throughput_per_s": 1.0 / median,
+        "mean_peak_alloc_bytes": statistics.mean(peaks),
+        "max_peak_alloc_bytes": max(peaks),
+    }
+
+
+def evaluate_accuracy(corpus):
+    """Intent accuracy of the rule-based classifier overall, per language and per intent,
+    plus how often the language detector agrees with the corpus label"""
+    service = server.mistral_service
+    totals, hits = defaultdict(int), defaultdict(int)
+    predictions = []
+
+    for sample in corpus:
+        totals["language_detection"] += 1
+        hits["language_detection"] += server.language_detector.detect(sample["text"])["language"] == sample["language"]
+
+        predicted = service._fallback_intent_classification(sample["text"], sample["language"])["intent"]
+        predictions.append(predicted)
+        correct = predicted == sample["intent"]
+        for key in ("overall", f"language:{sample['language']}", f"intent:{sample['intent']}"):
+            totals[key] += 1
+            hits[key] += correct
+
+    return {
+        "accuracy": {key: hits[key] / totals[key] for key in sorted(totals)},
+        "predictions": predictions,
+        "predictions_digest": hashlib.sha256("\n".join(predictions).encode()).hexdigest(),
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def run(rounds=7, min_time=0.1, only=None):
+    corpus = load_corpus()
+    results = {}
+    for name, calls in build_benchmarks(corpus).items():
+        if only and name not in only:
+            continue
+        results[name] = measure(calls, rounds, min_time)
+
+    return {
+        "meta": {
+            "created_at": datetime.utcnow().isoformat(),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "corpus_size": len(corpus),
+        },
+        "benchmarks": results,
+        **evaluate_accuracy(corpus),
+    }
+
+
+def compare(baseline, current, threshold=0.20, accuracy_tolerance=0.0):
+    """Return (report lines, regression flag) comparing two result documents"""
+    lines, regressed = [], False
+
+    for name, new in current["benchmarks"].items():
+        old = baseline["benchmarks"].get(name)
+        if not old:
+            lines.append(f"  NEW        {name}: {new['min_us']:.1f} us/call")
+            continue
+        # Gate on the fastest round: it is far less sensitive to scheduler noise than the median
+        for metric, label in (("min_us", "latency"), ("mean_peak_alloc_bytes", "allocations")):
+            change = (new[metric] - old[metric]) / old[metric] if old[metric] else 0.0
+            status = "REGRESSION" if change > threshold else "ok"
+            regressed |= status == "REGRESSION"
+            lines.append(f"  {status:<10} {name} {label}: {old[metric]:.1f} -> {new[metric]:.1f} ({change:+.1%})")
+
+    for key, old_accuracy in baseline["accuracy"].items():
+        new_accuracy = current["accuracy"].get(key, 0.0)
+        if new_accuracy < old_accuracy - accuracy_tolerance:
+            regressed = True
+            lines.append(f"  REGRESSION accuracy {key}: {old_accuracy:.3f} -> {new_accuracy:.3f}")
+    lines.append(f"  accuracy overall: {baseline['accuracy']['overall']:.3f} -> {current['accuracy']['overall']:.3f}")
+
+    if baseline["predictions_digest"] != current["predictions_digest"]:
+        corpus = load_corpus()
+        changed = [
+            (sample, old, new)
+            for sample, old, new in zip(corpus, baseline["predictions"], current["predictions"])
+            if old != new
+        ]
+        lines.append(f"  CHANGED    {len(changed)} classification(s) differ from the baseline:")
+        for sample, old, new in changed:
+            marker = "fixed" if new == sample["intent"] else ("broke" if old == sample["intent"] else "moved")
+            lines.append(f"             [{marker}] {sample['language']} {sample['text']!r}: {old} -> {new}")
+
+    return lines, regressed
+
+
+def print_results(results):
+    print(f"{'benchmark':<34} {'median us':>10} {'min us':>9} {'calls/s':>10} {'peak B/call':>12}")
+    for name, stats in results["benchmarks"].items():
+        print(f"{name:<34} {stats['median_us']:>10.1f} {stats['min_us']:>9.1f} "
+              f"{stats['throughput_per_s']:>10.0f} {stats['mean_peak_alloc_bytes']:>12.0f}")
+    print()
+    for key, value in results["accuracy"].items():
+        print(f"accuracy {key:<30} {value:.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="NLU hot-path microbenchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="Run the benchmarks")
+    run_parser.add_argument("--rounds", type=int, default=7)
+    run_parser.add_argument("--min-time", type=float, default=0.1, help="Minimum seconds per round")
+    run_parser.add_argument("--only", nargs="*", help="Run only these benchmarks")
+    run_parser.add_argument("--output", help="Write results JSON here")
+    run_parser.add_argument("--save", action="store_true", help=f"Overwrite {BASELINE_PATH.name}")
+    run_parser.add_argument("--compare", nargs="?", const=str(BASELINE_PATH), help="Gate against a baseline")
+    run_parser.add_argument("--threshold", type=float, default=0.20)
+
+    compare_parser = commands.add_parser("compare", help="Compare two result files")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=0.20)
+
+    args = parser.parse_args()
+
+    if args.command == "compare":
+        baseline = json.loads(Path(args.baseline).read_text())
+        current = json.loads(Path(args.current).read_text())
+    else:
+        current = run(args.rounds, args.min_time, args.only)
+        print_results(current)
+        for path in filter(None, [args.output, str(BASELINE_PATH) if args.save else None]):
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+            Path(path).write_text(json.dumps(current, indent=2, ensure_ascii=False))
+        if not args.compare:
+            return 0
+        baseline = json.loads(Path(args.compare).read_text())
+
+    lines, regressed = compare(baseline, current, args.threshold)
+    print("\nComparison against baseline:")
+    print("\n".join(lines))
+    return 1 if regressed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
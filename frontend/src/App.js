@@ -15,6 +15,22 @@ import {
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
 
+// Files are streamed to the attachment store first; chat messages reference them by id
+const uploadAttachments = async (attachments) => {
+  const files = attachments.filter((item) => item instanceof File);
+  const references = attachments.filter((item) => !(item instanceof File)).map((item) => item.name || item);
+  if (files.length === 0) return references;
+
+  const form = new FormData();
+  files.forEach((file) => form.append('file', file, file.name));
+  const response = await fetch(`${API}/attachments`, { method: 'POST', body: form });
+  if (!response.ok) {
+    throw new Error(`Attachment upload failed! status: ${response.status}`);
+  }
+  const { attachments: stored } = await response.json();
+  return [...references, ...stored.map((attachment) => attachment.attachment_id)];
+};
+
 // Virtual Front Desk Services Configuration
 const availableServices = [
   {
@@ -254,17 +270,21 @@ function App() {
     ));
 
     try {
+      const attachmentIds = await uploadAttachments(attachments);
+
       // Call the real backend API
       const response = await fetch(`${API}/chat`, {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
+          // One key per turn: a retried request is answered once, not processed twice
+          'Idempotency-Key': `${activeConversationId}-${userMessage.id}`,
         },
         body: JSON.stringify({
           message: content,
           conversation_id: activeConversationId,
           language: currentLanguage,
-          attachments: attachments.map(file => file.name || file)
+          attachments: attachmentIds
         })
       });
 
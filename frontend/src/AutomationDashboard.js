@@ -1,5 +1,19 @@
 import React, { useState, useEffect } from 'react';
 
+// Activity events pushed on /api/automation/events
+const LIVE_ACTIVITY_EVENTS = [
+  'booking_created',
+  'booking_rescheduled',
+  'booking_cancelled',
+  'webhook_delivered',
+  'webhook_error',
+  'email_sent',
+  'sms_sent',
+  'whatsapp_sent',
+  'calendar_event',
+  'reminder_sent'
+];
+
 // n8n Automation Dashboard Component
 export const AutomationDashboard = ({ language }) => {
   const [automationStats, setAutomationStats] = useState({
@@ -57,14 +71,29 @@ export const AutomationDashboard = ({ language }) => {
   useEffect(() => {
     fetchAutomationStats();
     fetchRecentActivity();
-    
-    // Auto-refresh every 30 seconds
-    const interval = setInterval(() => {
-      fetchAutomationStats();
-      fetchRecentActivity();
-    }, 30000);
 
-    return () => clearInterval(interval);
+    if (typeof EventSource === 'undefined') {
+      // No server-sent events: fall back to refreshing every 30 seconds while the tab is visible
+      const interval = setInterval(() => {
+        if (document.hidden) return;
+        fetchAutomationStats();
+        fetchRecentActivity();
+      }, 30000);
+      return () => clearInterval(interval);
+    }
+
+    // Live feed: the server pushes metrics and activity as they happen (reconnects automatically)
+    const source = new EventSource('/api/automation/events');
+    source.addEventListener('metrics', (event) => {
+      setAutomationStats(JSON.parse(event.data));
+    });
+    const addActivity = (event) => {
+      const activity = JSON.parse(event.data);
+      setRecentActivity((current) => [activity, ...current.filter((item) => item.id !== activity.id)].slice(0, 15));
+    };
+    LIVE_ACTIVITY_EVENTS.forEach((type) => source.addEventListener(type, addActivity));
+
+    return () => source.close();
   }, []);
 
   const fetchAutomationStats = async () => {
@@ -167,12 +196,7 @@ export const AutomationDashboard = ({ language }) => {
 
       const result = await response.json();
       alert(`Webhook test ${result.status}: ${result.message}`);
-      
-      // Refresh data after test
-      setTimeout(() => {
-        fetchAutomationStats();
-        fetchRecentActivity();
-      }, 2000);
+      // The resulting booking and webhook events arrive on the live feed
       
     } catch (error) {
       alert(`Webhook test failed: ${error.message}`);
@@ -182,6 +206,9 @@ export const AutomationDashboard = ({ language }) => {
   const getActivityIcon = (type) => {
     switch (type) {
       case 'booking_created': return '📅';
+      case 'booking_rescheduled': return '🔁';
+      case 'booking_cancelled': return '🚫';
+      case 'webhook_delivered': return '🔗';
       case 'email_sent': return '📧';
       case 'sms_sent': return '📱';
       case 'whatsapp_sent': return '💬';
@@ -0,0 +1,44 @@
+import asyncio
+
+import pytest
+
+from server import AnalyticsCache
+
+
+def test_concurrent_misses_share_one_load_and_stale_entries_refresh_in_background():
+    cache = AnalyticsCache({"stats": (60, 600)})
+    calls = []
+
+    async def loader():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {"load": len(calls)}
+
+    async def run():
+        first = await asyncio.gather(*(cache.get("stats", loader) for _ in range(20)))
+        cached = await cache.get("stats", loader)
+
+        cache.expire("stats")
+        stale = await cache.get("stats", loader)  # served immediately, refresh scheduled
+        await asyncio.sleep(0.05)
+        refreshed = await cache.get("stats", loader)
+        return first, cached, stale, refreshed
+
+    first, cached, stale, refreshed = asyncio.run(run())
+    assert first == [{"load": 1}] * 20
+    assert cached == stale == {"load": 1}
+    assert refreshed == {"load": 2}
+    assert len(calls) == 2
+    assert cache.counters["coalesced"] == 19
+
+
+def test_slow_loads_are_cut_off_and_not_cached():
+    cache = AnalyticsCache({"stats": (60, 600)}, timeout=0.01)
+
+    async def slow():
+        await asyncio.sleep(1)
+
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(cache.get("stats", slow))
+    assert cache.snapshot()["entries"] == {}
+    assert cache.counters["errors"] == 1
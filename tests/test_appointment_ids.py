@@ -0,0 +1,74 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import server
+from server import AppointmentIdGenerator, SessionData
+
+
+async def _book(index):
+    """Drive the rule-based booking handler through its final (free-text) step"""
+    session = SessionData(
+        step="booking",
+        booking_step="datetime",
+        selected_service="medical-consultation",
+        collected_info={"name": f"User {index}", "phone": "0501234567"}
+    )
+    result = await server.mistral_service._handle_booking_backend("Sunday at 10:00", session, {}, "en", "sunday at 10:00")
+    return result["booking_data"]["appointment_id"]
+
+
+def _book_batch(indexes):
+    async def run():
+        return await asyncio.gather(*(_book(index) for index in indexes))
+    return asyncio.run(run())
+
+
+def test_parallel_bookings_get_unique_ids():
+    batches = [range(start, start + 1250) for start in range(0, 20000, 1250)]
+    with ThreadPoolExecutor(max_workers=len(batches)) as pool:
+        ids = [appointment_id for batch in pool.map(_book_batch, batches) for appointment_id in batch]
+
+    assert len(set(ids)) == len(ids)
+    assert all(appointment_id.startswith("APT") for appointment_id in ids)
+
+
+def test_ids_are_monotonic_and_sortable_within_a_worker():
+    generator = AppointmentIdGenerator(worker_id=7)
+    ids = [generator.next_id() for _ in range(50000)]
+
+    assert ids == sorted(ids)
+    assert len(set(ids)) == len(ids)
+
+
+def test_workers_sharing_a_clock_never_collide():
+    frozen_clock = lambda: AppointmentIdGenerator.EPOCH_MS + 1_000
+    generators = [AppointmentIdGenerator(worker_id=worker_id, clock=frozen_clock) for worker_id in range(8)]
+
+    def drain(generator):
+        return [generator.next_id() for _ in range(10000)]
+
+    with ThreadPoolExecutor(max_workers=len(generators)) as pool:
+        batches = list(pool.map(drain, generators))
+
+    ids = [appointment_id for batch in batches for appointment_id in batch]
+    assert len(set(ids)) == len(ids)
+    for batch in batches:
+        assert batch == sorted(batch)
+
+
+def test_backwards_clock_stays_monotonic():
+    ticks = iter([AppointmentIdGenerator.EPOCH_MS + 5_000, AppointmentIdGenerator.EPOCH_MS + 4_000])
+    generator = AppointmentIdGenerator(worker_id=1, clock=lambda: next(ticks))
+
+    first, second = generator.next_id(), generator.next_id()
+    assert first < second
+
+
+def test_decode_round_trip():
+    generator = AppointmentIdGenerator(worker_id=42)
+    appointment_id = generator.next_id()
+    decoded = AppointmentIdGenerator.decode(appointment_id)
+
+    assert decoded["worker_id"] == 42
+    assert decoded["sequence"] == 0
+    assert len(appointment_id) == len("APT") + AppointmentIdGenerator.ENCODED_LENGTH
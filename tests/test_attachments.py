@@ -0,0 +1,71 @@
+import asyncio
+import hashlib
+
+import httpx
+from mongomock_motor import AsyncMongoMockClient, enabled_gridfs_integration
+
+import server
+
+
+def test_uploads_stream_into_gridfs_dedupe_and_serve_ranges(monkeypatch):
+    store = server.AttachmentStore(database=AsyncMongoMockClient()["attachments_test"], max_bytes=600 * 1024)
+    monkeypatch.setattr(server, "attachment_store", store)
+    document = bytes(range(256)) * 2048  # 512 KiB, three GridFS chunks
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=server.app), base_url="http://test") as client:
+            def upload(name, content):
+                return client.post("/api/attachments", files={"file": (name, content, "application/pdf")},
+                                   data={"note": "ignored"})
+
+            first = (await upload("id-card.pdf", document)).json()["attachments"][0]
+            again = (await upload("copy.pdf", document)).json()["attachments"][0]
+            too_big = await upload("huge.pdf", document * 2)
+
+            url = f"/api/attachments/{first['attachment_id']}"
+            full = await client.get(url)
+            middle = await client.get(url, headers={"Range": "bytes=261000-262999"})
+            tail = await client.get(url, headers={"Range": "bytes=-10"})
+            outside = await client.get(url, headers={"Range": f"bytes={len(document)}-"})
+            missing = await client.get("/api/attachments/not-an-id")
+            files = await store.database["attachments.files"].count_documents({})
+            chunks = await store.database["attachments.chunks"].count_documents({})
+        return first, again, too_big, full, middle, tail, outside, missing, files, chunks
+
+    with enabled_gridfs_integration():
+        first, again, too_big, full, middle, tail, outside, missing, files, chunks = asyncio.run(run())
+
+    assert first["sha256"] == hashlib.sha256(document).hexdigest() and first["size"] == len(document)
+    assert again["attachment_id"] == first["attachment_id"] and again["deduplicated"] is True
+    assert too_big.status_code == 413
+    assert (files, chunks) == (1, 3)  # the duplicate and the oversized upload left nothing behind
+
+    assert full.content == document and full.headers["etag"] == f'"{first["sha256"]}"'
+    assert middle.status_code == 206 and middle.content == document[261000:263000]
+    assert middle.headers["content-range"] == f"bytes 261000-262999/{len(document)}"
+    assert tail.content == document[-10:]
+    assert outside.status_code == 416 and missing.status_code == 404
+
+
+def test_only_safe_types_are_served_inline(monkeypatch):
+    store = server.AttachmentStore(database=AsyncMongoMockClient()["attachments_test"])
+    monkeypatch.setattr(server, "attachment_store", store)
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=server.app), base_url="http://test") as client:
+            async def round_trip(name, content, content_type):
+                uploaded = await client.post("/api/attachments", files={"file": (name, content, content_type)})
+                return await client.get(f"/api/attachments/{uploaded.json()['attachments'][0]['attachment_id']}")
+
+            return (await round_trip("page.html", b"<script>alert(1)</script>", "text/html"),
+                    await round_trip("logo.svg", b"<svg onload='alert(1)'/>", "image/svg+xml"),
+                    await round_trip("scan.png", b"\x89PNG\r\n\x1a\n", "image/png"))
+
+    with enabled_gridfs_integration():
+        html, svg, png = asyncio.run(run())
+
+    for response in (html, svg):
+        assert response.headers["content-type"] == "application/octet-stream"
+        assert response.headers["content-disposition"].startswith("attachment;")
+    assert png.headers["content-type"] == "image/png" and png.headers["content-disposition"].startswith("inline;")
+    assert all(r.headers["x-content-type-options"] == "nosniff" for r in (html, svg, png))
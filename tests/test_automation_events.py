@@ -0,0 +1,64 @@
+import asyncio
+
+from mongomock_motor import AsyncMongoMockClient
+
+import server
+from server import AutomationEventLog
+
+
+def test_events_feed_counters_recent_activity_and_tail():
+    log = AutomationEventLog(database=AsyncMongoMockClient()["events_test"])
+
+    async def run():
+        await log.ensure_collection()
+        await log.record("booking_created", "New appointment booked", appointment_id="APT1")
+        await log.record("webhook_error", "Booking webhook failed", "error", appointment_id="APT1", workflow="booking")
+        await log.record("webhook_delivered", "Booking workflow notified", appointment_id="APT1", workflow="booking",
+                         details={"status_code": 200})
+
+        tail = log.tail(poll_interval=0.01)
+        pending = asyncio.ensure_future(tail.__anext__())
+        await asyncio.sleep(0.05)
+        await log.record("email_sent", "Confirmation email sent", appointment_id="APT1")
+        tailed = await asyncio.wait_for(pending, 1)
+        await tail.aclose()
+        return await log.counts(), await log.recent(2), await log.recent(5, event_type="booking_created"), tailed
+
+    counts, recent, bookings, tailed = asyncio.run(run())
+    assert counts["booking_created"]["count"] == 1
+    assert counts["webhook:booking"] == {**counts["webhook:booking"], "count": 2, "last_status": "success"}
+    assert [activity["type"] for activity in recent] == ["email_sent", "webhook_delivered"]
+    assert [activity["appointment_id"] for activity in bookings] == ["APT1"]
+    assert tailed["type"] == "email_sent"
+    assert server.event_bus.latest["webhook_delivered"]["type"] == "webhook_delivered"
+
+
+def test_tail_resumes_in_insertion_order_and_relay_needs_a_capped_collection(monkeypatch, caplog):
+    from datetime import datetime, timedelta
+
+    from bson import ObjectId
+
+    log = AutomationEventLog(database=AsyncMongoMockClient()["events_order_test"])
+
+    async def run():
+        await log.record("booking_created", "New appointment booked", appointment_id="APT1")
+        tail = log.tail(poll_interval=0.01)
+        pending = asyncio.ensure_future(tail.__anext__())
+        await asyncio.sleep(0.05)
+        # Another worker's event: inserted later, but with an ObjectId that sorts earlier
+        earlier_id = ObjectId.from_datetime(datetime.utcnow() - timedelta(seconds=5))
+        await log.events.insert_one({"_id": earlier_id, "type": "sms_sent", "message": "SMS sent", "status": "success",
+                                     "created_at": datetime.utcnow(), "source": "other-worker"})
+        tailed = await asyncio.wait_for(pending, 1)
+        await tail.aclose()
+
+        async def not_capped():
+            return False
+        monkeypatch.setattr(log, "is_capped", not_capped)
+        await asyncio.wait_for(log.relay(), 1)
+        return tailed
+
+    tailed = asyncio.run(run())
+    assert tailed["type"] == "sms_sent"
+    assert [r.message for r in caplog.records].count(
+        "automation_events is not a capped collection, cross-worker activity relay disabled") == 1
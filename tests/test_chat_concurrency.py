@@ -0,0 +1,57 @@
+import asyncio
+
+import httpx
+from mongomock_motor import AsyncMongoMockClient
+
+import server
+
+
+def _post_concurrently(monkeypatch, messages):
+    # use() below swaps the process-wide client; monkeypatch puts the original back afterwards
+    monkeypatch.setattr(server.mongo, "_db", None)
+    monkeypatch.setattr(server.mongo, "analytics", None)
+
+    async def run():
+        server.mongo.use(AsyncMongoMockClient()["chat_concurrency_test"])
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=server.app), base_url="http://test") as client:
+            first = await client.post("/api/chat", json={"message": "hello", "language": "en"})
+            conversation_id = first.json()["conversation_id"]
+            responses = await asyncio.gather(*(
+                client.post("/api/chat", json={"message": message, "language": "en", "conversation_id": conversation_id})
+                for message in messages
+            ))
+            stored = await server.mongo.db.conversations.find_one({"id": conversation_id})
+        return responses, stored
+
+    return asyncio.run(run())
+
+
+def test_concurrent_turns_on_one_conversation_keep_every_message(monkeypatch):
+    messages = ["health card renewal", "what documents do I need", "thanks"]
+    process_conversation = server.process_conversation
+
+    async def slow_process_conversation(*args, **kwargs):
+        await asyncio.sleep(0.02)  # stands in for model latency, so the turns overlap
+        return await process_conversation(*args, **kwargs)
+
+    monkeypatch.setattr(server, "process_conversation", slow_process_conversation)
+
+    for use_locks in (True, False):
+        concurrency = server.ConversationConcurrency(max_retries=len(messages), use_locks=use_locks)
+        monkeypatch.setattr(server, "conversation_concurrency", concurrency)
+        responses, stored = _post_concurrently(monkeypatch, messages)
+
+        assert [response.status_code for response in responses] == [200] * len(messages)
+        user_messages = [m["content"] for m in stored["messages"] if m["role"] == "user"]
+        assert sorted(user_messages) == sorted(["hello"] + messages)
+        assert stored["version"] == 1 + len(messages)
+        assert concurrency.counters["saved"] == 1 + len(messages)
+        # Attempts that lost the race leave no trace in the in-memory context
+        history = server.mistral_service.conversation_context[stored["id"]]["conversation_history"]
+        assert sorted(turn["user_input"] for turn in history) == sorted(["hello"] + messages)
+        if use_locks:
+            assert concurrency.counters["conflicts"] == 0
+            assert concurrency.counters["lock_waits"] == len(messages) - 1
+        else:
+            assert concurrency.counters["conflicts"] > 0
+            assert concurrency.counters["retries"] == concurrency.counters["conflicts"]
@@ -0,0 +1,44 @@
+import asyncio
+
+from server import MistralService, SessionData, flow_metrics
+
+
+def turn(service, text, session, language="en"):
+    intent_result = service._fallback_intent_classification(text, language)
+    session.intent = intent_result["intent"]
+    return asyncio.run(service._generate_with_rules(text, session, intent_result, language))
+
+
+def test_service_request_after_welcome_starts_the_flow():
+    service = MistralService()
+    session = turn(service, "hello", SessionData())["session_data"]
+    assert session.step == "intent_detection"
+
+    session = turn(service, "I need to renew my health card", session)["session_data"]
+    assert session.step == "service_selection"
+    assert session.selected_service == "health-card-renewal"
+
+    session = turn(service, "yes please", session)["session_data"]
+    assert (session.step, session.booking_step) == ("booking", "name")
+    assert flow_metrics.transitions[("intent_detection", "service_selection")] >= 1
+
+
+def test_booking_validators_reprompt_without_advancing():
+    service = MistralService()
+    session = SessionData(step="booking", booking_step="name", selected_service="health-card-renewal", intent="x")
+
+    response = turn(service, "12345", session)
+    assert response["session_data"].booking_step == "name"
+    assert "full name" in response["message"]
+
+    session = turn(service, "أحمد محمد", session, "ar")["session_data"]
+    assert session.booking_step == "phone"
+
+    response = turn(service, "call me", session)
+    assert response["session_data"].booking_step == "phone"
+    assert "phone number" in response["message"]
+    assert flow_metrics.states["booking.phone"]["validation_failures"] >= 1
+
+    session = turn(service, "٠٥٠١٢٣٤٥٦٧", session, "ar")["session_data"]
+    assert session.booking_step == "datetime"
+    assert session.collected_info["phone"] == "٠٥٠١٢٣٤٥٦٧"
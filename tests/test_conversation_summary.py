@@ -0,0 +1,46 @@
+import asyncio
+
+import httpx
+from mongomock_motor import AsyncMongoMockClient
+
+import server
+from server import Conversation, ConversationSummarizer, Message, MessageRole, SessionData
+
+
+def test_turns_are_folded_into_a_bounded_summary_used_by_the_prompt(monkeypatch):
+    monkeypatch.setattr(server.mongo, "_db", None)
+    monkeypatch.setattr(server.mongo, "analytics", None)
+
+    async def run():
+        server.mongo.use(AsyncMongoMockClient()["summary_test"])
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=server.app), base_url="http://test") as client:
+            conversation_id = None
+            for message in ["I want to renew my health card", "yes", "Sara Ahmed", "+1 555 123 4567"]:
+                response = await client.post("/api/chat", json={"message": message, "language": "en",
+                                                                "conversation_id": conversation_id})
+                conversation_id = response.json()["conversation_id"]
+        return await server.mongo.db.conversations.find_one({"id": conversation_id})
+
+    stored = asyncio.run(run())
+    summary = stored["summary"]
+    assert summary["covered_messages"] == len(stored["messages"]) == 8
+    assert summary["facts"]["service"] == "health-card-renewal"
+    assert "Selected service: Health Card Renewal" in summary["text"]
+    assert "Customer name: Sara Ahmed" in summary["text"]
+    assert 'First request: "I want to renew my health card"' in summary["text"]
+
+    # However long the conversation gets, the summary and the prompt keep the same size
+    summarizer = ConversationSummarizer(max_chars=300)
+    conversation = Conversation(user_id="u", session_data=SessionData(selected_service="id-card-replacement"))
+    prompt_sizes = []
+    for turn in range(60):
+        conversation.messages += [
+            Message(role=MessageRole.USER, content=f"question number {turn} about my lost id card " * 5),
+            Message(role=MessageRole.ASSISTANT, content="answer", intent="id_card_replacement")
+        ]
+        conversation.summary = summarizer.fold(conversation)
+        context = summarizer.prompt_context(conversation)
+        prompt_sizes.append(len(server.mistral_service._get_response_generation_prompt(conversation.session_data, "en", context)))
+    assert len(conversation.summary.text) <= 300
+    assert conversation.summary.covered_messages == 120
+    assert len(set(prompt_sizes[5:])) == 1
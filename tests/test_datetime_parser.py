@@ -0,0 +1,66 @@
+import time
+from datetime import datetime, timezone
+
+import pytest
+
+from server import DateTimeParser
+
+NOW = datetime(2025, 1, 22, 10, 0, tzinfo=timezone.utc)  # Wednesday
+
+
+@pytest.fixture(scope="module")
+def parser():
+    return DateTimeParser(tz=timezone.utc)
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("January 25th at 2:00 PM", "2025-01-25T14:00:00+00:00"),
+    ("25 يناير في الساعة 2:00 مساءً", "2025-01-25T14:00:00+00:00"),
+    ("غداً الساعة ٣", "2025-01-23T15:00:00+00:00"),
+    ("tomorrow morning", "2025-01-23T09:00:00+00:00"),
+    ("next sunday at 10", "2025-01-26T10:00:00+00:00"),
+    ("الأحد 26/01/2025 الساعة 09:00", "2025-01-26T09:00:00+00:00"),
+    ("2025-02-03 09:20", "2025-02-03T09:20:00+00:00"),
+    ("3pm", "2025-01-22T15:00:00+00:00"),
+    ("9:00", "2025-01-23T09:00:00+00:00"),
+    ("5 January", "2026-01-05T00:00:00+00:00"),
+    ("tomorrow at 3 in the afternoon", "2025-01-23T15:00:00+00:00"),
+    ("tomorrow at 7 in the evening", "2025-01-23T19:00:00+00:00"),
+    ("at 8 tonight", "2025-01-22T20:00:00+00:00"),
+    ("friday at 9:30 at night", "2025-01-24T21:30:00+00:00"),
+    ("tomorrow at 7 in the morning", "2025-01-23T07:00:00+00:00"),
+])
+def test_parses_to_iso(parser, text, expected):
+    assert parser.parse(text, NOW).iso == expected
+
+
+@pytest.mark.parametrize("text", ["hello", "my phone is 0501234567", "مرحبا"])
+def test_non_dates_return_none(parser, text):
+    assert parser.parse(text, NOW) is None
+
+
+def test_reports_granularity(parser):
+    day_only = parser.parse("بعد ٣ أيام", NOW)
+    time_only = parser.parse("at 4:30 pm", NOW)
+
+    assert (day_only.has_date, day_only.has_time) == (True, False)
+    assert (time_only.has_date, time_only.has_time) == (False, True)
+
+
+def test_resolves_in_configured_timezone():
+    riyadh = DateTimeParser(tz=__import__("zoneinfo").ZoneInfo("Asia/Riyadh"))
+    parsed = riyadh.parse("tomorrow at 9:00", NOW)
+
+    assert parsed.iso == "2025-01-23T09:00:00+03:00"
+    assert parsed.utc == datetime(2025, 1, 23, 6, 0)
+
+
+def test_throughput(parser):
+    corpus = ["January 25th at 2:00 PM", "غداً الساعة ٣", "next sunday at 10", "hello there", "26/01 at 9:40"]
+    iterations = 4000
+    started = time.perf_counter()
+    for index in range(iterations):
+        parser.parse(corpus[index % len(corpus)], NOW)
+    per_second = iterations / (time.perf_counter() - started)
+
+    assert per_second > 2000
@@ -0,0 +1,113 @@
+import asyncio
+import io
+import time
+import zipfile
+
+from mongomock_motor import AsyncMongoMockClient, enabled_gridfs_integration
+
+import server
+
+
+def _slow_engine(data):
+    time.sleep(5)
+    return ""
+
+
+def _docx(*paragraphs):
+    namespace = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+    body = "".join(f"<w:p><w:r><w:t>{text}</w:t></w:r></w:p>" for text in paragraphs)
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        archive.writestr("word/document.xml", f'<w:document xmlns:w="{namespace}"><w:body>{body}</w:body></w:document>')
+    return buffer.getvalue()
+
+
+def test_docx_extraction_reads_paragraph_text():
+    assert server._extract_docx(_docx("Health card renewal", "Phone: 0501234567")) == "Health card renewal\nPhone: 0501234567"
+
+
+def test_extraction_jobs_run_in_worker_processes_cache_by_hash_and_time_out(monkeypatch):
+    database = AsyncMongoMockClient()["extraction_test"]
+    store = server.AttachmentStore(database=database)
+    service = server.DocumentExtractionService(database=database, max_workers=1, timeout=0.5, engines=["stub"])
+    monkeypatch.setattr(server, "attachment_store", store)
+    monkeypatch.setitem(server.EXTRACTION_ENGINES, "slow", _slow_engine)
+    letter = b"I need to renew my health card, my phone number is 0501234567"
+
+    async def upload(content, name):
+        async def body():
+            yield (b"--b\r\nContent-Disposition: form-data; name=\"file\"; filename=\"" + name.encode()
+                   + b"\"\r\nContent-Type: image/png\r\n\r\n" + content + b"\r\n--b--\r\n")
+        return (await store.save_multipart("multipart/form-data; boundary=b", body()))[0]["attachment_id"]
+
+    async def wait(job):
+        while job["status"] in ("queued", "running"):
+            await asyncio.sleep(0.02)
+        return job
+
+    async def run():
+        first_id = await upload(letter, "scan.png")
+        first = await wait(await service.submit(first_id))
+        # Same bytes under another name: answered from the hash cache without a worker
+        second = await wait(await service.submit(await upload(letter, "copy.png")))
+        documents = await service.analyses_for([first_id, "not-an-id"])
+
+        service.engines = {"slow"}
+        monkeypatch.setattr(service, "engine_for", lambda content_type, filename="": "slow")
+        slow = await wait(await service.submit(await upload(b"another scan", "slow.png")))
+        service.shutdown()
+        return first, second, documents, slow
+
+    with enabled_gridfs_integration():
+        first, second, documents, slow = asyncio.run(run())
+
+    assert first["status"] == "completed" and first["engine"] == "stub" and not first["cached"]
+    assert first["result"]["analysis"]["intent"] == "health_card_renewal"
+    assert first["result"]["analysis"]["entities"]["phone"] == "0501234567"
+    assert second["cached"] and second["result"]["text"] == letter.decode()
+    assert [document["intent"] for document in documents] == ["health_card_renewal"]
+    assert slow["status"] == "timeout"
+    assert service.counters["cache_hits"] == 1 and service.counters["timeouts"] == 1
+
+
+def test_queued_jobs_read_the_attachment_only_once_a_worker_is_free(monkeypatch):
+    database = AsyncMongoMockClient()["extraction_queue_test"]
+    store = server.AttachmentStore(database=database)
+    service = server.DocumentExtractionService(database=database, max_workers=1, engines=["stub"])
+    monkeypatch.setattr(server, "attachment_store", store)
+    reads = []
+    opened = store.open
+
+    async def open_and_count_reads(attachment_id):
+        grid_out = await opened(attachment_id)
+        original_read = grid_out.read
+
+        async def read(*args):
+            reads.append(attachment_id)
+            return await original_read(*args)
+        grid_out.read = read
+        return grid_out
+    monkeypatch.setattr(store, "open", open_and_count_reads)
+
+    async def upload(content):
+        async def body():
+            yield (b"--b\r\nContent-Disposition: form-data; name=\"file\"; filename=\"note.txt\"\r\n"
+                   b"Content-Type: text/plain\r\n\r\n" + content + b"\r\n--b--\r\n")
+        return (await store.save_multipart("multipart/form-data; boundary=b", body()))[0]["attachment_id"]
+
+    async def run():
+        ids = [await upload(f"health card renewal {index}".encode()) for index in range(3)]
+        async with service._worker_slots:  # every worker busy
+            jobs = [await service.submit(attachment_id) for attachment_id in ids]
+            await asyncio.sleep(0.05)
+            queued = ([job["status"] for job in jobs], list(reads))
+        while any(job["status"] in ("queued", "running") for job in jobs):
+            await asyncio.sleep(0.02)
+        service.shutdown()
+        return queued, jobs
+
+    with enabled_gridfs_integration():
+        (statuses, reads_while_busy), jobs = asyncio.run(run())
+
+    assert statuses == ["queued"] * 3 and reads_while_busy == []
+    assert [job["status"] for job in jobs] == ["completed"] * 3 and len(reads) == 3
@@ -0,0 +1,28 @@
+import json
+
+from server import EventBus
+
+
+def test_events_fan_out_once_and_reconnects_replay_missed_ones():
+    bus = EventBus(history_size=10, queue_size=2)
+    bus.publish("metrics", {"totalBookings": 1})
+    dashboards = [bus.subscribe() for _ in range(3)]
+
+    booked = bus.publish("booking_created", {"message": "Booked"})
+    for queue in dashboards:
+        assert [queue.get_nowait()["type"] for _ in range(2)] == ["metrics", "booking_created"]
+    assert booked["sse"].startswith(f"id: {booked['id']}\nevent: booking_created\ndata: ")
+    assert json.loads(booked["json"])["data"] == {"message": "Booked"}
+
+    # A slow subscriber drops its oldest events instead of blocking the publisher
+    for index in range(3):
+        bus.publish("webhook_delivered", {"index": index})
+    assert [json.loads(dashboards[0].get_nowait()["json"])["data"]["index"] for _ in range(2)] == [1, 2]
+    assert bus.counters["dropped"] == 3
+
+    replay = bus.subscribe(last_event_id=booked["id"] + 1)
+    assert [replay.get_nowait()["id"] for _ in range(replay.qsize())] == [booked["id"] + 2, booked["id"] + 3]
+
+    for queue in dashboards + [replay]:
+        bus.unsubscribe(queue)
+    assert bus.subscriber_count == 0
@@ -0,0 +1,76 @@
+import asyncio
+
+import httpx
+from fastapi import FastAPI
+from mongomock_motor import AsyncMongoMockClient
+
+from server import IdempotencyMiddleware, IdempotencyStore
+
+
+def test_retries_replay_the_stored_response_and_concurrent_duplicates_wait():
+    store = IdempotencyStore(database=AsyncMongoMockClient()["idempotency_test"])
+    app = FastAPI()
+    calls = []
+
+    @app.post("/api/chat")
+    async def chat(payload: dict):
+        calls.append(payload)
+        await asyncio.sleep(0.05)
+        return {"message": f"reply {len(calls)}"}
+
+    app.add_middleware(IdempotencyMiddleware, store=store)
+
+    async def run():
+        await store.ensure_indexes()
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            def post(key, text="hi"):
+                return client.post("/api/chat", json={"text": text}, headers={"Idempotency-Key": key})
+
+            concurrent = await asyncio.gather(*(post("turn-1") for _ in range(3)))
+            retried = await post("turn-1")
+            reused = await post("turn-1", text="something else")
+            other = await post("turn-2")
+            plain = await client.post("/api/chat", json={"text": "hi"})
+        return concurrent, retried, reused, other, plain
+
+    concurrent, retried, reused, other, plain = asyncio.run(run())
+    assert len(calls) == 3  # turn-1 once, turn-2 once, the request without a key
+    assert {response.content for response in concurrent + [retried]} == {b'{"message":"reply 1"}'}
+    assert retried.headers["idempotent-replayed"] == "true"
+    assert sum("idempotent-replayed" in response.headers for response in concurrent) == 2
+    assert reused.status_code == 422
+    assert other.json() == {"message": "reply 2"}
+    assert "idempotent-replayed" not in plain.headers
+    assert store.counters["executed"] == 2
+
+
+def test_same_worker_duplicates_wait_on_the_running_request_instead_of_polling(monkeypatch):
+    store = IdempotencyStore(database=AsyncMongoMockClient()["idempotency_wait_test"])
+    app = FastAPI()
+
+    @app.post("/api/chat")
+    async def chat(payload: dict):
+        await asyncio.sleep(0.3)
+        return {"message": "reply"}
+
+    app.add_middleware(IdempotencyMiddleware, store=store, poll_interval=0.01)
+    lookups = []
+    get = store.get
+
+    async def counted_get(key):
+        lookups.append(key)
+        return await get(key)
+    monkeypatch.setattr(store, "get", counted_get)
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            first = asyncio.ensure_future(client.post("/api/chat", json={}, headers={"Idempotency-Key": "k"}))
+            await asyncio.sleep(0.05)
+            duplicates = await asyncio.gather(*(client.post("/api/chat", json={}, headers={"Idempotency-Key": "k"})
+                                                for _ in range(3)))
+            return await first, duplicates
+
+    first, duplicates = asyncio.run(run())
+    assert all(response.headers.get("idempotent-replayed") == "true" for response in duplicates)
+    assert len(lookups) == 1 + 3  # one lookup each, not one per poll interval
+    assert store.counters["waited"] == 3
@@ -0,0 +1,86 @@
+import numpy as np
+
+from benchmarks.nlu_benchmark import load_corpus
+from server import HashedNgramIntentModel
+
+
+def _train():
+    corpus = load_corpus()
+    texts = [sample["text"] for sample in corpus] * 4
+    labels = [sample["intent"] for sample in corpus] * 4
+    return HashedNgramIntentModel.fit(texts, labels, n_features=2 ** 14, epochs=20), corpus
+
+
+def test_batch_prediction_matches_single_predictions():
+    model, corpus = _train()
+    texts = [sample["text"] for sample in corpus]
+
+    batch = model.predict(texts)
+    singles = [model.predict([text])[0] for text in texts]
+
+    assert [r["intent"] for r in batch] == [r["intent"] for r in singles]
+    assert np.allclose([r["confidence"] for r in batch], [r["confidence"] for r in singles], atol=1e-5)
+    accuracy = np.mean([r["intent"] == sample["intent"] for r, sample in zip(batch, corpus)])
+    assert accuracy > 0.9
+
+
+def test_probabilities_are_calibrated_distributions():
+    model, _ = _train()
+    probabilities = model.predict_proba(["I lost my id card", "مرحبا", "zzz"])
+
+    assert probabilities.shape == (3, len(model.labels))
+    assert np.allclose(probabilities.sum(axis=1), 1.0)
+    assert model.temperature > 0
+
+
+def test_artifact_round_trip(tmp_path):
+    model, _ = _train()
+    loaded = HashedNgramIntentModel.load(model.save(tmp_path / "intent_model.npz"))
+
+    assert loaded.labels == model.labels
+    assert loaded.version == model.version
+    assert np.allclose(loaded.predict_proba(["book a doctor"]), model.predict_proba(["book a doctor"]))
+
+
+def test_training_pipeline_streams_dedupes_and_reports():
+    import argparse
+
+    import mongomock
+    from train_intent_model import run_pipeline
+
+    database = mongomock.MongoClient()["pipeline_test"]
+    corpus = load_corpus()
+    database.conversations.insert_many([
+        {"messages": [
+            {"role": "user", "content": f"{sample['text']} {index % 7}", "language": sample["language"]},
+            {"role": "assistant", "content": "...", "intent": sample["intent"], "confidence": 0.9 if index % 10 else 0.3}
+        ]}
+        for index, sample in enumerate(corpus * 20)
+    ])
+    args = argparse.Namespace(min_confidence=0.8, batch_size=100, since=None, max_per_intent=50, eval_percent=10,
+                              dedupe_bits=2 ** 20, features=2 ** 14, epochs=8, seed=14)
+
+    model, report = run_pipeline(database, args)
+
+    counts = report["counts"]
+    assert counts["conversations"] == len(corpus) * 20
+    assert counts["low_confidence"] == len(corpus) * 2
+    assert counts["duplicates"] > 0
+    assert counts["train_rows"] <= 50 * len(model.labels)
+    assert report["accuracy"] is not None
+    assert set(report["per_intent"]) <= set(model.labels)
+
+
+def test_features_are_sparse_rows_of_normalised_counts():
+    model = HashedNgramIntentModel(["a", "b"], n_features=2 ** 16)
+    texts = ["book a doctor", "", "مرحبا مرحبا"]
+    columns, values, row_starts = model.featurize(texts)
+
+    assert len(row_starts) == len(texts) + 1 and row_starts[-1] == len(columns) == len(values)
+    assert len(columns) < 100  # a dense batch would hold 3 x 65536 floats
+    for row, text in enumerate(texts):
+        dense = np.bincount(model._ngram_indices(text), minlength=model.n_features).astype(np.float32)
+        dense /= np.linalg.norm(dense)
+        stored = np.zeros(model.n_features, dtype=np.float32)
+        stored[columns[row_starts[row]:row_starts[row + 1]]] = values[row_starts[row]:row_starts[row + 1]]
+        assert np.allclose(stored, dense)
@@ -0,0 +1,33 @@
+import os
+import time
+
+from server import AVAILABLE_SERVICES, KnowledgeBase
+
+
+def test_bilingual_answers_grounding_and_incremental_refresh(tmp_path):
+    faq = tmp_path / "faq.en.txt"
+    faq.write_text("[[parking]]\n? Is there parking?\nFree parking is available behind the building.\n", encoding="utf-8")
+    (tmp_path / "faq.ar.txt").write_text("[[parking]]\n? هل يوجد موقف سيارات؟\nيوجد موقف سيارات مجاني خلف المبنى.\n", encoding="utf-8")
+    kb = KnowledgeBase(tmp_path, services=AVAILABLE_SERVICES, check_interval=0)
+
+    answer, hits = kb.answer("is there any parking", "en")
+    assert answer == "Free parking is available behind the building."
+    assert kb.answer("هل يوجد موقف للسيارات", "ar")[0].startswith("يوجد موقف سيارات")
+    assert kb.search("when is medical consultation open", "en")[0]["id"] == "medical-consultation"
+
+    # Ambiguous questions are not answered directly but still return grounding passages
+    answer, hits = kb.answer("what are your working hours", "en")
+    assert answer is None and hits
+    assert kb.search("tell me a joke", "en") == []
+
+    started = time.perf_counter()
+    for _ in range(200):
+        kb.search("how long does the health card renewal take", "en")
+    assert (time.perf_counter() - started) / 200 < 0.001
+
+    faq.write_text("[[parking]]\n? Is there parking?\nParking is closed for works until June.\n", encoding="utf-8")
+    os.utime(faq, ns=(time.time_ns(), time.time_ns() + 10 ** 9))
+    passages = kb.stats()["passages"]
+    assert kb.answer("is there any parking", "en")[0] == "Parking is closed for works until June."
+    assert kb.stats()["passages"] == passages
+    assert kb.answer("هل يوجد موقف للسيارات", "ar")[0].startswith("يوجد موقف سيارات")
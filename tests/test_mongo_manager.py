@@ -0,0 +1,46 @@
+import asyncio
+from types import SimpleNamespace
+
+from mongomock_motor import AsyncMongoMockClient
+from pymongo.read_preferences import Secondary
+
+from server import MongoManager, PoolMetricsListener
+
+
+def test_pool_listener_tracks_checkouts_and_wait_time():
+    listener = PoolMetricsListener()
+    event = SimpleNamespace(address=("localhost", 27017), connection_id=1, reason="timeout")
+
+    for _ in range(3):
+        listener.connection_check_out_started(event)
+        listener.connection_checked_out(event)
+    listener.connection_checked_in(event)
+    listener.connection_check_out_failed(event)
+
+    snapshot = listener.snapshot(max_pool_size=4)
+    assert snapshot["checkouts"] == 3
+    assert snapshot["in_use"] == snapshot["peak_in_use"] - 1 == 2
+    assert snapshot["saturation"] == 0.5
+    assert snapshot["checkout_failures"] == {"timeout": 1}
+    assert sum(snapshot["wait_histogram"].values()) == 3
+
+
+def test_analytics_reads_use_their_own_read_preference():
+    manager = MongoManager("mongodb://localhost", "test", {"compressors": "zstd,unknown,zlib"},
+                           analytics_read_preference="secondary", analytics_max_staleness=120)
+    assert "unknown" not in manager.client_options["compressors"]
+    assert "zlib" in manager.client_options["compressors"]
+
+    manager.connect()  # Motor connects lazily, no server needed to inspect the handles
+    assert manager.analytics.read_preference == Secondary(max_staleness=120)
+    assert manager.db.read_preference.mongos_mode == "primary"
+    manager.close()
+
+    database = manager.use(AsyncMongoMockClient()["test"])
+    assert manager.db is database
+
+    async def run():
+        await manager.db.conversations.insert_one({"status": "completed"})
+        return await manager.analytics.conversations.count_documents({}, maxTimeMS=manager.analytics_max_time_ms)
+
+    assert asyncio.run(run()) == 1
@@ -0,0 +1,21 @@
+import json
+
+from benchmarks.nlu_benchmark import BASELINE_PATH, evaluate_accuracy, load_corpus
+
+
+def test_classifications_match_the_committed_baseline():
+    """Speed work on the NLU path must not silently change classifications.
+
+    If a change is intentional, refresh the baseline with
+    ``python benchmarks/nlu_benchmark.py run --save`` and commit it.
+    """
+    baseline = json.loads(BASELINE_PATH.read_text())
+    current = evaluate_accuracy(load_corpus())
+
+    changed = [
+        (sample["text"], old, new)
+        for sample, old, new in zip(load_corpus(), baseline["predictions"], current["predictions"])
+        if old != new
+    ]
+    assert not changed
+    assert current["accuracy"]["overall"] >= baseline["accuracy"]["overall"]
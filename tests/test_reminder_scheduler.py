@@ -0,0 +1,66 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from mongomock_motor import AsyncMongoMockClient
+
+import server
+from server import AVAILABLE_SERVICES, ReminderScheduler, SlotEngine
+
+START = datetime(2030, 1, 7, 9, 0)
+
+
+def test_only_the_lease_holder_sends_and_failed_sends_are_retried(monkeypatch):
+    delivered = []
+    outcomes = []
+
+    async def deliver(workflow, url, payload, appointment_id=None, timeout=30.0):
+        delivered.append((payload["appointment_id"], payload["reminder_type"]))
+        return outcomes.pop(0) if outcomes else True
+
+    async def record(*args, **kwargs):
+        return None
+
+    monkeypatch.setattr(server, "deliver_webhook", deliver)
+    monkeypatch.setattr(server.automation_events, "record", record)
+    engine = SlotEngine(AVAILABLE_SERVICES, database=AsyncMongoMockClient()["reminders_test"])
+    workers = [ReminderScheduler(engine, "http://n8n/reminders", lease_seconds=60, owner=name) for name in "AB"]
+
+    async def run():
+        await engine.record_unslotted("APT1", "medical-consultation", START, reminder_hours_before=[24, 2])
+        for worker in workers:
+            await worker.sync()
+        first_due = workers[0].next_due()
+
+        # Both workers wake at the same deadline; one lease, one send
+        now = START - timedelta(hours=24)
+        sent = await asyncio.gather(*(worker.fire(worker.pop_due(now)[0], now) for worker in workers))
+
+        # The 2h reminder fails on the first attempt and is retried after the lease runs out
+        now = START - timedelta(hours=2)
+        outcomes.append(False)
+        winner = workers[sent.index(True)]
+        failed = await winner.fire(winner.pop_due(now)[0], now)
+        retry_at = winner.next_due()
+        retried = await winner.fire(winner.pop_due(retry_at)[0], retry_at)
+        return first_due, sent, failed, retry_at, retried, await engine.collection.find_one({"appointment_id": "APT1"})
+
+    first_due, sent, failed, retry_at, retried, appointment = asyncio.run(run())
+    assert first_due == START - timedelta(hours=24)
+    assert sorted(sent) == [False, True]
+    assert failed is False and retried is True
+    assert retry_at == START - timedelta(hours=2) + timedelta(seconds=60)
+    assert delivered == [("APT1", "24h"), ("APT1", "2h"), ("APT1", "2h")]
+    assert appointment["reminders_pending"] == [] and "next_reminder_at" not in appointment
+
+
+def test_reschedule_and_cancel_supersede_heap_entries():
+    scheduler = ReminderScheduler(SlotEngine(AVAILABLE_SERVICES, database=AsyncMongoMockClient()["reminders_test"]),
+                                  lease_seconds=60, sync_interval=60, owner="A")
+    for index in range(5):
+        scheduler.schedule(f"APT{index}", START + timedelta(hours=index))
+    scheduler.schedule("APT0", START + timedelta(hours=10))
+    scheduler.cancel("APT1")
+
+    assert scheduler.next_due() == START + timedelta(hours=2)
+    assert scheduler.pop_due(START + timedelta(hours=10)) == ["APT2", "APT3", "APT4", "APT0"]
+    assert scheduler.next_due() is None and scheduler.entries == {}
@@ -0,0 +1,45 @@
+import os
+
+import pytest
+
+from server import CompiledTemplate, TemplateRegistry, response_templates
+
+
+def write(path, text):
+    path.write_text(text, encoding="utf-8")
+    # Make sure the change is visible even on filesystems with coarse mtimes
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+
+def test_compiled_template_inlines_static_values():
+    template = CompiledTemplate("Hi {name}, we offer:\n{services} {{braces}}", {"services": "A, B"})
+    assert template.fields == {"name"}
+    assert template.render({"name": "Sara"}) == "Hi Sara, we offer:\nA, B {braces}"
+    assert CompiledTemplate("{a} and {b}", {"a": "1", "b": "2"}).static == "1 and 2"
+    with pytest.raises(ValueError):
+        CompiledTemplate("{service.name}")
+
+
+def test_registry_hot_reloads_and_keeps_last_good_set(tmp_path):
+    write(tmp_path / "en.txt", "# comment\n[[greeting.welcome]]\nHello {name}!\n\n[[error.default]]\nOops\n")
+    write(tmp_path / "ar.txt", "[[greeting.welcome]]\nمرحبا {name}!\n")
+    registry = TemplateRegistry(tmp_path, check_interval=0)
+
+    assert registry.render("greeting", "en", "welcome", name="Sara") == "Hello Sara!"
+    assert registry.render("greeting", "ar", "welcome", name="سارة") == "مرحبا سارة!"
+    assert registry.render("error", "ar") == "Oops"  # falls back to English
+
+    write(tmp_path / "en.txt", "[[greeting.welcome]]\nWelcome, {name}.\n")
+    assert registry.render("greeting", "en", "welcome", name="Sara") == "Welcome, Sara."
+    assert registry.version == 2
+
+    write(tmp_path / "en.txt", "[[greeting.welcome]]\nBroken {name.first}\n")
+    assert registry.render("greeting", "en", "welcome", name="Sara") == "Welcome, Sara."
+    assert registry.version == 2
+
+
+def test_shipped_templates_cover_both_languages():
+    keys = {(step, variant) for step, language, variant in response_templates._templates if language == "en"}
+    assert keys == {(step, variant) for step, language, variant in response_templates._templates if language == "ar"}
+    assert "Health Card Renewal" in response_templates.render("service_selection", "en", "services")
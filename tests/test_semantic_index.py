@@ -0,0 +1,69 @@
+import threading
+
+import numpy as np
+
+from server import SemanticIndex
+
+
+def test_nearest_examples_persist_memory_mapped_and_rebuild_on_change(tmp_path):
+    examples = [
+        ("intent", "en", "health_card_renewal", "my health card has expired"),
+        ("intent", "en", "id_card_replacement", "I lost my identity card"),
+        ("intent", "ar", "id_card_replacement", "ضاعت بطاقة الهوية"),
+        ("faq", "en", "faq.en.txt/faq.en:contact/en", "How can I contact you?"),
+    ]
+    path = tmp_path / "semantic_index.npy"
+    index = SemanticIndex(path, examples=lambda: examples)
+    index.load_or_build()
+
+    assert index.classify("my health insurance card expired", "en")["intent"] == "health_card_renewal"
+    assert index.classify("ضاعت بطاقة هويتي", "ar")["intent"] == "id_card_replacement"
+    assert index.classify("what is the weather like", "en") is None
+    assert index.nearest_faq("how do I contact you", "en")["label"] == "faq.en.txt/faq.en:contact/en"
+
+    batch = index.search(["lost identity card", "health card expired"], "en", "intent", k=2)
+    assert [hits[0]["label"] for hits in batch] == ["id_card_replacement", "health_card_renewal"]
+
+    reopened = SemanticIndex(path, examples=lambda: examples)
+    reopened.load_or_build()
+    assert reopened.counters == {**reopened.counters, "loads": 1, "builds": 0}
+    assert isinstance(reopened.matrix, np.memmap) and reopened.matrix.dtype == np.float32
+    assert np.array_equal(reopened.matrix, index.matrix)
+
+    examples.append(("intent", "en", "student_enrollment", "register for classes"))
+    reopened.load_or_build()
+    assert reopened.counters["builds"] == 1
+    assert reopened.classify("register for evening classes", "en")["intent"] == "student_enrollment"
+
+
+def test_stale_index_keeps_serving_while_rebuilding_in_background(tmp_path):
+    examples = [("intent", "en", "health_card_renewal", "my health card has expired")]
+    version, release = [1], threading.Event()
+
+    def current_examples():
+        release.wait(5)
+        return list(examples)
+
+    index = SemanticIndex(tmp_path / "semantic_index.npy", examples=current_examples, source_version=lambda: version[0])
+    assert index.classify("my health card expired", "en") is None  # nothing built yet, the query does not wait
+    release.set()
+    index.builder.join()
+    assert index.classify("my health card expired", "en")["intent"] == "health_card_renewal"
+
+    release.clear()
+    examples.append(("intent", "en", "student_enrollment", "register for classes"))
+    version[0] = 2
+    assert index.classify("register for evening classes", "en") is None
+    assert index.classify("my health card expired", "en")["intent"] == "health_card_renewal"
+    release.set()
+    index.builder.join()
+    assert index.classify("register for evening classes", "en")["intent"] == "student_enrollment"
+    assert index.counters["builds"] == 2
+
+
+def test_nearest_faq_never_answers_a_question_bm25_declined():
+    from server import mistral_service
+
+    # BM25 ties every service on opening hours; the nearest catalogue phrasing must not pick one
+    assert mistral_service._knowledge_answer("ما هي ساعات العمل؟", "ar")[0] is None
+    assert mistral_service._knowledge_answer("What are your working hours?", "en")[0] is None
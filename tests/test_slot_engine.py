@@ -0,0 +1,175 @@
+import asyncio
+from datetime import datetime
+
+from mongomock_motor import AsyncMongoMockClient
+
+from server import AVAILABLE_SERVICES, SessionData, SlotEngine
+import server
+
+NOW = datetime(2030, 1, 6, 6, 0)  # a Sunday, before opening hours
+
+
+def _engine():
+    return SlotEngine(AVAILABLE_SERVICES, database=AsyncMongoMockClient()["slots_test"], horizon_days=7)
+
+
+def test_slots_follow_working_hours_and_days():
+    engine = _engine()
+    service = next(s for s in AVAILABLE_SERVICES if s.id == "id-card-replacement")
+    slots = engine.generate_slots(service, NOW.date(), 7, now=NOW)
+
+    # 08:00-15:00 in 45 minute steps -> 9 slots on each of Sun, Tue, Thu
+    assert len(slots) == 27
+    assert {engine.WEEKDAYS[slot["start"].weekday()] for slot in slots} == {"sunday", "tuesday", "thursday"}
+    assert all(slot["end"].time() <= datetime.strptime("15:00", "%H:%M").time() for slot in slots)
+
+
+def test_nearest_slots_come_back_in_order():
+    async def run():
+        engine = _engine()
+        await engine.materialize(now=NOW)
+        return await engine.find_nearest("medical-consultation", after=NOW, limit=3)
+
+    slots = asyncio.run(run())
+    assert [slot["start"].strftime("%H:%M") for slot in slots] == ["09:00", "09:20", "09:40"]
+
+
+def test_concurrent_reservations_cannot_double_book():
+    async def run():
+        engine = _engine()
+        await engine.materialize(now=NOW)
+        slot_id = SlotEngine.slot_id("medical-consultation", datetime(2030, 1, 1, 9, 0))
+        await engine.collection.insert_one({
+            "_id": slot_id, "service_id": "medical-consultation", "status": "available",
+            "start": datetime(2030, 1, 1, 9, 0), "end": datetime(2030, 1, 1, 9, 20), "appointment_id": None
+        })
+        results = await asyncio.gather(*(engine.reserve(slot_id, f"APT{i}") for i in range(50)))
+        return [result for result in results if result]
+
+    winners = asyncio.run(run())
+    assert len(winners) == 1
+
+
+def test_booking_flow_offers_and_reserves_slots(monkeypatch):
+    engine = _engine()
+    monkeypatch.setattr(server, "slot_engine", engine)
+
+    async def run():
+        await engine.materialize()
+        session = SessionData(step="booking", booking_step="phone", selected_service="medical-consultation",
+                              collected_info={"name": "Sara"})
+        offered = await server.mistral_service._handle_booking_backend("0501234567", session, {}, "en", "0501234567")
+        booked = await server.mistral_service._handle_booking_backend("1", offered["session_data"], {}, "en", "1")
+        stored = await engine.collection.find_one({"_id": booked["session_data"].slot_id})
+        return offered, booked, stored
+
+    offered, booked, stored = asyncio.run(run())
+    assert "1. " in offered["message"]
+    assert booked["trigger_webhook"]
+    assert stored["status"] == "reserved"
+    assert stored["appointment_id"] == booked["booking_data"]["appointment_id"]
+
+
+def test_due_reminders_page_and_advance_once_per_reminder():
+    async def run():
+        engine = _engine()
+        start = datetime(2030, 1, 7, 9, 0)
+        for index in range(3):
+            await engine.record_unslotted(f"APT{index}", "medical-consultation", start, reminder_hours_before=[24, 2])
+
+        due = datetime(2030, 1, 6, 10, 0)  # past the 24h reminder, before the 2h one
+        first = await engine.due_reminders(now=due, limit=2)
+        rest = await engine.due_reminders(now=due, limit=2, after=first["next_cursor"])
+
+        advanced = await engine.mark_reminder_sent("APT0", {"reminder_type": "24h"}, now=due)
+        repeated = await engine.mark_reminder_sent("APT0", {"reminder_type": "24h"}, now=due)
+        after_sent = await engine.due_reminders(now=due)
+        unknown = await engine.mark_reminder_sent("APT9", now=due)
+        return first, rest, advanced, repeated, after_sent, unknown
+
+    first, rest, advanced, repeated, after_sent, unknown = asyncio.run(run())
+    assert [a["appointment_id"] for a in first["appointments"] + rest["appointments"]] == ["APT0", "APT1", "APT2"]
+    assert rest["next_cursor"] is None
+
+    appointment, was_advanced = advanced
+    assert was_advanced and appointment["reminders_pending"] == [2]
+    assert appointment["next_reminder_at"] == datetime(2030, 1, 7, 7, 0)
+    assert repeated[1] is False and len(repeated[0]["reminders_sent"]) == 1
+    assert [a["appointment_id"] for a in after_sent["appointments"]] == ["APT1", "APT2"]
+    assert unknown is None
+
+
+def test_releasing_an_unslotted_appointment_cancels_it_instead_of_offering_it():
+    async def run():
+        engine = _engine()
+        await engine.materialize(now=NOW)
+        await engine.record_unslotted("APT1", "medical-consultation", datetime(2030, 1, 7, 9, 5))
+        released = await engine.release("APT1")
+        offered = await engine.find_nearest("medical-consultation", after=NOW, limit=50)
+        stored = await engine.collection.find_one({"_id": "medical-consultation#APT1"})
+        reserved = await engine.reserve("medical-consultation#APT1", "APT2")
+        return released, offered, stored, reserved
+
+    released, offered, stored, reserved = asyncio.run(run())
+    assert released
+    assert all(SlotEngine.is_slot_id(slot["_id"]) for slot in offered)
+    assert stored["status"] == "cancelled" and "next_reminder_at" not in stored
+    assert reserved is None
+
+
+def test_rescheduling_a_slot_booking_moves_it_to_the_new_slot():
+    old_start, new_start = datetime(2030, 1, 7, 9, 0), datetime(2030, 1, 7, 10, 20)
+    old_id = SlotEngine.slot_id("medical-consultation", old_start)
+    new_id = SlotEngine.slot_id("medical-consultation", new_start)
+
+    async def run():
+        engine = _engine()
+        await engine.materialize(now=NOW)
+        await engine.reserve(old_id, "APT1", customer_info={"name": "Sara"}, language="ar",
+                             notification_preferences={"sms": True}, reminder_hours_before=[2])
+        await engine.reserve(SlotEngine.slot_id("medical-consultation", datetime(2030, 1, 7, 10, 40)), "APT2")
+        moved = await engine.reschedule("APT1", new_start, now=NOW)
+        taken = await engine.reschedule("APT1", datetime(2030, 1, 7, 10, 40), now=NOW)
+        offered = await engine.find_nearest("medical-consultation", after=NOW, limit=50)
+        await engine.release("APT1")
+        at_new_time = await engine.collection.count_documents({"start": new_start, "status": "available"})
+        return moved, taken, offered, at_new_time
+
+    (moved, was_moved), (unchanged, was_taken), offered, at_new_time = asyncio.run(run())
+    assert was_moved and moved["_id"] == new_id and moved["status"] == "reserved"
+    assert moved["customer_info"] == {"name": "Sara"} and moved["language"] == "ar"
+    assert moved["notification_preferences"] == {"sms": True}
+    assert moved["next_reminder_at"] == datetime(2030, 1, 7, 8, 20)
+    assert was_taken is False and unchanged["_id"] == new_id
+
+    offered_ids = [slot["_id"] for slot in offered]
+    assert old_id in offered_ids and new_id not in offered_ids
+    assert at_new_time == 1
+
+
+def test_reminder_view_has_every_field_the_reminder_workflow_reads():
+    import json
+    import re
+    from pathlib import Path
+
+    workflow = (Path(__file__).resolve().parent.parent / "n8n-workflows" / "reminder-automation.json").read_text(encoding="utf-8")
+    computed = {"appointments", "hoursUntil", "reminderType", "messageTemplate"}  # set by the workflow itself
+    paths = {path for path in re.findall(r"\$json((?:\.\w+)+)", workflow) if path.split(".")[1] not in computed}
+
+    async def run():
+        engine = _engine()
+        await engine.materialize(now=NOW)
+        slot = await engine.reserve(SlotEngine.slot_id("medical-consultation", datetime(2030, 1, 7, 9, 0)), "APT1",
+                                    customer_info={"name": "Sara", "phone": "0501234567"},
+                                    notification_preferences={"sms": True, "whatsapp": False})
+        return json.loads(json.dumps(engine.reminder_view(slot)))
+
+    view = asyncio.run(run())
+    assert {".service.name.ar", ".location.address", ".customer_info.phone"} <= paths
+    for path in paths:
+        value = view
+        for key in path.split(".")[1:]:
+            assert isinstance(value, dict) and key in value, path
+            value = value[key]
+    assert view["service"]["name"]["en"] == "Medical Consultation"
+    assert view["location"]["address"] == "MIND14 Service Center"
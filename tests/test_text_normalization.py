@@ -0,0 +1,84 @@
+import asyncio
+import os
+
+os.environ.setdefault("MISTRAL_ENABLED", "false")
+
+import httpx
+from mongomock_motor import AsyncMongoMockClient
+
+import server
+from server import language_detector, mistral_service, normalize_text
+
+
+def test_folds_arabic_spelling_variants():
+    assert normalize_text("أهلاً") == normalize_text("اهلا") == "اهلا"
+    assert normalize_text("إستبدال") == "استبدال"
+    assert normalize_text("مستشفى") == "مستشفي"
+    assert normalize_text("البطاقة الصحيّة") == "البطاقه الصحيه"
+    assert normalize_text("مـــرحبا") == "مرحبا"
+
+
+def test_unifies_digits_case_and_whitespace():
+    assert normalize_text("  Call ME\t on ٠٥٠١٢٣٤٥٦٧ ") == "call me on 0501234567"
+    assert normalize_text("۱۲:۳۰") == "12:30"
+
+
+def test_variants_classify_the_same():
+    for first, second in (("أهلا", "اهلاً"), ("أحتاج هوية جديدة", "احتاج هويه جديده")):
+        assert (mistral_service._fallback_intent_classification(first, "ar")["intent"]
+                == mistral_service._fallback_intent_classification(second, "ar")["intent"])
+
+
+def test_entities_use_ascii_digits():
+    entities = mistral_service._extract_entities("رقمي ٠٥٠١٢٣٤٥٦٧", "ar")
+    assert entities["phone"] == "0501234567"
+
+
+def test_language_detection_by_script():
+    assert language_detector.detect("مرحبا، أريد تجديد البطاقة الصحية")["language"] == "ar"
+    assert language_detector.detect("I need to renew my health card", fallback="ar")["language"] == "en"
+    # Brand names and abbreviations inside Arabic text do not flip the language
+    detection = language_detector.detect("أريد استبدال بطاقة ID")
+    assert detection["language"] == "ar" and not detection["mixed"]
+
+
+def test_text_without_letters_keeps_the_fallback_language():
+    detection = language_detector.detect("٠٥٠١٢٣٤٥٦٧", fallback="ar")
+    assert detection == {"language": "ar", "method": "fallback", "arabic_ratio": None, "mixed": False, "letters": 0}
+    assert language_detector.detect("2", fallback="fr")["language"] == "en"
+
+
+def test_mixed_input_is_classified_against_both_tables():
+    text = "please أريد تجديد البطاقة الصحية"
+    detection = language_detector.detect(text)
+    assert detection["mixed"]
+    result = asyncio.run(mistral_service.classify_intent(text, "en", detection))
+    assert result["intent"] == "health_card_renewal"
+    assert result["metadata"]["language_detection"] == detection
+
+
+def test_names_and_short_replies_do_not_switch_the_conversation_language(monkeypatch):
+    detect = language_detector.detect
+    assert language_detector.conversation_language(detect("Ahmed Ali"), "ar") == "ar"
+    assert language_detector.conversation_language(detect("ok"), "ar") == "ar"
+    assert language_detector.conversation_language(detect("I would like to speak English please"), "ar") == "en"
+    assert language_detector.conversation_language(detect("I would like to speak English please"), "ar", free_text=False) == "ar"
+
+    monkeypatch.setattr(server.mongo, "_db", None)
+    monkeypatch.setattr(server.mongo, "analytics", None)
+
+    async def run():
+        server.mongo.use(AsyncMongoMockClient()["language_switch_test"])
+        replies, conversation_id = [], None
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=server.app), base_url="http://test") as client:
+            for message in ["أريد تجديد البطاقة الصحية", "نعم", "Ahmed Ali", "0501234567"]:
+                response = await client.post("/api/chat", json={"message": message, "language": "ar",
+                                                                "conversation_id": conversation_id})
+                conversation_id = response.json()["conversation_id"]
+                replies.append(response.json()["message"])
+        return replies, await server.mongo.db.conversations.find_one({"id": conversation_id})
+
+    replies, stored = asyncio.run(run())
+    assert all(language_detector.detect(reply)["language"] == "ar" for reply in replies)
+    assert stored["language"] == "ar"
+    assert stored["messages"][4]["metadata"]["language_detection"]["language"] == "en"
@@ -0,0 +1,57 @@
+import asyncio
+import gzip
+import json
+
+import httpx
+
+from server import AVAILABLE_SERVICES, BookingData, WebhookDispatcher
+
+
+def _booking(appointment_id):
+    return {
+        **BookingData(appointment_id=appointment_id, service=AVAILABLE_SERVICES[0], customer_info={"name": "Sara"},
+                      language="en", timestamp="2030-01-01T09:00:00", conversation_id="C1").dict(),
+        "webhook_type": "booking_created",
+        "system_info": {"source": "MIND14 Virtual Front Desk", "version": "2.0"}
+    }
+
+
+def test_compact_payloads_are_gzipped_and_batched_with_per_event_status():
+    requests = []
+
+    def handler(request):
+        body = json.loads(gzip.decompress(request.content))
+        requests.append((request.headers.get("content-encoding"), body))
+        rejected = body["batch"][1]["event_id"]
+        return httpx.Response(200, json={"results": [
+            {"event_id": event["event_id"], "status": "error" if event["event_id"] == rejected else "ok"}
+            for event in body["batch"]
+        ]})
+
+    dispatcher = WebhookDispatcher(payload_version=2, gzip_min_bytes=1, batch_interval=5, batch_max_events=3,
+                                   transport=httpx.MockTransport(handler))
+
+    async def run():
+        results = await asyncio.gather(*(dispatcher.send("http://n8n/booking", _booking(f"APT{i}")) for i in range(3)))
+        await dispatcher.close()
+        return results
+
+    results = asyncio.run(run())
+    assert len(requests) == 1 and requests[0][0] == "gzip"
+    events = requests[0][1]["batch"]
+    assert [event["appointment_id"] for event in events] == ["APT0", "APT1", "APT2"]
+    assert events[0]["service_id"] == AVAILABLE_SERVICES[0].id
+    assert {"service", "system_info", "priority", "status", "location"}.isdisjoint(events[0])
+    assert [result["ok"] for result in results] == [True, False, True]
+    assert dispatcher.counters["bytes_sent"] < dispatcher.counters["bytes_uncompressed"]
+
+
+def test_version_1_sends_payloads_unchanged_one_post_each():
+    bodies = []
+    dispatcher = WebhookDispatcher(payload_version=1, gzip_min_bytes=0, batch_interval=0,
+                                   transport=httpx.MockTransport(lambda request: bodies.append(json.loads(request.content))
+                                                                 or httpx.Response(500)))
+    payload = _booking("APT1")
+    result = asyncio.run(dispatcher.send("http://n8n/booking", payload))
+    assert bodies == [json.loads(json.dumps(payload))]
+    assert result["ok"] is False and result["error_type"] == "HTTPStatusError"